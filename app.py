@@ -1,19 +1,204 @@
-from flask import Flask, render_template, request, jsonify, send_file  # type: ignore
+from flask import Flask, Request, Response, render_template, request, jsonify, send_from_directory, url_for, stream_with_context, current_app, g  # type: ignore
 import os
-import uuid
+import hashlib
+import mimetypes
+import re
+import shutil
+from functools import partial
 from werkzeug.utils import secure_filename  # type: ignore
-from image_converter import convert_image, check_imagemagick
+from werkzeug.middleware.proxy_fix import ProxyFix  # type: ignore
+from image_converter import convert_image, convert_image_multi, pillow_can_write, RESPONSIVE_WIDTHS, PLUGIN_FORMATS, resolve_encoder_options, supported_encoder_options, InvalidEncoderOptions, ENCODER_OPTIONS
+from capabilities import cached_capabilities, get_capabilities, imagemagick_can_write, probe_in_background
+from result_cache import ResultCache, hash_stream, make_key
+from jobs import JobQueue, QueueFull
+from janitor import Janitor
+from batch import get_executor, iter_batch_zip
+from sniff import SniffingStream, UploadRejected
+from ratelimit import RateLimiter, retry_after_header
+from assets import EncodedBody, StaticAssets
+import metrics
 import tempfile
 
-app = Flask(__name__)
+# Single-file upload endpoints whose files are vetted while they stream in
+SNIFFED_ENDPOINTS = {'upload_file', 'upload_multi'}
+
+class SpooledRequest(Request):
+    """Keep small uploads in memory and spill larger ones to UPLOAD_FOLDER"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint in SNIFFED_ENDPOINTS and filename and not allowed_file(filename):
+            raise UploadRejected('File type not allowed', status=400)
+        spool = tempfile.SpooledTemporaryFile(
+            max_size=app.config['SPOOL_MAX_MEMORY'],
+            mode='rb+',
+            dir=app.config['UPLOAD_FOLDER']
+        )
+        if self.endpoint in SNIFFED_ENDPOINTS and filename:
+            # Vet the header as it streams in so bad files are refused early
+            return SniffingStream(spool, filename)
+        return spool
+
+    @property
+    def max_content_length(self):
+        # Batch uploads carry many files, so they get their own limit
+        if self.endpoint == 'batch_convert':
+            return current_app.config['BATCH_MAX_CONTENT_LENGTH']
+        return super().max_content_length
+
+# static/ is served from memory by static_file() below
+app = Flask(__name__, static_folder=None)
+app.request_class = SpooledRequest
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['BATCH_MAX_CONTENT_LENGTH'] = int(os.environ.get('BATCH_MAX_CONTENT_LENGTH', 1024 * 1024 * 1024))
+app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+app.config['SPOOL_MAX_MEMORY'] = int(os.environ.get('SPOOL_MAX_MEMORY', 2 * 1024 * 1024))  # larger uploads go to disk
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'outputs'
+app.config['RESULT_CACHE_MAX_BYTES'] = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+app.config['RESULT_CACHE_DB'] = os.environ.get('RESULT_CACHE_DB', os.path.join(tempfile.gettempdir(), 'formatly-result-cache.sqlite3'))
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', os.cpu_count() or 1))
+app.config['JOB_MAX_PENDING'] = int(os.environ.get('JOB_MAX_PENDING', app.config['JOB_WORKERS'] * 4))
+app.config['JOB_TIMEOUT'] = int(os.environ.get('JOB_TIMEOUT', 60))  # seconds per conversion
+app.config['JOB_DB'] = os.environ.get('JOB_DB', os.path.join(tempfile.gettempdir(), 'formatly-jobs.sqlite3'))
+app.config['FILE_TTL'] = int(os.environ.get('FILE_TTL', 3600))  # seconds before outputs/uploads are deleted
+app.config['DISK_QUOTA'] = int(os.environ.get('DISK_QUOTA', 1024 * 1024 * 1024))  # outputs + uploads
+app.config['JANITOR_INTERVAL'] = int(os.environ.get('JANITOR_INTERVAL', 60))  # seconds, 0 disables
+# Let the front proxy stream downloads: '' (serve from Flask), 'x-accel' (nginx) or 'x-sendfile' (Apache/lighttpd)
+app.config['DOWNLOAD_HANDOFF'] = os.environ.get('DOWNLOAD_HANDOFF', '').lower()
+app.config['X_ACCEL_PREFIX'] = os.environ.get('X_ACCEL_PREFIX', '/protected-outputs/')  # nginx internal location
+app.config['USE_X_SENDFILE'] = app.config['DOWNLOAD_HANDOFF'] == 'x-sendfile'
+app.config['MULTI_MAX_OUTPUTS'] = int(os.environ.get('MULTI_MAX_OUTPUTS', 16))  # per /upload/multi request
+app.config['RATE_LIMIT'] = float(os.environ.get('RATE_LIMIT', 2))  # conversion requests per second per client, 0 disables
+app.config['RATE_LIMIT_BURST'] = int(os.environ.get('RATE_LIMIT_BURST', 20))
+app.config['MAX_INFLIGHT'] = int(os.environ.get('MAX_INFLIGHT', (os.cpu_count() or 1) * 8))  # per host, 0 disables
+app.config['RATE_LIMIT_DB'] = os.environ.get('RATE_LIMIT_DB', os.path.join(tempfile.gettempdir(), 'formatly-ratelimit.sqlite3'))
+# Comma-separated X-API-Key values that get their own rate limit bucket; other keys are ignored
+app.config['API_KEYS'] = {key.strip() for key in os.environ.get('API_KEYS', '').split(',') if key.strip()}
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))  # X-Forwarded-For hops to trust for client IPs
+# /readyz fails below this much free disk for uploads/ or outputs/, or once the job queue is this full
+app.config['READY_MIN_FREE_BYTES'] = int(os.environ.get('READY_MIN_FREE_BYTES', 256 * 1024 * 1024))
+app.config['READY_MAX_QUEUE'] = float(os.environ.get('READY_MAX_QUEUE', 0.9))  # share of JOB_MAX_PENDING
+
+if app.config['TRUSTED_PROXIES']:
+    # Behind a proxy, remote_addr would otherwise be the proxy for every client
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
 
 # Ensure directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
+# Converted outputs are content-addressed so repeat conversions skip decoding
+result_cache = ResultCache(app.config['OUTPUT_FOLDER'], app.config['RESULT_CACHE_DB'], app.config['RESULT_CACHE_MAX_BYTES'])
+
+# Conversions run in a bounded process pool; job state is shared via SQLite
+job_queue = JobQueue(
+    app.config['JOB_DB'],
+    max_workers=app.config['JOB_WORKERS'],
+    max_pending=app.config['JOB_MAX_PENDING'],
+    timeout=app.config['JOB_TIMEOUT']
+)
+
+# Expired and over-quota files are swept in the background; the result
+# cache must forget outputs the janitor deletes
+def forget_outputs(paths):
+    output_folder = os.path.abspath(app.config['OUTPUT_FOLDER'])
+    result_cache.discard(*[os.path.basename(p) for p in paths if os.path.dirname(p) == output_folder])
+
+janitor = Janitor(
+    [app.config['OUTPUT_FOLDER'], app.config['UPLOAD_FOLDER']],
+    ttl=app.config['FILE_TTL'],
+    max_bytes=app.config['DISK_QUOTA'],
+    interval=app.config['JANITOR_INTERVAL'],
+    on_remove=forget_outputs
+)
+
+@app.before_request
+def start_janitor():
+    janitor.start()
+
+@app.before_request
+def start_capability_probe():
+    # ImageMagick is probed in the background; nothing on the request path waits for it
+    probe_in_background()
+
+# Conversion requests are rate limited per client and capped host-wide;
+# state is shared through SQLite so every gunicorn worker agrees
+rate_limiter = RateLimiter(
+    app.config['RATE_LIMIT_DB'],
+    rate=app.config['RATE_LIMIT'],
+    burst=app.config['RATE_LIMIT_BURST'],
+    max_inflight=app.config['MAX_INFLIGHT']
+)
+LIMITED_ENDPOINTS = {'upload_file', 'upload_multi', 'batch_convert'}
+
+def client_id():
+    """Rate limit key: the API key if it is one of API_KEYS, else the client IP"""
+    api_key = request.headers.get('X-API-Key')
+    if api_key and api_key in app.config['API_KEYS']:
+        return 'key:' + hashlib.sha256(api_key.encode()).hexdigest()
+    return 'ip:' + (request.remote_addr or '')
+
+@app.before_request
+def admission_control():
+    # Runs before the view touches request.files, so refused bodies are never read
+    if request.endpoint not in LIMITED_ENDPOINTS:
+        return None
+    if ADMITTED_KEY in request.environ:
+        # The ASGI front end already admitted this request before buffering its body
+        g.admission_slot = request.environ.pop(ADMITTED_KEY)
+        return None
+    with metrics.timed('admission'):
+        retry_after = rate_limiter.consume(client_id())
+        if retry_after:
+            metrics.REJECTIONS.inc(reason='rate_limited')
+            return busy_response('Too many requests. Please slow down.', retry_after)
+        slot = rate_limiter.admit()
+        if slot is None:
+            metrics.REJECTIONS.inc(reason='overloaded')
+            return busy_response('The server is overloaded. Please try again shortly.', 5, status=503)
+    g.admission_slot = slot
+
+@app.teardown_request
+def release_admission(exc):
+    # For streamed batches this runs once the archive has been sent
+    rate_limiter.release(g.pop('admission_slot', None))
+
+# Environ keys set by check_before_body() for the real request
+ADMITTED_KEY = 'formatly.admission_slot'
+MAX_BODY_KEY = 'formatly.max_content_length'
+
+def check_before_body(environ):
+    """
+    Run the checks that don't need the request body, for front ends (asgi.py)
+    that buffer the body before calling the app.
+
+    Returns:
+        A response to send instead, or None to go on. The admission slot and
+        the body size limit are left in environ; call release_unused() if
+        the request never reaches the app.
+    """
+    if app.config['TRUSTED_PROXIES']:
+        # Resolve the client IP the same way the wrapped wsgi_app will (in place)
+        ProxyFix(lambda _environ, _start_response: None, x_for=app.config['TRUSTED_PROXIES'])(environ, None)
+    with app.request_context(environ):
+        response = admission_control()
+        if response is not None:
+            return app.make_response(response)
+        environ[MAX_BODY_KEY] = request.max_content_length
+        if 'admission_slot' in g:
+            environ[ADMITTED_KEY] = g.pop('admission_slot')
+    return None
+
+def release_unused(environ):
+    """Give back the slot of a request abandoned between check_before_body() and the app"""
+    rate_limiter.release(environ.pop(ADMITTED_KEY, None))
+
+# Saturation gauges are read at scrape time
+metrics.QUEUE_DEPTH.set_function(lambda: job_queue.pending())
+metrics.WORKERS_BUSY.set_function(lambda: job_queue.running())
+metrics.WORKER_UTILIZATION.set_function(lambda: job_queue.running() / job_queue.max_workers)
+metrics.INFLIGHT.set_function(lambda: rate_limiter.inflight())
+
 # All supported output formats
 ALL_FORMATS = [
     'JPEG', 'JPG', 'PNG', 'GIF', 'BMP', 'TIFF', 'WEBP', 'HEIC', 'RAW', 'PSD', 'EXR', 'ICO', 'SVG', 'EPS', 'PDF', 'AI', 'CDR', 'APNG', 'SVGZ', 'DDS', 'TGA', 'JFIF', 'AVIF', 'PIC', 'XCF', 'DNG', 'PCX'
@@ -22,21 +207,284 @@ ALL_FORMATS = [
 # Accept all as output, but restrict uploads to common image types
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'webp', 'heic', 'raw', 'psd', 'exr', 'ico', 'svg', 'eps', 'pdf', 'ai', 'cdr', 'apng', 'svgz', 'dds', 'tga', 'jfif', 'avif', 'pic', 'xcf', 'dng', 'pcx'}
 
+# Conversion outputs are named <cache key>.<ext>
+CONTENT_ADDRESSED_NAME = re.compile(r'^([0-9a-f]{64})\.[a-z0-9]+$')
+
+# /upload/multi output spec: FORMAT, or FORMAT@WxH to fit within a box (W or H may be empty)
+OUTPUT_SPEC = re.compile(r'^([A-Z0-9]+)(?:@(\d*)[xX](\d*))?$')
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+class ConversionError(Exception):
+    pass
+
+def encoder_settings(form, output_format=None):
+    """
+    Read the optional preset and encoder option fields of an upload form.
+    
+    Options are validated against output_format if one is given.
+    
+    Returns:
+        (preset, encoder_options); raises InvalidEncoderOptions if invalid
+    """
+    preset = form.get('preset') or None
+    encoder_options = {}
+    for name, (kind, _, _) in ENCODER_OPTIONS.items():
+        value = form.get(name, '').strip().lower()
+        if not value:
+            continue
+        if kind is bool:
+            if value not in ('true', 'false', '1', '0', 'on', 'off'):
+                raise InvalidEncoderOptions(f"'{name}' must be true or false")
+            encoder_options[name] = value in ('true', '1', 'on')
+        else:
+            try:
+                encoder_options[name] = int(value)
+            except ValueError:
+                raise InvalidEncoderOptions(f"'{name}' must be a whole number")
+    # Validate against the target format before any work is queued
+    if output_format:
+        resolve_encoder_options(output_format, preset, encoder_options)
+    elif preset is not None:
+        resolve_encoder_options('', preset)
+    return preset, encoder_options
+
+def conversion_result(filename, original_name, actual_format, output_format, cached=False):
+    forced_png = (actual_format == 'PNG' and output_format != 'PNG')
+    return {
+        'success': True,
+        'filename': filename,
+        'original_name': original_name,
+        'output_format': actual_format,
+        'forced_png': forced_png,
+        'forced_message': 'The requested format is not supported. Your file was converted to PNG instead.' if forced_png else None,
+        'cached': cached
+    }
+
+def conversion_error_message(output_format):
+    """Explain why a conversion to `output_format` failed"""
+    if not pillow_can_write(output_format):
+        imagemagick_available = get_capabilities()['command'] is not None
+        if not imagemagick_available:
+            return f'Conversion to {output_format} requires ImageMagick, which is not installed. Please install ImageMagick or try a different format.'
+        elif not imagemagick_can_write(output_format):
+            return f'The installed ImageMagick cannot write {output_format}. Please try a different format.'
+        else:
+            return f'Conversion to {output_format} failed. The format might not be supported or the input file might be corrupted.'
+    return 'Conversion failed. The input file might be corrupted or unsupported.'
+
+def finish_conversion(cache_key, original_name, output_format, input_size, value):
+    """Turn convert_image's return value into the job result, caching the output"""
+    success, actual_format, actual_filename = value
+    if not success:
+        metrics.record_conversion(original_name, output_format, False)
+        raise ConversionError(conversion_error_message(output_format))
+    # Check if the output file was actually created
+    if not (actual_filename and os.path.exists(actual_filename)):
+        raise ConversionError('Conversion completed but output file not found')
+    metrics.record_conversion(original_name, output_format, True, input_size, os.path.getsize(actual_filename))
+    with metrics.timed('save'):
+        result_cache.put(cache_key, actual_filename, actual_format)
+    janitor.track(actual_filename)
+    return conversion_result(os.path.basename(actual_filename), original_name, actual_format, output_format)
+
+def parse_output_specs(values):
+    """
+    Parse /upload/multi output specs such as 'WEBP' or 'JPEG@800x600'.
+    
+    Returns:
+        List of (format, size) where size is a (max_width, max_height) box or
+        None; raises ValueError if a spec is invalid
+    """
+    specs = []
+    for value in values:
+        for item in value.split(','):
+            item = item.strip().upper()
+            if not item:
+                continue
+            match = OUTPUT_SPEC.match(item)
+            if not match or match.group(1) not in ALL_FORMATS:
+                raise ValueError(f"Invalid output '{item}'")
+            size = None
+            if match.group(2) is not None:
+                size = (int(match.group(2) or 0), int(match.group(3) or 0))
+                if size == (0, 0):
+                    raise ValueError(f"Output '{item}' needs a width or a height")
+            if (match.group(1), size) not in specs:
+                specs.append((match.group(1), size))
+    return specs
+
+def output_cache_key(content_hash, output_format, preset, encoder_options, size=None):
+    # Unsized outputs share their cache entries with /upload
+    options = {'preset': preset, **supported_encoder_options(output_format, encoder_options)}
+    if size:
+        options['size'] = list(size)
+    return make_key(content_hash, output_format, options)
+
+def multi_output_result(filename, original_name, actual_format, output_format, size, dimensions, cached=False):
+    result = conversion_result(filename, original_name, actual_format, output_format, cached)
+    del result['original_name']
+    result.update({'requested_format': output_format, 'max_size': list(size) if size else None,
+                   'dimensions': dimensions})
+    return result
+
+def finish_multi(original_name, input_size, results, pending, manifest):
+    """Merge convert_image_multi's manifest into the cached results, caching new outputs"""
+    for (index, cache_key, output_format, size), entry in zip(pending, manifest):
+        actual_filename = entry.get('output')
+        if not entry['success'] or not (actual_filename and os.path.exists(actual_filename)):
+            metrics.record_conversion(original_name, output_format, False)
+            results[index] = {'success': False, 'requested_format': output_format,
+                              'max_size': list(size) if size else None,
+                              'error': entry.get('error') or conversion_error_message(output_format)}
+            continue
+        metrics.record_conversion(original_name, output_format, True, input_size, os.path.getsize(actual_filename))
+        with metrics.timed('save'):
+            result_cache.put(cache_key, actual_filename, entry['actual_format'], dimensions=entry['size'])
+        janitor.track(actual_filename)
+        results[index] = multi_output_result(os.path.basename(actual_filename), original_name, entry['actual_format'],
+                                             output_format, size, entry['size'])
+    return {
+        'success': all(result['success'] for result in results),
+        'original_name': original_name,
+        'outputs': results
+    }
+
+def parse_widths(value):
+    """
+    Parse /upload's widths field: comma-separated pixel widths or 'responsive'.
+    
+    Returns:
+        Sorted list of widths; raises ValueError if invalid
+    """
+    if value.strip().lower() == 'responsive':
+        return list(RESPONSIVE_WIDTHS)
+    try:
+        widths = {int(item) for item in value.split(',') if item.strip()}
+    except ValueError:
+        raise ValueError("'widths' must be whole numbers separated by commas, or 'responsive'")
+    if not widths or min(widths) < 1:
+        raise ValueError("'widths' must be positive")
+    return sorted(widths)
+
+def finish_derivatives(*args):
+    """finish_multi for /upload with widths: the full-size output plus its derivatives"""
+    result = finish_multi(*args)
+    main = result['outputs'][0]
+    if not main['success']:
+        raise ConversionError(main['error'])
+    return dict(main, original_name=result['original_name'], derivatives=result['outputs'][1:])
+
+def job_status(job):
+    status = {'job_id': job['id'], 'state': job['state']}
+    if job['state'] == 'done':
+        status.update(job['result'])
+    elif job['state'] == 'failed':
+        status['error'] = job['error']
+    return status
+
+def busy_response(message='The server is busy. Please try again in a few seconds.', retry_after=5, status=429):
+    response = jsonify({'error': message})
+    response.headers['Retry-After'] = retry_after_header(retry_after)
+    return response, status
+
+@app.errorhandler(UploadRejected)
+def upload_rejected(e):
+    return jsonify({'error': e.message}), e.status
+
+# CSS and JS are served under fingerprinted URLs that browsers cache for good
+static_assets = StaticAssets(os.path.join(app.root_path, 'static'))
+app.jinja_env.globals['asset_url'] = static_assets.url
+
+# The page only varies with ImageMagick availability, so each version is
+# rendered once and then served from memory, pre-compressed
+index_pages = {}
+
 @app.route('/')
 def index():
-    # Check if ImageMagick is available
-    imagemagick_available = check_imagemagick() is not None
-    return render_template('index.html', all_formats=ALL_FORMATS, imagemagick_available=imagemagick_available)
+    # Until the first probe finishes, don't warn about a missing ImageMagick
+    capabilities = cached_capabilities()
+    imagemagick_available = capabilities is None or capabilities['command'] is not None
+    page = index_pages.get(imagemagick_available)
+    if page is None or app.debug:
+        if app.debug:
+            static_assets.refresh()
+        html = render_template('index.html', all_formats=ALL_FORMATS, imagemagick_available=imagemagick_available)
+        page = index_pages[imagemagick_available] = EncodedBody(html.encode(), 'text/html')
+    return page.respond(request)
+
+@app.route('/static/<path:filename>')
+def static_file(filename):
+    response = static_assets.respond(filename, request)
+    if response is None:
+        return jsonify({'error': 'File not found'}), 404
+    return response
+
+def submit_multi(file, specs, preset, encoder_options, finish=finish_multi):
+    """
+    Queue a convert_image_multi job for the (format, size) specs not already cached.
+    
+    `finish` shapes the job result; it receives finish_multi's arguments.
+    """
+    try:
+        content_hash = hash_stream(file.stream)
+        results = [None] * len(specs)
+        pending = []
+        outputs = []
+        for index, (output_format, size) in enumerate(specs):
+            cache_key = output_cache_key(content_hash, output_format, preset, encoder_options, size)
+            cached = result_cache.get(cache_key)
+            if cached:
+                cached_path = os.path.join(app.config['OUTPUT_FOLDER'], cached['filename'])
+                os.utime(cached_path)
+                janitor.track(cached_path)
+                results[index] = multi_output_result(cached['filename'], file.filename, cached['format'], output_format,
+                                                     size, cached.get('dimensions'), cached=True)
+                continue
+            pending.append((index, cache_key, output_format, size))
+            outputs.append({
+                'format': output_format,
+                'output': os.path.join(app.config['OUTPUT_FOLDER'], f"{cache_key}.{output_format.lower()}"),
+                'size': size
+            })
+        if not pending:
+            return jsonify(finish(file.filename, 0, results, [], []))
+        
+        data = file.read()
+        try:
+            job_id = job_queue.submit(
+                convert_image_multi, data, outputs,
+                input_name=file.filename, preset=preset, encoder_options=encoder_options,
+                on_result=partial(finish, file.filename, len(data), results, pending)
+            )
+        except QueueFull:
+            return busy_response()
+        
+        if request.args.get('wait'):
+            job = job_queue.wait(job_id)
+            if job['state'] == 'done':
+                return jsonify(job['result'])
+            return jsonify({'error': job['error'] or 'Conversion is still running', 'job_id': job_id}), 500
+        
+        return jsonify({
+            'job_id': job_id,
+            'state': 'queued',
+            'status_url': url_for('get_job', job_id=job_id)
+        }), 202
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    if 'file' not in request.files:
+    # The multipart body is read and parsed on first access
+    with metrics.timed('receive'):
+        files = request.files
+    if 'file' not in files:
         return jsonify({'error': 'No file part'}), 400
     
-    file = request.files['file']
+    file = files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     
@@ -48,77 +496,264 @@ def upload_file():
         return jsonify({'error': 'Invalid output format'}), 400
     
     try:
-        # Generate unique filename
-        file_id = str(uuid.uuid4())
-        original_ext = file.filename.rsplit('.', 1)[1].lower()
-        input_filename = f"{file_id}.{original_ext}"
-        output_filename = f"{file_id}.{output_format.lower()}"
-        
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
+        preset, encoder_options = encoder_settings(request.form, output_format)
+    except InvalidEncoderOptions as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if request.form.get('widths'):
+        # Responsive derivatives are produced alongside the full-size output in one job
+        try:
+            widths = parse_widths(request.form['widths'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if len(widths) >= app.config['MULTI_MAX_OUTPUTS']:
+            return jsonify({'error': f"At most {app.config['MULTI_MAX_OUTPUTS'] - 1} widths per request"}), 400
+        specs = [(output_format, None)] + [(output_format, (width, 0)) for width in widths]
+        return submit_multi(file, specs, preset, encoder_options, finish=finish_derivatives)
+    
+    try:
+        # Repeat conversions of the same bytes are served from the result cache
+        cache_key = make_key(hash_stream(file.stream), output_format, {'preset': preset, **encoder_options})
+        cached = result_cache.get(cache_key)
+        if cached:
+            # Restart the TTL so the janitor doesn't delete it before the download
+            cached_path = os.path.join(app.config['OUTPUT_FOLDER'], cached['filename'])
+            os.utime(cached_path)
+            janitor.track(cached_path)
+            return jsonify(conversion_result(cached['filename'], file.filename, cached['format'], output_format, cached=True))
+
+        # Outputs are named after the cache key
+        output_filename = f"{cache_key}.{output_format.lower()}"
         output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
         
-        # Save uploaded file
-        file.save(input_path)
-        
-        # Convert to selected format
-        success, actual_format, actual_filename = convert_image(input_path, output_path, output_format)
-        
-        if success:
-            # Clean up input file
-            os.remove(input_path)
-            
-            # Check if the output file was actually created
-            if actual_filename and os.path.exists(actual_filename):
-                forced_png = (actual_format == 'PNG' and output_format != 'PNG')
-                return jsonify({
-                    'success': True,
-                    'filename': os.path.basename(actual_filename),
-                    'original_name': file.filename,
-                    'output_format': actual_format,
-                    'forced_png': forced_png,
-                    'forced_message': 'The requested format is not supported. Your file was converted to PNG instead.' if forced_png else None
-                })
-            else:
-                return jsonify({'error': 'Conversion completed but output file not found'}), 500
-        else:
-            if os.path.exists(input_path):
-                os.remove(input_path)
-            from image_converter import pillow_can_write
-            if not pillow_can_write(output_format):
-                imagemagick_available = check_imagemagick() is not None
-                if not imagemagick_available:
-                    return jsonify({
-                        'error': f'Conversion to {output_format} requires ImageMagick, which is not installed. Please install ImageMagick or try a different format.'
-                    }), 500
-                else:
-                    return jsonify({'error': f'Conversion to {output_format} failed. The format might not be supported or the input file might be corrupted.'}), 500
-            else:
-                return jsonify({'error': 'Conversion failed. The input file might be corrupted or unsupported.'}), 500
+        # Hand the upload to the worker pool; the client polls /jobs/<id>
+        data = file.read()
+        try:
+            job_id = job_queue.submit(
+                convert_image, data, output_path, output_format,
+                input_name=file.filename, preset=preset, encoder_options=encoder_options,
+                on_result=partial(finish_conversion, cache_key, file.filename, output_format, len(data))
+            )
+        except QueueFull:
+            return busy_response()
+
+        # ?wait=1 keeps the old synchronous behaviour for API clients
+        if request.args.get('wait'):
+            job = job_queue.wait(job_id)
+            if job['state'] == 'done':
+                return jsonify(job['result'])
+            return jsonify({'error': job['error'] or 'Conversion is still running', 'job_id': job_id}), 500
+
+        return jsonify({
+            'job_id': job_id,
+            'state': 'queued',
+            'status_url': url_for('get_job', job_id=job_id)
+        }), 202
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/upload/multi', methods=['POST'])
+def upload_multi():
+    """Convert one upload to several formats and sizes, decoding it once"""
+    with metrics.timed('receive'):
+        files = request.files
+    file = files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    
+    try:
+        specs = parse_output_specs(request.form.getlist('outputs'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not specs:
+        return jsonify({'error': 'No outputs requested'}), 400
+    if len(specs) > app.config['MULTI_MAX_OUTPUTS']:
+        return jsonify({'error': f"At most {app.config['MULTI_MAX_OUTPUTS']} outputs per request"}), 400
+    
+    try:
+        # Each output gets the options its format supports; an option no
+        # requested format can use is a mistake worth reporting
+        preset, encoder_options = encoder_settings(request.form)
+        formats = {output_format for output_format, _ in specs}
+        for name in encoder_options:
+            if not any(supported_encoder_options(fmt, {name: None}) for fmt in formats):
+                raise InvalidEncoderOptions(f"None of the requested formats support the '{name}' option")
+        for fmt in formats:
+            resolve_encoder_options(fmt, preset, supported_encoder_options(fmt, encoder_options))
+    except InvalidEncoderOptions as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return submit_multi(file, specs, preset, encoder_options)
+
+@app.route('/batch', methods=['POST'])
+def batch_convert():
+    with metrics.timed('receive'):
+        files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+    
+    rejected = [f.filename for f in files if not allowed_file(f.filename)]
+    if rejected:
+        return jsonify({'error': 'File type not allowed', 'files': rejected}), 400
+    
+    output_format = request.form.get('output_format', 'PNG').upper()
+    if output_format not in ALL_FORMATS:
+        return jsonify({'error': 'Invalid output format'}), 400
+    
+    try:
+        preset, encoder_options = encoder_settings(request.form, output_format)
+    except InvalidEncoderOptions as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Stream the archive out as conversions finish instead of buffering it
+    executor = get_executor(app.config['BATCH_WORKERS'])
+    return Response(
+        stream_with_context(iter_batch_zip(files, output_format, executor, preset=preset, encoder_options=encoder_options)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=converted_{output_format.lower()}.zip'}
+    )
+
+@app.route('/healthz')
+def healthz():
+    # Liveness only: no template, no probes, no disk or database access
+    return jsonify({'status': 'ok'})
+
+def readiness():
+    """
+    Check whether this instance should get new conversions.
+
+    Only cached or in-memory state is read (plus a statvfs per folder and
+    one SQLite count), so orchestrators can poll it often.
+
+    Returns:
+        (ready, report dict)
+    """
+    problems = []
+    capabilities = cached_capabilities()
+    backend = {
+        'imagemagick': capabilities['command'] if capabilities else None,
+        'imagemagick_version': capabilities['version'] if capabilities else None,
+        'probed': capabilities is not None,
+        'codecs': sorted(PLUGIN_FORMATS),
+    }
+    disk = {'quota_free_bytes': max(0, app.config['DISK_QUOTA'] - janitor.total_bytes())}
+    for key in ('UPLOAD_FOLDER', 'OUTPUT_FOLDER'):
+        name = os.path.basename(os.path.normpath(app.config[key]))
+        try:
+            free = shutil.disk_usage(app.config[key]).free
+        except OSError:
+            free = 0
+        disk[f'{name}_free_bytes'] = free
+        if free < app.config['READY_MIN_FREE_BYTES']:
+            problems.append(f'{name} is low on disk space')
+    pending = job_queue.pending()
+    queue = {
+        'pending': pending,
+        'running': job_queue.running(),
+        'max_pending': job_queue.max_pending,
+        'workers': job_queue.max_workers,
+        'saturation': round(pending / job_queue.max_pending, 3),
+        'inflight': rate_limiter.inflight() if rate_limiter.max_inflight else None,
+        'max_inflight': rate_limiter.max_inflight or None,
+    }
+    if queue['saturation'] >= app.config['READY_MAX_QUEUE']:
+        problems.append('job queue is saturated')
+    if queue['max_inflight'] and queue['inflight'] >= queue['max_inflight']:
+        problems.append('host is at its in-flight request limit')
+    return not problems, {'ready': not problems, 'problems': problems, 'backend': backend, 'disk': disk, 'queue': queue}
+
+@app.route('/readyz')
+def readyz():
+    ready, report = readiness()
+    response = jsonify(report)
+    response.headers['Cache-Control'] = 'no-store'
+    return response, 200 if ready else 503
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job_status(job))
+
+def accel_redirect_response(filename, etag):
+    """Hand the download to nginx, which also handles Range and conditional requests"""
+    if etag and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = app.config['X_ACCEL_PREFIX'] + filename
+        response.headers['Content-Disposition'] = f'attachment; filename="converted_{filename}"'
+    if etag:
+        response.set_etag(etag)
+    return response
+
 @app.route('/download/<filename>')
 def download_file(filename):
+    if not CONTENT_ADDRESSED_NAME.match(filename):
+        # Only conversion outputs are served, never other files in the folder
+        return jsonify({'error': 'File not found'}), 404
+    # A hash of the output bytes, so it is safe for If-Range; outputs the
+    # cache has forgotten fall back to werkzeug's size/mtime ETag
+    etag = result_cache.content_hash(filename)
+    if request.headers.get('If-Range', '').startswith('W/'):
+        # Weak validators can't guard a Range (RFC 9110 13.1.5) but werkzeug
+        # strips the W/, so send the whole file
+        request.environ.pop('HTTP_RANGE', None)
     try:
-        return send_file(
-            os.path.join(app.config['OUTPUT_FOLDER'], filename),
-            as_attachment=True,
-            download_name=f"converted_{filename}"
-        )
+        if app.config['DOWNLOAD_HANDOFF'] == 'x-accel':
+            if not os.path.isfile(os.path.join(app.config['OUTPUT_FOLDER'], filename)):
+                return jsonify({'error': 'File not found'}), 404
+            response = accel_redirect_response(filename, etag)
+        else:
+            # Werkzeug answers If-None-Match with 304 and Range with 206 itself,
+            # except with X-Sendfile, where the front-end server sends the
+            # body and so has to handle Range too
+            response = send_from_directory(
+                os.path.abspath(app.config['OUTPUT_FOLDER']),
+                filename,
+                as_attachment=True,
+                download_name=f"converted_{filename}",
+                etag=etag or True,
+                conditional=not app.config['USE_X_SENDFILE']
+            )
+            # Werkzeug only advertises ranges once a client has sent one
+            response.headers.setdefault('Accept-Ranges', 'bytes')
+        # The name stays the same if the output is converted again, so
+        # clients revalidate instead of caching it as immutable
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 404
 
 @app.route('/cleanup/<filename>', methods=['DELETE'])
 def cleanup_file(filename):
+    if not CONTENT_ADDRESSED_NAME.match(filename):
+        return jsonify({'error': 'File not found'}), 404
     try:
         file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
+        result_cache.discard(filename)
+        janitor.forget(file_path)
         if os.path.exists(file_path):
             os.remove(file_path)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Counters are per process; scrape each gunicorn worker or sum in Prometheus
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     # Production settings
     port = int(os.environ.get('PORT', 5001))
@@ -0,0 +1,213 @@
+"""
+ASGI entry point, for serving many slow or idle clients per process:
+
+    uvicorn asgi:app --workers 4
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+
+The Flask app in app.py serves every route, unchanged. Request bodies are
+received on the event loop and the app only runs, in a bounded thread pool,
+once the whole body has arrived; downloads are sent from the event loop
+too. A client on a slow link therefore holds a socket and a buffer rather
+than a thread. Conversions still run in the job queue's process pool, so
+throughput stays bounded by cores.
+"""
+import asyncio
+import contextvars
+import io
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import RequestEntityTooLarge  # type: ignore
+from werkzeug.wsgi import FileWrapper  # type: ignore
+import app as formatly
+
+CHUNK_SIZE = 64 * 1024
+
+
+class AsyncFileWrapper(FileWrapper):
+    """wsgi.file_wrapper whose files the adapter sends itself, off the app's threads"""
+
+
+def build_environ(scope):
+    """WSGI environ for an ASGI http scope; wsgi.input is filled in once the body has arrived"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': AsyncFileWrapper,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def read_chunk(file):
+    """Next chunk of file, or None at the end"""
+    return file.read(CHUNK_SIZE) or None
+
+
+class AsgiAdapter:
+    """
+    Serve a WSGI app over ASGI.
+
+    Everything that touches the app (admission checks, the view, iterating
+    streamed responses such as /batch archives) runs in `threads` threads,
+    each call in the request's own context so Flask's context locals follow
+    it from thread to thread. Waiting on the client never does.
+    """
+
+    def __init__(self, wsgi_app, threads=None):
+        self.wsgi_app = wsgi_app
+        # Enough for a ?wait=1 request waiting on every job the queue accepts, plus quick routes
+        threads = threads or int(os.environ.get('ASGI_THREADS', formatly.app.config['JOB_MAX_PENDING'] + 8))
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        # Websockets aren't served; returning makes the server refuse them
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Let requests still in the pool finish
+                await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+
+        def call(fn, *args):
+            return loop.run_in_executor(self.executor, context.run, fn, *args)
+
+        environ = build_environ(scope)
+        # Refuse before reading (and before sending 100 Continue), as under gunicorn
+        early = await call(formatly.check_before_body, environ)
+        if early is not None:
+            await self.respond(early, environ, send, call)
+            return
+        body = await self.receive_body(environ, receive)
+        if body is None:
+            # Client went away mid-upload
+            await call(formatly.release_unused, environ)
+            return
+        if isinstance(body, RequestEntityTooLarge):
+            await call(formatly.release_unused, environ)
+            await self.respond(body.get_response(environ), environ, send, call)
+            return
+        try:
+            environ['wsgi.input'] = body
+            await self.respond(self.wsgi_app, environ, send, call, receive)
+        finally:
+            body.close()
+
+    async def receive_body(self, environ, receive):
+        """
+        Buffer the request body, spilling large ones to UPLOAD_FOLDER.
+
+        Returns:
+            The body file, RequestEntityTooLarge if it goes over the limit
+            check_before_body() set, or None if the client disconnected
+        """
+        limit = environ.get(formatly.MAX_BODY_KEY)
+        declared = environ.get('CONTENT_LENGTH', '')
+        if limit is not None and declared.isdigit() and int(declared) > limit:
+            return RequestEntityTooLarge()
+        body = tempfile.SpooledTemporaryFile(max_size=formatly.app.config['SPOOL_MAX_MEMORY'], mode='w+b',
+                                             dir=formatly.app.config['UPLOAD_FOLDER'])
+        size = 0
+        more = True
+        while more:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if limit is not None and size > limit:
+                body.close()
+                return RequestEntityTooLarge()
+            body.write(chunk)
+            more = message.get('more_body', False)
+        body.seek(0)
+        if not declared:
+            # Chunked upload: tell the app where the body ends
+            environ['CONTENT_LENGTH'] = str(size)
+        return body
+
+    async def respond(self, wsgi_app, environ, send, call, receive=None):
+        """Run wsgi_app in the pool and send its response, stopping early if the client disconnects"""
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+
+        iterable = await call(wsgi_app, environ, start_response)
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive)) if receive else None
+        try:
+            status, headers = started
+            await send({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers],
+            })
+            if isinstance(iterable, AsyncFileWrapper):
+                # Plain downloads: read the file in the loop's default pool, not the app's
+                loop = asyncio.get_running_loop()
+                read = lambda: loop.run_in_executor(None, read_chunk, iterable.file)
+            else:
+                iterator = iter(iterable)
+                read = lambda: call(next, iterator, None)
+            while not (disconnected and disconnected.done()):
+                chunk = await read()
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if disconnected:
+                disconnected.cancel()
+            if hasattr(iterable, 'close'):
+                # Ends stream_with_context responses, which runs their teardown
+                await call(iterable.close)
+
+    async def wait_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+
+app = AsgiAdapter(formatly.app)
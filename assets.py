@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from flask import Response  # type: ignore
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+# Long enough to never expire in practice; fingerprinted URLs change with their content
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Below this, compression saves less than the headers it costs
+MIN_COMPRESS_BYTES = 512
+
+COMPRESSORS = {'gzip': lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+if brotli is not None:
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=11)
+# Server preference when the client accepts several equally
+ENCODING_PREFERENCE = ('br', 'gzip')
+
+
+class EncodedBody:
+    """
+    A response body kept in memory with its compressed encodings.
+
+    Each encoding is made the first time a client asks for it and kept, and
+    only if it is smaller than the original. Every encoding gets its own
+    strong ETag.
+    """
+
+    def __init__(self, data, mimetype):
+        self.data = data
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(data).hexdigest()[:32]
+        self._encoded = {'identity': data}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding):
+        """The body in encoding, or None if it isn't worth compressing"""
+        with self._lock:
+            if encoding not in self._encoded:
+                data = None
+                if len(self.data) >= MIN_COMPRESS_BYTES:
+                    data = COMPRESSORS[encoding](self.data)
+                self._encoded[encoding] = data if data is not None and len(data) < len(self.data) else None
+            return self._encoded[encoding]
+
+    def negotiate(self, accept_encodings):
+        """Pick the best encoding from a werkzeug Accept header, falling back to identity"""
+        for encoding in sorted((e for e in ENCODING_PREFERENCE if e in COMPRESSORS),
+                               key=lambda e: -accept_encodings[e]):
+            if accept_encodings[encoding] and self.encoded(encoding) is not None:
+                return encoding
+        return 'identity'
+
+    def respond(self, request, immutable=False):
+        """
+        Response for request: the negotiated encoding, or 304 if the client's copy is current.
+
+        Immutable bodies are cached for a year without revalidation; others
+        must be revalidated with their ETag on every use.
+        """
+        encoding = self.negotiate(request.accept_encodings)
+        response = Response(self.encoded(encoding), mimetype=self.mimetype)
+        response.vary.add('Accept-Encoding')
+        if encoding != 'identity':
+            response.content_encoding = encoding
+        response.set_etag(self.etag if encoding == 'identity' else f"{self.etag}-{encoding}")
+        response.cache_control.public = True
+        if immutable:
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+class StaticAssets:
+    """
+    Files in `folder` served from memory under content-fingerprinted names.
+
+    url('formatly.css') is '/static/formatly.<hash>.css'; that URL changes
+    whenever the file does, so it can be cached forever. The plain name is
+    still served, but has to be revalidated. Files are read on first use;
+    refresh() picks up edits.
+    """
+
+    def __init__(self, folder, url_prefix='/static/'):
+        self.folder = folder
+        self.url_prefix = url_prefix
+        self._names = None
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        names = {}
+        for root, _, files in os.walk(self.folder):
+            for filename in files:
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                base, ext = os.path.splitext(name)
+                body = EncodedBody(data, mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+                names[name] = f"{base}.{body.etag[:12]}{ext}"
+                self._bodies[name] = self._bodies[names[name]] = body
+        return names
+
+    def _ensure(self):
+        with self._lock:
+            if self._names is None:
+                self._names = self._scan()
+            return self._names
+
+    def refresh(self):
+        with self._lock:
+            self._bodies = {}
+            self._names = None
+
+    def url(self, name):
+        """Fingerprinted URL for name; unknown names get their plain URL"""
+        return self.url_prefix + self._ensure().get(name, name)
+
+    def respond(self, name, request):
+        """Response for a request for name (fingerprinted or plain), or None if there is no such file"""
+        names = self._ensure()
+        body = self._bodies.get(name)
+        if body is None:
+            return None
+        return body.respond(request, immutable=name not in names)
@@ -0,0 +1,120 @@
+import os
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from werkzeug.utils import secure_filename  # type: ignore
+from image_converter import convert_image_bytes
+import metrics
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(max_workers=None):
+    """Shared process pool for batch conversions, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count())
+        return _executor
+
+
+class ChunkWriter:
+    """Write-only file object that collects bytes until they are drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def archive_name(filename, output_format, actual_format, used_names):
+    """
+    Build a unique, safe name inside the ZIP for a converted file.
+
+    Directory components from folder uploads are kept, each sanitised.
+    """
+    parts = [secure_filename(part) for part in filename.replace('\\', '/').split('/')]
+    parts = [part for part in parts if part] or ['image']
+    stem = parts[-1].rsplit('.', 1)[0] if '.' in parts[-1] else parts[-1]
+    if actual_format == output_format or {actual_format, output_format} == {'JPEG', 'JPG'}:
+        ext = output_format.lower()
+    else:
+        ext = actual_format.lower()
+    base = '/'.join(parts[:-1] + [stem])
+    name = f"{base}.{ext}"
+    counter = 1
+    while name in used_names:
+        name = f"{base}_{counter}.{ext}"
+        counter += 1
+    used_names.add(name)
+    return name
+
+
+def iter_batch_zip(files, output_format, executor, window=None, preset=None, encoder_options=None):
+    """
+    Convert uploads in parallel and yield a ZIP archive as it is built.
+
+    At most `window` conversions are in flight so only that many inputs and
+    outputs are held in memory. Results are added in completion order, and
+    failures are listed in an errors.txt entry at the end.
+
+    Args:
+        files: werkzeug FileStorage objects
+        output_format: Target format shared by every file
+        executor: Process pool to run convert_image_bytes in
+        window: Maximum number of conversions in flight
+        preset, encoder_options: Passed through to convert_image
+    """
+    window = window or (executor._max_workers * 2)
+    writer = ChunkWriter()
+    used_names = set()
+    errors = []
+    pending = {}
+    remaining = iter(files)
+
+    def submit_next():
+        for file in remaining:
+            data = file.read()
+            future = executor.submit(metrics.call_collected, convert_image_bytes, data, output_format,
+                                     input_name=file.filename, preset=preset, encoder_options=encoder_options)
+            pending[future] = (file.filename, len(data))
+            return True
+        return False
+
+    # Image payloads are already compressed, so don't spend CPU deflating them
+    with zipfile.ZipFile(writer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        while len(pending) < window and submit_next():
+            pass
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename, size = pending.pop(future)
+                try:
+                    (success, actual_format, data), samples = future.result()
+                    metrics.merge(samples)
+                except Exception as e:
+                    success, actual_format, data = False, None, None
+                    print(f"Batch conversion error for {filename}: {e}")
+                metrics.record_conversion(filename, output_format, success, size, len(data) if success else 0)
+                if success:
+                    archive.writestr(archive_name(filename, output_format, actual_format, used_names), data)
+                else:
+                    errors.append(filename)
+                submit_next()
+            chunk = writer.drain()
+            if chunk:
+                yield chunk
+        if errors:
+            archive.writestr('errors.txt', 'Could not convert:\n' + '\n'.join(errors) + '\n')
+    yield writer.drain()
@@ -0,0 +1,286 @@
+"""
+Conversion benchmark: latency, throughput, peak memory and output size for
+every input x output format pair on a synthetic corpus.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --output new.json --compare bench.json --threshold 0.2
+    python benchmark.py --formats AVIF HEIC --routes native imagemagick
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+import PIL
+from PIL import Image  # type: ignore
+from capabilities import get_capabilities
+from image_converter import convert_image, FORMAT_REGISTRY, PILLOW_FORMATS, PLUGIN_FORMATS
+
+SIZES = {
+    'small': (64, 64),
+    'medium': (640, 480),
+    'large': (1920, 1080),
+}
+
+# Formats the corpus is written in, i.e. the input side of the matrix
+INPUT_FORMATS = ['JPEG', 'PNG', 'GIF', 'BMP', 'TIFF', 'WEBP', 'TGA', 'PCX', 'ICO']
+
+
+def synthetic_image(size, mode):
+    """Gradient plus noise, so encoders see realistic, not flat, content"""
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 40)
+    rgb = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    if mode == 'RGB':
+        return rgb
+    if mode == 'RGBA':
+        rgba = rgb.copy()
+        rgba.putalpha(Image.radial_gradient('L').resize(size))
+        return rgba
+    if mode == 'L':
+        return rgb.convert('L')
+    if mode == 'P':
+        return rgb.quantize(256)
+    raise ValueError(f"Unsupported corpus mode {mode}")
+
+
+def build_corpus(sizes, modes, input_formats):
+    """
+    Encode each synthetic image in every input format that accepts its mode.
+
+    Returns:
+        List of dicts with 'input', 'size', 'mode' and encoded 'data'
+    """
+    corpus = []
+    for size_name in sizes:
+        for mode in modes:
+            img = synthetic_image(SIZES[size_name], mode)
+            for fmt in input_formats:
+                buf = io.BytesIO()
+                try:
+                    img.save(buf, fmt)
+                except (OSError, ValueError, KeyError):
+                    continue
+                corpus.append({'input': fmt, 'size': size_name, 'mode': mode, 'data': buf.getvalue()})
+    return corpus
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak-RSS counter where supported (Linux)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss is KB on Linux but bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+@contextmanager
+def imagemagick_route(formats):
+    """Temporarily send formats with an in-process plugin to ImageMagick instead"""
+    saved = {fmt: FORMAT_REGISTRY.pop(fmt) for fmt in formats if fmt in FORMAT_REGISTRY}
+    PILLOW_FORMATS.difference_update(saved)
+    try:
+        yield
+    finally:
+        FORMAT_REGISTRY.update(saved)
+        PILLOW_FORMATS.update(saved)
+
+
+def bench_pair(sample, output_format, iterations):
+    """Convert one corpus sample to one format `iterations` times"""
+    timings = []
+    output_bytes = None
+    reset_peak_rss()
+    for _ in range(iterations):
+        output = io.BytesIO()
+        start = time.perf_counter()
+        success, actual_format, _ = convert_image(sample['data'], output, output_format)
+        elapsed = time.perf_counter() - start
+        if not success:
+            return None
+        timings.append(elapsed)
+        output_bytes = len(output.getvalue())
+    p50 = percentile(timings, 50)
+    return {
+        'input': sample['input'],
+        'output': output_format,
+        'actual_output': actual_format,
+        'size': sample['size'],
+        'mode': sample['mode'],
+        'input_bytes': len(sample['data']),
+        'output_bytes': output_bytes,
+        'p50_ms': round(p50 * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'mb_per_s': round(len(sample['data']) / p50 / 1e6, 3) if p50 else None,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def output_formats(include_imagemagick=True):
+    formats = sorted(PILLOW_FORMATS)
+    if include_imagemagick and get_capabilities()['command']:
+        from app import ALL_FORMATS
+        writable = get_capabilities()['write_formats']
+        formats += [fmt for fmt in ALL_FORMATS if fmt not in PILLOW_FORMATS and (not writable or fmt in writable)]
+    return formats
+
+
+def run_benchmark(sizes=('small', 'medium'), modes=('RGB', 'RGBA', 'L', 'P'), input_formats=None,
+                  outputs=None, iterations=5, progress=None, routes=('native',)):
+    """
+    Run the full matrix and return a JSON-serialisable report.
+
+    Pairs that fail to convert (e.g. ImageMagick cannot read an input) are
+    left out of the results. The 'imagemagick' route re-runs the formats
+    that have an in-process plugin (PLUGIN_FORMATS) through ImageMagick, so
+    the two encoders can be compared; it is skipped without ImageMagick.
+    """
+    corpus = build_corpus(sizes, modes, input_formats or INPUT_FORMATS)
+    outputs = outputs or output_formats()
+    results = []
+    for route in routes:
+        if route == 'native':
+            route_outputs, context = outputs, nullcontext()
+        elif get_capabilities()['command']:
+            route_outputs, context = [fmt for fmt in outputs if fmt in PLUGIN_FORMATS], imagemagick_route(PLUGIN_FORMATS)
+        else:
+            print('ImageMagick is not installed; skipping the imagemagick route')
+            continue
+        with context:
+            for sample in corpus:
+                for fmt in route_outputs:
+                    result = bench_pair(sample, fmt, iterations)
+                    if result is not None:
+                        result['route'] = route
+                        results.append(result)
+                        if progress:
+                            progress(result)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'imagemagick': get_capabilities()['version'],
+            'plugins': sorted(PLUGIN_FORMATS),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'iterations': iterations,
+            'timestamp': time.time(),
+        },
+        'results': results,
+    }
+
+
+def result_key(result):
+    key = f"{result['input']}->{result['output']} {result['size']} {result['mode']}"
+    # Native results keep the plain key so older reports still compare
+    if result.get('route', 'native') != 'native':
+        key += f" via {result['route']}"
+    return key
+
+
+def route_summary(report):
+    """
+    Median p50 latency and output size per format and route.
+
+    Returns:
+        Dict of format -> route -> {'p50_ms', 'output_bytes'}
+    """
+    grouped = {}
+    for result in report['results']:
+        grouped.setdefault(result['output'], {}).setdefault(result.get('route', 'native'), []).append(result)
+    return {
+        fmt: {route: {'p50_ms': percentile([r['p50_ms'] for r in results], 50),
+                      'output_bytes': percentile([r['output_bytes'] for r in results], 50)}
+              for route, results in routes.items()}
+        for fmt, routes in grouped.items()
+    }
+
+
+def compare(baseline, current, threshold=0.2, min_ms=1.0):
+    """
+    Find pairs whose p50 latency or output size grew by more than threshold.
+
+    Latencies under min_ms are ignored because they are mostly timer noise.
+
+    Returns:
+        List of human-readable regression descriptions
+    """
+    previous = {result_key(r): r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        if old['p50_ms'] >= min_ms and result['p50_ms'] > old['p50_ms'] * (1 + threshold):
+            regressions.append(f"{result_key(result)}: p50 {old['p50_ms']}ms -> {result['p50_ms']}ms")
+        if result['output_bytes'] > old['output_bytes'] * (1 + threshold):
+            regressions.append(f"{result_key(result)}: output {old['output_bytes']}B -> {result['output_bytes']}B")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Formatly conversions')
+    parser.add_argument('--output', default='bench_results.json', help='Where to write the JSON report')
+    parser.add_argument('--sizes', nargs='+', default=['small', 'medium'], choices=sorted(SIZES))
+    parser.add_argument('--modes', nargs='+', default=['RGB', 'RGBA', 'L', 'P'])
+    parser.add_argument('--inputs', nargs='+', default=INPUT_FORMATS, help='Input formats for the corpus')
+    parser.add_argument('--formats', nargs='+', help='Output formats (default: all Pillow + ImageMagick)')
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--routes', nargs='+', default=['native'], choices=['native', 'imagemagick'],
+                        help='Also run plugin formats (AVIF, HEIC) through ImageMagick to compare')
+    parser.add_argument('--compare', help='Baseline JSON report to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed relative slowdown/growth')
+    args = parser.parse_args(argv)
+
+    def progress(result):
+        print(f"{result_key(result):<32} p50 {result['p50_ms']:>9.2f}ms  p95 {result['p95_ms']:>9.2f}ms  "
+              f"{result['mb_per_s'] or 0:>8.2f}MB/s  {result['output_bytes']:>9}B  peak {result['peak_rss_kb']}KB")
+
+    report = run_benchmark(args.sizes, args.modes, args.inputs, args.formats, args.iterations, progress, args.routes)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(report['results'])} results to {args.output}")
+    if len(args.routes) > 1:
+        for fmt, routes in sorted(route_summary(report).items()):
+            if len(routes) > 1:
+                print(f"{fmt}: " + '  '.join(f"{route} p50 {stats['p50_ms']:.2f}ms {stats['output_bytes']}B"
+                                             for route, stats in routes.items()))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print('No regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,273 @@
+"""
+Offline bulk conversion of a directory tree.
+
+    python -m bulk SOURCE DEST --format WEBP [--workers 8] [--preset small]
+
+Every image under SOURCE is converted in a process pool to the same
+relative path under DEST. Finished files are appended to a manifest in
+DEST as they complete, so a rerun (or a run resumed after a crash) skips
+files whose source and settings haven't changed since their output was
+written.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from image_converter import convert_image, resolve_encoder_options, InvalidEncoderOptions, ENCODER_OPTIONS, ENCODER_PRESETS
+
+MANIFEST_FILENAME = '.formatly-manifest.jsonl'
+# Same as the upload whitelist in app.py
+DEFAULT_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'webp', 'heic', 'raw', 'psd', 'exr', 'ico', 'svg',
+                      'eps', 'pdf', 'ai', 'cdr', 'apng', 'svgz', 'dds', 'tga', 'jfif', 'avif', 'pic', 'xcf', 'dng', 'pcx'}
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def settings_key(output_format, preset, encoder_options):
+    """Outputs made with different settings are out of date"""
+    return json.dumps([output_format, preset, encoder_options or {}], sort_keys=True)
+
+
+def walk(source, extensions):
+    """Yield paths of images under source relative to it, in a stable order, skipping hidden entries"""
+    for root, dirs, files in os.walk(source):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(files):
+            if not name.startswith('.') and '.' in name and name.rsplit('.', 1)[1].lower() in extensions:
+                yield os.path.relpath(os.path.join(root, name), source)
+
+
+def output_relpath(relpath, output_format):
+    """Output path for a source: its whole name plus the new extension, so photo.jpg and photo.png stay apart"""
+    return f"{relpath}.{output_format.lower()}"
+
+
+def load_manifest(path):
+    """
+    Read the manifest, keeping the last entry for each source.
+
+    A line cut short by a crash is ignored, so its file is converted again.
+    """
+    entries = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry['source']] = entry
+    except OSError:
+        pass
+    return entries
+
+
+def write_manifest(path, entries):
+    """Rewrite the manifest with one line per source"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        for entry in entries.values():
+            f.write(json.dumps(entry) + '\n')
+    os.replace(tmp_path, path)
+
+
+def up_to_date(entry, stat, settings, dest):
+    """True if entry shows this source was converted unchanged with these settings"""
+    return (entry is not None and entry['settings'] == settings
+            and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+            and os.path.exists(os.path.join(dest, entry['output'])))
+
+
+def convert_one(source_path, output_path, output_format, preset, encoder_options, known_hash=None):
+    """
+    Worker: convert one file, writing its output atomically.
+
+    If the source's hash equals known_hash it was only touched, not changed,
+    and nothing is converted.
+
+    Returns:
+        Dict with 'hash', 'status' ('converted', 'unchanged' or 'failed') and
+        'output' (path actually written, which may be a PNG fallback)
+    """
+    content_hash = hash_file(source_path)
+    if content_hash == known_hash and os.path.exists(output_path):
+        return {'hash': content_hash, 'status': 'unchanged', 'output': output_path}
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    # Write next to the target and rename, so a crash never leaves a half-written output behind
+    base, ext = os.path.splitext(output_path)
+    tmp_path = f"{base}.tmp{os.getpid()}{ext}"
+    success, actual_format, actual_path = convert_image(source_path, tmp_path, output_format,
+                                                        preset=preset, encoder_options=encoder_options)
+    if not success:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return {'hash': content_hash, 'status': 'failed', 'output': None}
+    if actual_path != tmp_path:
+        # ImageMagick was unavailable and convert_image wrote a PNG instead
+        output_path = f"{base}.png"
+    os.replace(actual_path, output_path)
+    return {'hash': content_hash, 'status': 'converted', 'output': output_path, 'format': actual_format}
+
+
+class Progress:
+    """Running totals, printed at most every `interval` seconds"""
+
+    def __init__(self, interval=5.0, stream=sys.stderr):
+        self.interval = interval
+        self.stream = stream
+        self.start = time.monotonic()
+        self.last = self.start
+        self.counts = {'converted': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0}
+        self.bytes = 0
+
+    def add(self, status, size=0):
+        self.counts[status] += 1
+        if status == 'converted':
+            self.bytes += size
+        now = time.monotonic()
+        if self.stream is not None and now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        return dict(self.counts, seconds=round(elapsed, 2),
+                    files_per_s=round(self.counts['converted'] / elapsed, 2),
+                    mb_per_s=round(self.bytes / elapsed / 1e6, 2))
+
+    def report(self):
+        s = self.summary()
+        print(f"{s['converted']} converted, {s['skipped'] + s['unchanged']} up to date, {s['failed']} failed "
+              f"in {s['seconds']}s: {s['files_per_s']} files/s, {s['mb_per_s']} MB/s", file=self.stream)
+
+
+def run(source, dest, output_format, workers=None, preset=None, encoder_options=None, extensions=None,
+        window=None, progress=None, checkpoint_every=100):
+    """
+    Convert every image under source into dest, skipping up-to-date outputs.
+
+    Results are appended to the manifest as they finish and flushed every
+    `checkpoint_every` files, which is how far a crashed run backs up.
+
+    Returns:
+        Progress summary dict
+    """
+    output_format = output_format.upper()
+    settings = settings_key(output_format, preset, encoder_options)
+    os.makedirs(dest, exist_ok=True)
+    manifest_path = os.path.join(dest, MANIFEST_FILENAME)
+    entries = load_manifest(manifest_path)
+    progress = progress or Progress(stream=None)
+    workers = workers or os.cpu_count() or 1
+    window = window or workers * 4
+    pending = {}
+    since_checkpoint = 0
+
+    with open(manifest_path, 'a') as checkpoint, ProcessPoolExecutor(max_workers=workers) as executor:
+        def record(relpath, stat, result):
+            nonlocal since_checkpoint
+            if result['status'] == 'failed':
+                print(f"Could not convert {relpath}", file=sys.stderr)
+                progress.add('failed')
+                return
+            entry = {'source': relpath, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': result['hash'],
+                     'settings': settings, 'output': os.path.relpath(result['output'], dest)}
+            entries[relpath] = entry
+            checkpoint.write(json.dumps(entry) + '\n')
+            since_checkpoint += 1
+            if since_checkpoint >= checkpoint_every:
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+                since_checkpoint = 0
+            progress.add(result['status'], stat.st_size)
+
+        def collect(return_when):
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                relpath, stat = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error converting {relpath}: {e}", file=sys.stderr)
+                    result = {'status': 'failed'}
+                record(relpath, stat, result)
+
+        for relpath in walk(source, extensions or DEFAULT_EXTENSIONS):
+            source_path = os.path.join(source, relpath)
+            try:
+                stat = os.stat(source_path)
+            except OSError:
+                continue
+            entry = entries.get(relpath)
+            if up_to_date(entry, stat, settings, dest):
+                progress.add('skipped')
+                continue
+            known_hash = entry['hash'] if entry and entry['settings'] == settings else None
+            future = executor.submit(convert_one, source_path, os.path.join(dest, output_relpath(relpath, output_format)),
+                                     output_format, preset, encoder_options, known_hash)
+            pending[future] = (relpath, stat)
+            if len(pending) >= window:
+                collect(FIRST_COMPLETED)
+        while pending:
+            collect(FIRST_COMPLETED)
+
+    # Drop superseded lines now that the run is complete
+    write_manifest(manifest_path, entries)
+    return progress.summary()
+
+
+def parse_option(value):
+    """name=value for an ENCODER_OPTIONS entry"""
+    name, _, raw = value.partition('=')
+    if name not in ENCODER_OPTIONS:
+        raise argparse.ArgumentTypeError(f"Unknown encoder option '{name}'")
+    kind = ENCODER_OPTIONS[name][0]
+    if kind is bool:
+        return name, raw.lower() in ('true', '1', 'on')
+    try:
+        return name, int(raw)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{name}' must be a whole number")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bulk', description='Convert a directory tree of images')
+    parser.add_argument('source')
+    parser.add_argument('dest')
+    parser.add_argument('--format', default='WEBP', help='Output format')
+    parser.add_argument('--workers', type=int, help='Conversion processes (default: one per CPU)')
+    parser.add_argument('--preset', choices=ENCODER_PRESETS)
+    parser.add_argument('--option', action='append', type=parse_option, default=[],
+                        help='Encoder option, e.g. --option quality=80 (repeatable)')
+    parser.add_argument('--extensions', help='Comma-separated input extensions to convert')
+    parser.add_argument('--interval', type=float, default=5.0, help='Seconds between progress lines')
+    args = parser.parse_args(argv)
+
+    encoder_options = dict(args.option) or None
+    try:
+        # Fail now rather than once per file
+        resolve_encoder_options(args.format, args.preset, encoder_options)
+    except InvalidEncoderOptions as e:
+        parser.error(str(e))
+    if not os.path.isdir(args.source):
+        parser.error(f"{args.source} is not a directory")
+    extensions = {ext.strip().lower().lstrip('.') for ext in args.extensions.split(',')} if args.extensions else None
+    progress = Progress(args.interval)
+    summary = run(args.source, args.dest, args.format, args.workers, args.preset, encoder_options,
+                  extensions, progress=progress)
+    progress.report()
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
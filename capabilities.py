@@ -0,0 +1,150 @@
+import os
+import subprocess
+import threading
+import time
+
+# How long a probe result stays valid before ImageMagick is looked up again
+PROBE_TTL = float(os.environ.get('FORMATLY_PROBE_TTL', 3600))
+
+_lock = threading.Lock()
+_capabilities = None
+_probed_at = 0.0
+_background = None
+_background_lock = threading.Lock()
+
+
+def _run(cmd):
+    """Run a probe command and return its stdout, or None if it failed"""
+    try:
+        result = subprocess.run(cmd, capture_output=True, check=True, timeout=10)
+        return result.stdout.decode(errors='replace')
+    except Exception:
+        return None
+
+
+def parse_version(output):
+    """Extract the version string from `magick -version` output"""
+    for line in output.splitlines():
+        if line.startswith('Version:'):
+            parts = line.split()
+            # "Version: ImageMagick 7.1.1-15 Q16-HDRI x86_64 ..."
+            if len(parts) >= 3:
+                return parts[2]
+    return None
+
+
+def parse_formats(output):
+    """
+    Parse `magick -list format` output into read and write format sets.
+
+    Returns:
+        (read_formats, write_formats)
+    """
+    read_formats = set()
+    write_formats = set()
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        name, mode = parts[0].rstrip('*').upper(), parts[1]
+        if len(mode) != 3 or not set(mode) <= set('rw+-'):
+            continue
+        if mode[0] == 'r':
+            read_formats.add(name)
+        if mode[1] == 'w':
+            write_formats.add(name)
+    return read_formats, write_formats
+
+
+def probe_imagemagick():
+    """
+    Detect the ImageMagick binary, its version and supported formats.
+
+    This spawns subprocesses, so callers should go through get_capabilities().
+    """
+    for command in ('magick', 'convert'):
+        output = _run([command, '-version'])
+        if output is None:
+            continue
+        formats = _run([command, '-list', 'format'])
+        read_formats, write_formats = parse_formats(formats) if formats else (set(), set())
+        return {
+            'command': command,
+            'version': parse_version(output),
+            'read_formats': frozenset(read_formats),
+            'write_formats': frozenset(write_formats),
+        }
+    return {
+        'command': None,
+        'version': None,
+        'read_formats': frozenset(),
+        'write_formats': frozenset(),
+    }
+
+
+def get_capabilities(refresh=False):
+    """Return the cached ImageMagick capabilities, probing at most once per TTL"""
+    global _capabilities, _probed_at
+    with _lock:
+        expired = time.monotonic() - _probed_at > PROBE_TTL
+        if refresh or _capabilities is None or expired:
+            _capabilities = probe_imagemagick()
+            _probed_at = time.monotonic()
+        return _capabilities
+
+
+def probe_in_background():
+    """
+    Start probing in a thread if there is no fresh result, without waiting.
+
+    The probe spawns ImageMagick twice; serving paths that only want a hint
+    call this and read cached_capabilities() instead of blocking on it.
+    """
+    global _background
+    # Not _lock: a running probe holds that for as long as ImageMagick takes
+    with _background_lock:
+        fresh = _capabilities is not None and time.monotonic() - _probed_at <= PROBE_TTL
+        if fresh or (_background is not None and _background.is_alive()):
+            return
+        _background = threading.Thread(target=get_capabilities, name='formatly-probe', daemon=True)
+        _background.start()
+
+
+def cached_capabilities():
+    """The last probe result, possibly stale, or None if no probe has finished yet"""
+    return _capabilities
+
+
+def _reset_after_fork():
+    # A probe thread (and the lock it held) doesn't survive fork
+    global _lock, _background, _background_lock
+    _lock = threading.Lock()
+    _background = None
+    _background_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def refresh_capabilities():
+    """Force a new probe, e.g. after ImageMagick was installed or upgraded"""
+    return get_capabilities(refresh=True)
+
+
+def imagemagick_command():
+    return get_capabilities()['command']
+
+
+def imagemagick_can_write(fmt):
+    """
+    Check whether ImageMagick can write a format.
+
+    If the binary exists but its format list could not be read, assume it can
+    and let the conversion itself report the failure.
+    """
+    caps = get_capabilities()
+    if caps['command'] is None:
+        return False
+    if not caps['write_formats']:
+        return True
+    return fmt.upper() in caps['write_formats']
@@ -0,0 +1,89 @@
+"""
+Cold start benchmark: how long a fresh process takes to import the app and
+answer its first request, which is what a scale-to-zero deploy waits on.
+
+    python coldstart.py --runs 5 --path /healthz --max-total-ms 1500
+
+Each run is a new interpreter, so nothing is shared between runs except the
+OS file cache. The report also lists the Pillow plugins loaded by then, to
+catch imports creeping back onto the startup path.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from statistics import median
+
+# Runs in the child: import the app, then serve one request in-process
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1])
+imported = time.perf_counter()
+response = module.app.test_client().get(sys.argv[2])
+answered = time.perf_counter()
+print(json.dumps({
+    'status': response.status_code,
+    'import_ms': (imported - start) * 1000,
+    'first_response_ms': (answered - imported) * 1000,
+    'modules': len(sys.modules),
+    'pillow_plugins': sorted(m[4:] for m in sys.modules if m.startswith('PIL.') and m.endswith('ImagePlugin')),
+}))
+"""
+
+
+def measure(module='wsgi', path='/healthz', env=None):
+    """
+    Start a fresh interpreter, import module and GET path from its app.
+
+    Returns:
+        Dict with 'status', 'import_ms', 'first_response_ms', 'total_ms'
+        (spawn to response, including interpreter startup), 'modules' and
+        'pillow_plugins'
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', CHILD, module, path], capture_output=True, check=True,
+                            env=dict(os.environ, **(env or {})), cwd=os.path.dirname(os.path.abspath(__file__)))
+    total_ms = (time.perf_counter() - start) * 1000
+    # The app may print while starting; the report is the last line
+    report = json.loads(result.stdout.decode().strip().splitlines()[-1])
+    report['total_ms'] = total_ms
+    return report
+
+
+def summarize(runs):
+    """Medians over runs, plus what the last run loaded"""
+    return {
+        'runs': len(runs),
+        'import_ms': round(median(r['import_ms'] for r in runs), 1),
+        'first_response_ms': round(median(r['first_response_ms'] for r in runs), 1),
+        'total_ms': round(median(r['total_ms'] for r in runs), 1),
+        'statuses': sorted({r['status'] for r in runs}),
+        'modules': runs[-1]['modules'],
+        'pillow_plugins': runs[-1]['pillow_plugins'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure Formatly cold start time')
+    parser.add_argument('--module', default='wsgi', help='Module whose `app` is the Flask app')
+    parser.add_argument('--path', default='/healthz', help='First request to send')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-total-ms', type=float, help='Fail if the median spawn-to-response time is higher')
+    args = parser.parse_args(argv)
+
+    summary = summarize([measure(args.module, args.path) for _ in range(args.runs)])
+    print(json.dumps(summary, indent=2))
+    if summary['statuses'] != [200]:
+        print(f"FAIL {args.path} returned {summary['statuses']}")
+        return 1
+    if args.max_total_ms and summary['total_ms'] > args.max_total_ms:
+        print(f"FAIL median cold start {summary['total_ms']}ms over {args.max_total_ms}ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Production gunicorn settings, sized from the CPU and memory actually
+available to the container.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every setting can be pinned with an environment variable: WEB_CONCURRENCY
+(web workers), GUNICORN_THREADS, JOB_WORKERS and BATCH_WORKERS (conversion and /batch
+processes per web worker), GUNICORN_TIMEOUT, MAX_REQUESTS.
+"""
+import math
+import os
+
+# Resident memory of one web worker (Flask, Pillow and its plugins)
+WORKER_MEMORY = 100 * 1024 * 1024
+# Interpreter overhead of one conversion process, on top of its pixel budget
+CONVERSION_OVERHEAD = 64 * 1024 * 1024
+# Smallest pixel budget plan() will shrink to on a small box
+MIN_BUDGET = 64 * 1024 * 1024
+
+
+def cpu_limit():
+    """CPUs this container may use: cgroup quota, else affinity, else cpu_count"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def memory_limit():
+    """Bytes of memory this container may use: cgroup limit, else physical memory"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+            # cgroup v1 reports "no limit" as a huge number
+            if value != 'max' and int(value) < 1 << 60:
+                return int(value)
+        except (OSError, ValueError):
+            pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 1024 * 1024 * 1024
+
+
+def plan(cpus, memory, budget, workers=None):
+    """
+    Split the machine between web workers and conversion processes.
+
+    Conversions are CPU-bound and each may use `budget` bytes of pixels, so
+    their total is capped by both the CPUs and the memory left after the web
+    workers. Web workers mostly wait on uploads and downloads (in threads),
+    so about one per two CPUs is enough. Each web worker has two process
+    pools, the job queue's and /batch's, and they split its share of the
+    slots. If memory doesn't fit even one process per pool, the pixel budget
+    is lowered until it does.
+
+    Returns:
+        (web workers, conversion processes per web worker, /batch processes
+        per web worker, pixel budget per conversion)
+    """
+    workers = workers or max(1, (cpus + 1) // 2)
+    slots = (memory - workers * WORKER_MEMORY) // (budget + CONVERSION_OVERHEAD)
+    slots = min(max(2, cpus), slots)
+    # Every web worker needs one process in each of its pools
+    workers = max(1, min(workers, slots // 2))
+    if slots < 2:
+        slots = 2
+        budget = max(MIN_BUDGET, (memory - workers * WORKER_MEMORY) // 2 - CONVERSION_OVERHEAD)
+    per_worker = slots // workers
+    batch = per_worker // 2
+    return workers, per_worker - batch, batch, budget
+
+
+_budget = int(os.environ.get('FORMATLY_MEMORY_BUDGET', 256 * 1024 * 1024))
+_workers, _job_workers, _batch_workers, _budget = plan(cpu_limit(), memory_limit(), _budget,
+                                                       int(os.environ.get('WEB_CONCURRENCY', 0)))
+# Read by app.py and image_converter.py when the preloaded app is imported below
+os.environ.setdefault('JOB_WORKERS', str(_job_workers))
+os.environ.setdefault('BATCH_WORKERS', str(_batch_workers))
+os.environ['FORMATLY_MEMORY_BUDGET'] = str(_budget)
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = _workers
+# Threads serve slow uploads and downloads without holding a whole worker
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Import the app, Pillow's core plugins and the format registry once in the
+# master; workers fork with them already loaded (and shared copy-on-write).
+# Rarer plugins and codecs are still imported on first use
+preload_app = True
+
+# ?wait=1 uploads block for up to JOB_TIMEOUT, so leave headroom above it
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', int(os.environ.get('JOB_TIMEOUT', 60)) + 30))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers, and with them their conversion pools, before heap
+# fragmentation from large Pillow buffers builds up; jitter keeps them from
+# all restarting at once
+max_requests = int(os.environ.get('MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+# Heartbeat files on tmpfs, so a slow disk can't get workers killed
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    server.log.info(f"Formatly: {workers} workers x {threads} threads, "
+                    f"{os.environ['JOB_WORKERS']} conversion and {os.environ['BATCH_WORKERS']} batch processes per worker, "
+                    f"{_budget // (1024 * 1024)}MB pixel budget each")
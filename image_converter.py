@@ -1,129 +1,505 @@
+import importlib
+import importlib.util
+import io
 import os
+import shutil
 import subprocess
-from PIL import Image  # type: ignore
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from PIL import Image, ImageSequence, UnidentifiedImageError  # type: ignore
+from capabilities import imagemagick_command, imagemagick_can_write
+from magick_backend import run_conversion
+import metrics
+from metrics import timed
 
-# Formats Pillow can write
-PILLOW_FORMATS = {
-    'JPEG', 'JPG', 'PNG', 'GIF', 'BMP', 'TIFF', 'WEBP', 'ICO', 'TGA', 'PCX'
+# Formats Pillow can write; filled in by register_format()
+PILLOW_FORMATS = set()
+
+# How Pillow writes each output format. Images already in one of keep_modes
+# are encoded as-is; anything else is converted to convert_mode first, so a
+# pixel copy is only made when the encoder actually needs a different mode.
+FORMAT_REGISTRY = {}
+
+# Encoder presets: 'fast' trades size for CPU, 'small' the reverse.
+# 'balanced' is each format's base save options.
+ENCODER_PRESETS = ('fast', 'balanced', 'small')
+
+# User-tunable encoder options: name -> (type, min, max)
+ENCODER_OPTIONS = {
+    'quality': (int, 1, 100),
+    'compression_level': (int, 0, 9),
+    'lossless': (bool, None, None),
+    'progressive': (bool, None, None),
+    'max_fps': (int, 1, 100),
+    'speed': (int, 0, 10),
+}
+
+# Frame disposal as read from each source format, and as written to each
+# output format. Pillow hands out fully composited frames and its GIF writer
+# can't restore a frame from two frames back, so 'previous' becomes
+# 'background' in GIF output: the whole composited frame is then redrawn.
+GIF_DISPOSAL = {0: 'none', 1: 'none', 2: 'background', 3: 'previous'}
+APNG_DISPOSAL = {0: 'none', 1: 'background', 2: 'previous'}
+DISPOSAL_CODES = {
+    'GIF': {'none': 1, 'background': 2, 'previous': 2},
+    'APNG': {'none': 0, 'background': 1, 'previous': 2},
+}
+
+class InvalidEncoderOptions(ValueError):
+    """Raised for an unknown preset or an option the format does not support"""
+
+def register_format(name, pillow_format=None, keep_modes=('RGB',), convert_mode='RGB',
+                    save_options=None, presets=None, options=None, animated=False, result_format=None):
+    """
+    Register (or replace) a Pillow output format.
+    
+    Args:
+        name: Format name as requested by callers, e.g. 'JPG'
+        pillow_format: Pillow encoder name, defaults to name
+        keep_modes: Modes the encoder accepts without conversion
+        convert_mode: Mode to convert any other image to
+        save_options: Extra keyword arguments for Image.save
+        presets: Save options layered on top for each preset name
+        options: Maps ENCODER_OPTIONS names to Image.save keyword arguments
+        animated: Write every frame of animated inputs
+        result_format: Format reported to callers, defaults to pillow_format
+    """
+    name = name.upper()
+    FORMAT_REGISTRY[name] = {
+        'pillow_format': pillow_format or name,
+        'result_format': result_format or pillow_format or name,
+        'animated': animated,
+        'keep_modes': frozenset(keep_modes),
+        'convert_mode': convert_mode,
+        'save_options': dict(save_options or {}),
+        'presets': dict(presets or {}),
+        'options': dict(options or {}),
+    }
+    PILLOW_FORMATS.add(name)
+
+JPEG_SETTINGS = {
+    'save_options': {'quality': 95},
+    'presets': {'small': {'optimize': True, 'progressive': True}},
+    'options': {'quality': 'quality', 'progressive': 'progressive'},
+}
+register_format('JPEG', **JPEG_SETTINGS)
+register_format('JPG', pillow_format='JPEG', **JPEG_SETTINGS)
+PNG_SETTINGS = {
+    'keep_modes': ('RGBA', 'RGB'),
+    'presets': {'fast': {'compress_level': 1}, 'small': {'optimize': True}},
+    'options': {'compression_level': 'compress_level'},
+}
+register_format('PNG', **PNG_SETTINGS)
+register_format('APNG', pillow_format='PNG', result_format='APNG', animated=True, **dict(
+    PNG_SETTINGS, options={'compression_level': 'compress_level', 'max_fps': 'max_fps'}))
+register_format('GIF', keep_modes=('P', 'RGB'), presets={'small': {'optimize': True}},
+                options={'max_fps': 'max_fps'}, animated=True)
+register_format('BMP')
+register_format('TIFF', keep_modes=('RGBA', 'LA', 'P', 'RGB'),
+                presets={'small': {'compression': 'tiff_adobe_deflate'}})
+register_format('WEBP', keep_modes=('RGBA', 'RGB'),
+                presets={'fast': {'method': 0}, 'small': {'method': 6}},
+                options={'quality': 'quality', 'lossless': 'lossless', 'max_fps': 'max_fps'}, animated=True)
+register_format('ICO', keep_modes=('RGBA',), convert_mode='RGBA')
+register_format('TGA', presets={'small': {'compression': 'tga_rle'}})
+register_format('PCX')
+
+# Optional in-process encoders for formats that otherwise need ImageMagick:
+# pillow-heif (HEIC) and pillow-avif-plugin (AVIF). Set FORMATLY_NATIVE_CODECS=0
+# to keep them on the ImageMagick route.
+NATIVE_CODECS = os.environ.get('FORMATLY_NATIVE_CODECS', '1') != '0'
+# Formats registered by register_codec_plugins()
+PLUGIN_FORMATS = set()
+_codecs_loaded = False
+_codecs_lock = threading.Lock()
+
+def register_codec_plugins():
+    """
+    Register the HEIC/AVIF encoders that are installed.
+
+    Only their presence is checked here; the libraries themselves are
+    imported by load_codec_plugins() the first time they are needed.
+    """
+    if importlib.util.find_spec('pillow_heif'):
+        # libheif hands enc_params to x265; its presets trade speed for size
+        register_format('HEIC', pillow_format='HEIF', result_format='HEIC', keep_modes=('RGBA', 'RGB'),
+                        presets={'fast': {'enc_params': {'preset': 'ultrafast'}},
+                                 'small': {'enc_params': {'preset': 'slower'}}},
+                        options={'quality': 'quality'})
+        PLUGIN_FORMATS.add('HEIC')
+    if importlib.util.find_spec('pillow_avif'):
+        # libavif speed runs from 0 (slowest, smallest) to 10; the plugin defaults to 6
+        register_format('AVIF', keep_modes=('RGBA', 'RGB'),
+                        presets={'fast': {'speed': 8}, 'small': {'speed': 4}},
+                        options={'quality': 'quality', 'speed': 'speed'})
+        PLUGIN_FORMATS.add('AVIF')
+
+def load_codec_plugins():
+    """
+    Import the registered codec plugins so Pillow can read and write HEIC/AVIF.
+
+    Returns:
+        True if they were loaded by this call, False if already loaded (or none are registered)
+    """
+    global _codecs_loaded
+    with _codecs_lock:
+        if _codecs_loaded or not PLUGIN_FORMATS:
+            return False
+        _codecs_loaded = True
+        if 'HEIC' in PLUGIN_FORMATS:
+            import pillow_heif  # type: ignore
+            pillow_heif.register_heif_opener()
+        if 'AVIF' in PLUGIN_FORMATS:
+            import pillow_avif  # type: ignore  # noqa: F401  registers on import
+        return True
+
+if NATIVE_CODECS:
+    register_codec_plugins()
+
+# Pillow plugin module for each Pillow format this app writes or sniffs.
+# Image.preinit() only loads BMP, GIF, JPEG, PPM and PNG, and Image.init()
+# imports every plugin at once; instead each one is imported when its format
+# is first used, which keeps them off the cold start path.
+PILLOW_PLUGINS = {
+    'JPEG': 'JpegImagePlugin', 'MPO': 'MpoImagePlugin', 'PNG': 'PngImagePlugin', 'GIF': 'GifImagePlugin',
+    'BMP': 'BmpImagePlugin', 'TIFF': 'TiffImagePlugin', 'WEBP': 'WebPImagePlugin', 'ICO': 'IcoImagePlugin',
+    'TGA': 'TgaImagePlugin', 'PCX': 'PcxImagePlugin', 'PSD': 'PsdImagePlugin', 'DDS': 'DdsImagePlugin',
+    'EPS': 'EpsImagePlugin', 'PDF': 'PdfImagePlugin',
 }
+CODEC_PLUGIN_FORMATS = {'HEIC', 'HEIF', 'AVIF'}
+
+def load_pillow_plugin(fmt):
+    """
+    Import the Pillow plugin for fmt, if it is one this module knows.
+
+    Other formats are left to Pillow, which falls back to Image.init() when
+    it meets a format it hasn't loaded.
+    """
+    fmt = fmt.upper() if fmt else ''
+    if fmt in CODEC_PLUGIN_FORMATS:
+        load_codec_plugins()
+    elif fmt in PILLOW_PLUGINS:
+        importlib.import_module(f"PIL.{PILLOW_PLUGINS[fmt]}")
+
+def open_image(source):
+    """Image.open, loading the HEIC/AVIF openers the first time an input needs them"""
+    start = None if is_path(source) else source.tell()
+    try:
+        return Image.open(source)
+    except UnidentifiedImageError:
+        if not load_codec_plugins():
+            raise
+        if start is not None:
+            source.seek(start)
+        return Image.open(source)
+
+def resolve_encoder_options(fmt, preset=None, encoder_options=None):
+    """
+    Validate a preset and user options for fmt and merge them into save options.
+    
+    Presets are accepted for every format and simply have no effect where the
+    format has nothing to tune; explicit options must be supported by fmt.
+    
+    Returns:
+        Keyword arguments for Image.save (empty for non-Pillow formats)
+    """
+    if preset is not None and preset not in ENCODER_PRESETS:
+        raise InvalidEncoderOptions(f"Unknown preset '{preset}'. Choose one of: {', '.join(ENCODER_PRESETS)}")
+    spec = FORMAT_REGISTRY.get(fmt.upper())
+    supported = spec['options'] if spec else {}
+    save_options = {}
+    if spec:
+        save_options.update(spec['save_options'])
+        save_options.update(spec['presets'].get(preset, {}))
+    for name, value in (encoder_options or {}).items():
+        if name not in ENCODER_OPTIONS:
+            raise InvalidEncoderOptions(f"Unknown encoder option '{name}'")
+        if name not in supported:
+            raise InvalidEncoderOptions(f"{fmt.upper()} does not support the '{name}' option")
+        kind, low, high = ENCODER_OPTIONS[name]
+        if kind is bool:
+            if not isinstance(value, bool):
+                raise InvalidEncoderOptions(f"'{name}' must be true or false")
+        elif isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+            raise InvalidEncoderOptions(f"'{name}' must be a whole number from {low} to {high}")
+        save_options[supported[name]] = value
+    return save_options
+
+# Peak pixel memory a single Pillow conversion may use; larger images are
+# decoded at reduced scale (JPEG) or handed to ImageMagick's disk-backed
+# pixel cache, which works through the image in tiles
+MEMORY_BUDGET = int(os.environ.get('FORMATLY_MEMORY_BUDGET', 256 * 1024 * 1024))
+# Images with more pixels than this are rejected before decoding
+MAX_PIXELS = int(os.environ.get('FORMATLY_MAX_PIXELS', 100_000_000))
+# 'reject' keeps full resolution; 'downscale' lets JPEG inputs decode smaller
+OVERSIZE_POLICY = os.environ.get('FORMATLY_OVERSIZE_POLICY', 'reject')
+
+# Bytes per pixel of Pillow's in-memory storage, by mode
+MODE_BYTES = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16L': 2, 'I;16B': 2, 'I;16N': 2}
+
+class ImageTooLarge(Exception):
+    """Raised when an image's dimensions exceed MAX_PIXELS"""
 
 def pillow_can_write(fmt):
-    return fmt.upper() in PILLOW_FORMATS
+    return fmt.upper() in FORMAT_REGISTRY
+
+def prepare_mode(img, fmt):
+    """Return img in a mode the format's encoder accepts, copying only if needed"""
+    spec = FORMAT_REGISTRY[fmt]
+    if img.mode in spec['keep_modes']:
+        return img
+    return img.convert(spec['convert_mode'])
+
+def save_with_pillow(img, output, fmt, save_options=None):
+    """
+    Encode an opened image using the registry entry for fmt.
+    
+    Args:
+        save_options: Resolved encoder options, defaults to the format's own
+    
+    Returns:
+        The format actually written, e.g. 'JPEG' for 'JPG'
+    """
+    spec = FORMAT_REGISTRY[fmt]
+    save_options = dict(spec['save_options'] if save_options is None else save_options)
+    max_fps = save_options.pop('max_fps', None)
+    if spec['animated'] and getattr(img, 'is_animated', False):
+        # Frames are decoded and encoded interleaved, so this is one stage
+        with timed('encode'):
+            save_animation(img, output, fmt, save_options, max_fps)
+        return spec['result_format']
+    # Decoding is lazy; load explicitly so each stage is timed on its own
+    with timed('decode'):
+        img.load()
+    with timed('mode_convert'):
+        img = prepare_mode(img, fmt)
+    load_pillow_plugin(spec['pillow_format'])
+    with timed('encode'):
+        img.save(output, spec['pillow_format'], **save_options)
+    return spec['result_format']
+
+def frame_disposal(frame):
+    if frame.format == 'GIF':
+        return GIF_DISPOSAL.get(frame.disposal_method, 'none')
+    if frame.format == 'PNG':
+        return APNG_DISPOSAL.get(frame.info.get('disposal'), 'none')
+    # WEBP frames come out of libwebp already composited
+    return 'none'
+
+def iter_frames(img, fmt, durations, disposals, max_fps=None, budget=None):
+    """
+    Yield an animation's frames one at a time, ready for fmt's encoder.
+
+    Each frame's duration and disposal code are appended to `durations` and
+    `disposals` just before it is yielded (encoders index them per frame); a frame is held back until the
+    next kept one is found, so durations merged by decimation are final.
+
+    Args:
+        max_fps: Drop frames shown sooner than 1/max_fps seconds after the
+            previous kept frame, adding their time to it
+        budget: Bytes the encoder may accumulate; Pillow's GIF, APNG and
+            WEBP writers keep every frame until the file is written
+    """
+    budget = MEMORY_BUDGET if budget is None else budget
+    min_interval = 1000 / max_fps if max_fps else 0
+    frame_bytes = estimate_decode_bytes(img.size, 'RGBA')
+    pending = None
+    kept = 0
+    for frame in ImageSequence.Iterator(img):
+        # Some plugins (WEBP) only fill in frame info once it is decoded
+        with timed('decode'):
+            frame.load()
+        duration = frame.info.get('duration') or 0
+        if min_interval and duration <= 10:
+            # Viewers show 0-10ms frames for about 100ms
+            duration = 100
+        if pending is not None and pending[1] < min_interval:
+            pending[1] += duration
+            continue
+        if pending is not None:
+            durations.append(pending[1])
+            disposals.append(pending[2])
+            yield pending[0]
+        kept += 1
+        if kept * frame_bytes > budget:
+            raise ImageTooLarge(f"Animation exceeds the {budget} byte memory budget after {kept} frames; try max_fps")
+        with timed('mode_convert'):
+            converted = frame.copy() if fmt == 'GIF' else frame.convert('RGBA')
+        pending = [converted, duration, DISPOSAL_CODES.get(fmt, {}).get(frame_disposal(frame))]
+    if pending is not None:
+        durations.append(pending[1])
+        disposals.append(pending[2])
+        yield pending[0]
+
+def save_animation(img, output, fmt, save_options, max_fps=None):
+    """Write every frame of an animated image, keeping timing, loop count and disposal"""
+    spec = FORMAT_REGISTRY[fmt]
+    loop = img.info.get('loop')
+    durations, disposals = [], []
+    frames = iter_frames(img, fmt, durations, disposals, max_fps)
+    first = next(frames)
+    if spec['pillow_format'] == 'PNG':
+        # Pillow's APNG writer iterates append_images twice
+        frames = list(frames)
+    options = dict(save_options, save_all=True, append_images=frames, duration=durations)
+    if fmt in DISPOSAL_CODES:
+        options['disposal'] = disposals
+    if loop is not None:
+        options['loop'] = loop
+    elif fmt != 'GIF':
+        # A GIF without a loop count plays once; GIF output simply omits it
+        options['loop'] = 1
+    load_pillow_plugin(spec['pillow_format'])
+    first.save(output, spec['pillow_format'], **options)
 
 def check_imagemagick():
-    """Check if ImageMagick is available"""
+    """Check if ImageMagick is available (cached, see capabilities.py)"""
+    return imagemagick_command()
+
+def estimate_decode_bytes(size, mode):
+    """Estimate peak memory to decode an image and convert it to RGB(A)"""
+    width, height = size
+    return width * height * (MODE_BYTES.get(mode, 4) + 4)
+
+def fit_memory_budget(img, budget=None, policy=None):
+    """
+    Check an opened (not yet decoded) image against the memory limits.
+
+    With the 'downscale' policy, JPEG inputs are set up to decode at a
+    reduced DCT scale via draft(). Raises ImageTooLarge for decompression
+    bombs.
+
+    Returns:
+        True if decoding with Pillow stays within the budget
+    """
+    budget = MEMORY_BUDGET if budget is None else budget
+    policy = policy or OVERSIZE_POLICY
+    width, height = img.size
+    if width * height > MAX_PIXELS:
+        raise ImageTooLarge(f"{width}x{height} exceeds the {MAX_PIXELS} pixel limit")
+    needed = estimate_decode_bytes(img.size, img.mode)
+    if needed <= budget:
+        return True
+    if policy == 'downscale' and img.format == 'JPEG':
+        # libjpeg can decode at 1/2, 1/4 or 1/8 scale
+        scale = (needed / budget) ** 0.5
+        factor = next((f for f in (2, 4, 8) if f >= scale), 8)
+        img.draft(img.mode, (-(-width // factor), -(-height // factor)))
+        return estimate_decode_bytes(img.size, img.mode) <= budget
+    return False
+
+def is_path(obj):
+    return isinstance(obj, (str, os.PathLike))
+
+def png_fallback_target(output_path):
+    """Where a PNG fallback goes: a .png sibling path, or the same stream"""
+    if is_path(output_path):
+        return os.fspath(output_path).rsplit('.', 1)[0] + '.png'
+    return output_path
+
+@contextmanager
+def real_input_path(source, input_name=None):
+    """Yield a filesystem path for `source`, spilling streams to a temp file"""
+    if is_path(source):
+        yield source
+        return
+    suffix = os.path.splitext(input_name)[1] if input_name else ''
+    fd, tmp_path = tempfile.mkstemp(suffix=suffix)
     try:
-        result = subprocess.run(['magick', '-version'], capture_output=True, check=True)
-        return 'magick'
-    except:
-        try:
-            result = subprocess.run(['convert', '-version'], capture_output=True, check=True)
-            return 'convert'
-        except:
-            return None
+        with os.fdopen(fd, 'wb') as tmp:
+            source.seek(0)
+            shutil.copyfileobj(source, tmp)
+        yield tmp_path
+    finally:
+        os.remove(tmp_path)
+
+@contextmanager
+def real_output_path(target, fmt):
+    """Yield a filesystem path to write to, copying into `target` if it is a stream"""
+    if is_path(target):
+        yield target
+        return
+    fd, tmp_path = tempfile.mkstemp(suffix=f".{fmt.lower()}")
+    os.close(fd)
+    try:
+        yield tmp_path
+        with open(tmp_path, 'rb') as tmp:
+            shutil.copyfileobj(tmp, target)
+    finally:
+        os.remove(tmp_path)
 
-def convert_image(input_path, output_path, output_format='PNG'):
+def run_imagemagick(magick_cmd, input_path, output_path, fmt, input_name=None, memory_limit=None):
+    """Run an ImageMagick conversion, giving it real paths for streamed input/output"""
+    limits = None
+    if memory_limit:
+        # Past these limits ImageMagick pages its pixel cache to disk in tiles
+        limits = ['-limit', 'memory', str(memory_limit), '-limit', 'map', str(memory_limit * 2)]
+    with real_input_path(input_path, input_name) as in_path, real_output_path(output_path, fmt) as out_path, \
+            timed('imagemagick'):
+        run_conversion(magick_cmd, in_path, out_path, timeout=30, limits=limits)
+
+def convert_oversized(input_path, output_path, fmt, input_name=None):
+    """Convert an image too large for the Pillow memory budget via ImageMagick"""
+    magick_cmd = check_imagemagick()
+    if not magick_cmd:
+        print(f"Image exceeds the {MEMORY_BUDGET} byte memory budget and ImageMagick is not available")
+        return False, None, None
+    try:
+        run_imagemagick(magick_cmd, input_path, output_path, fmt, input_name, memory_limit=MEMORY_BUDGET)
+    except subprocess.SubprocessError as e:
+        print(f"ImageMagick conversion of oversized image failed: {e}")
+        return False, None, None
+    return True, 'JPEG' if fmt == 'JPG' else fmt, output_path
+
+def convert_image(input_path, output_path, output_format='PNG', input_name=None, preset=None, encoder_options=None):
     """
     Convert image to specified format using Pillow or ImageMagick.
     
     Args:
-        input_path: Path to input image
-        output_path: Path for output file
+        input_path: Path to input image, or its bytes / a readable binary file object
+        output_path: Path for output file, or a writable binary file object
         output_format: Desired output format
+        input_name: Original filename, used as a format hint when a streamed
+            input has to be handed to ImageMagick
+        preset: Encoder preset, one of ENCODER_PRESETS
+        encoder_options: Dict of ENCODER_OPTIONS overrides, e.g. {'quality': 80}
     
     Returns:
-        (success, actual_format, actual_filename)
+        (success, actual_format, actual_filename); actual_filename is the
+        output file object itself when output_path is a stream
     """
     try:
-        if not os.path.exists(input_path):
+        if isinstance(input_path, (bytes, bytearray, memoryview)):
+            input_path = io.BytesIO(input_path)
+        if is_path(input_path) and not os.path.exists(input_path):
             return False, None, None
-        output_dir = os.path.dirname(output_path)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+        if is_path(output_path):
+            output_dir = os.path.dirname(output_path)
+            if output_dir and not os.path.exists(output_dir):
+                os.makedirs(output_dir)
         fmt = output_format.upper() if output_format else 'PNG'
+        save_options = resolve_encoder_options(fmt, preset, encoder_options)
         # If Pillow can handle this format, use it
         if pillow_can_write(fmt):
-            with Image.open(input_path) as img:
-                if fmt in ['JPEG', 'JPG']:
-                    converted_img = img.convert('RGB')
-                    converted_img.save(output_path, 'JPEG', quality=95)
-                    return True, 'JPEG', output_path
-                elif fmt == 'PNG':
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        if img.mode == 'RGBA':
-                            converted_img = img.convert('RGBA')
-                        else:
-                            converted_img = img.convert('RGB')
-                    else:
-                        converted_img = img.convert('RGB')
-                    converted_img.save(output_path, 'PNG')
-                    return True, 'PNG', output_path
-                elif fmt == 'GIF':
-                    if img.mode == 'P':
-                        converted_img = img
-                    else:
-                        converted_img = img.convert('RGB')
-                    converted_img.save(output_path, 'GIF')
-                    return True, 'GIF', output_path
-                elif fmt == 'BMP':
-                    converted_img = img.convert('RGB')
-                    converted_img.save(output_path, 'BMP')
-                    return True, 'BMP', output_path
-                elif fmt == 'TIFF':
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        converted_img = img
-                    else:
-                        converted_img = img.convert('RGB')
-                    converted_img.save(output_path, 'TIFF')
-                    return True, 'TIFF', output_path
-                elif fmt == 'WEBP':
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        if img.mode == 'RGBA':
-                            converted_img = img.convert('RGBA')
-                        else:
-                            converted_img = img.convert('RGB')
-                    else:
-                        converted_img = img.convert('RGB')
-                    converted_img.save(output_path, 'WEBP')
-                    return True, 'WEBP', output_path
-                elif fmt == 'ICO':
-                    converted_img = img.convert('RGBA')
-                    converted_img.save(output_path, 'ICO')
-                    return True, 'ICO', output_path
-                elif fmt == 'TGA':
-                    converted_img = img.convert('RGB')
-                    converted_img.save(output_path, 'TGA')
-                    return True, 'TGA', output_path
-                elif fmt == 'PCX':
-                    converted_img = img.convert('RGB')
-                    converted_img.save(output_path, 'PCX')
-                    return True, 'PCX', output_path
-                else:
-                    # Default to PNG for unsupported formats
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        if img.mode == 'RGBA':
-                            converted_img = img.convert('RGBA')
-                        else:
-                            converted_img = img.convert('RGB')
-                    else:
-                        converted_img = img.convert('RGB')
-                    # Change output_path to .png
-                    png_output = output_path.rsplit('.', 1)[0] + '.png'
-                    converted_img.save(png_output, 'PNG')
-                    return True, 'PNG', png_output
+            with open_image(input_path) as img:
+                if not fit_memory_budget(img):
+                    return convert_oversized(input_path, output_path, fmt, input_name)
+                actual_format = save_with_pillow(img, output_path, fmt, save_options)
+                return True, actual_format, output_path
         # For advanced formats, try ImageMagick
         else:
             magick_cmd = check_imagemagick()
+            if magick_cmd and not imagemagick_can_write(fmt):
+                print(f"ImageMagick cannot write {fmt}")
+                return False, None, None
             if magick_cmd:
                 try:
-                    if magick_cmd == 'magick':
-                        cmd = ['magick', input_path, output_path]
-                    else:
-                        cmd = ['convert', input_path, output_path]
-                    result = subprocess.run(cmd, capture_output=True, check=True, timeout=30)
+                    run_imagemagick(magick_cmd, input_path, output_path, fmt, input_name)
                     return True, fmt, output_path
                 except subprocess.TimeoutExpired:
-                    print(f"ImageMagick conversion timed out for {input_path}")
+                    print(f"ImageMagick conversion timed out for {input_name or input_path}")
                     return False, None, None
                 except subprocess.CalledProcessError as e:
                     print(f"ImageMagick conversion failed: {e.stderr.decode()}")
@@ -135,16 +511,12 @@ def convert_image(input_path, output_path, output_format='PNG'):
                 # If ImageMagick is not available, convert to PNG as fallback
                 print(f"ImageMagick not available, converting {fmt} to PNG instead")
                 try:
-                    with Image.open(input_path) as img:
-                        if img.mode in ('RGBA', 'LA', 'P'):
-                            if img.mode == 'RGBA':
-                                converted_img = img.convert('RGBA')
-                            else:
-                                converted_img = img.convert('RGB')
-                        else:
-                            converted_img = img.convert('RGB')
-                        png_output = output_path.rsplit('.', 1)[0] + '.png'
-                        converted_img.save(png_output, 'PNG')
+                    with open_image(input_path) as img:
+                        if not fit_memory_budget(img):
+                            print(f"Image exceeds the {MEMORY_BUDGET} byte memory budget")
+                            return False, None, None
+                        png_output = png_fallback_target(output_path)
+                        save_with_pillow(img, png_output, 'PNG')
                         return True, 'PNG', png_output
                 except Exception as e:
                     print(f"Fallback conversion failed: {e}")
@@ -153,6 +525,233 @@ def convert_image(input_path, output_path, output_format='PNG'):
         print(f"Error converting image: {e}")
         return False, None, None
 
+def convert_image_bytes(data, output_format='PNG', input_name=None, preset=None, encoder_options=None):
+    """
+    Convert image bytes entirely in memory, e.g. inside a worker process.
+    
+    Returns:
+        (success, actual_format, output_bytes)
+    """
+    output = io.BytesIO()
+    success, actual_format, _ = convert_image(data, output, output_format, input_name=input_name,
+                                              preset=preset, encoder_options=encoder_options)
+    return success, actual_format, output.getvalue() if success else None
+
+# Encoders for one fan-out conversion run concurrently; Pillow's codecs
+# release the GIL while they compress
+FANOUT_WORKERS = int(os.environ.get('FORMATLY_FANOUT_WORKERS', min(4, os.cpu_count() or 1)))
+
+_encode_pool = None
+_encode_pool_lock = threading.Lock()
+
+def get_encode_pool():
+    global _encode_pool
+    with _encode_pool_lock:
+        if _encode_pool is None:
+            _encode_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='formatly-encode')
+        return _encode_pool
+
+def _reset_encode_pool():
+    # Pool threads don't survive fork; the child builds its own on first use
+    global _encode_pool, _encode_pool_lock
+    _encode_pool = None
+    _encode_pool_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_encode_pool)
+
+def supported_encoder_options(fmt, encoder_options):
+    """The subset of encoder_options that fmt accepts"""
+    spec = FORMAT_REGISTRY.get(fmt.upper())
+    if not spec or not encoder_options:
+        return {}
+    return {name: value for name, value in encoder_options.items() if name in spec['options']}
+
+# Widths produced by /upload's widths=responsive
+RESPONSIVE_WIDTHS = (320, 640, 1280, 2560)
+
+def fit_size(size, box):
+    """Largest size within box that keeps the aspect ratio, never upscaling"""
+    width, height = size
+    max_width, max_height = box
+    scale = min(max_width / width if max_width else 1, max_height / height if max_height else 1, 1)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def downscale(img, size):
+    """
+    Resize a decoded image down to size.
+    
+    Large reductions first shrink by an integer factor with reduce(), a
+    cheap box filter, leaving LANCZOS at least 2x to work with so the
+    result matches a full LANCZOS resize while touching far fewer pixels.
+    """
+    if size == img.size:
+        return img
+    if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        # Palette and bilevel images only resample with NEAREST
+        img = img.convert('RGBA' if img.has_transparency_data else 'RGB')
+    factor = min(img.width // size[0], img.height // size[1]) // 2
+    if factor >= 2:
+        img = img.reduce(factor)
+    return img.resize(size, Image.Resampling.LANCZOS)
+
+def build_pyramid(img, sizes):
+    """
+    Downscale img to every one of sizes in a single cascade.
+    
+    Sizes are produced largest first, each from the previous level rather
+    than from the full-resolution image, so every level only reads as
+    many pixels as the one above it.
+    
+    Returns:
+        Dict mapping each size to its image (img itself for its own size)
+    """
+    levels = {img.size: img}
+    current = img
+    for size in sorted(set(sizes) - {img.size}, key=lambda s: s[0] * s[1], reverse=True):
+        if current.width < size[0] or current.height < size[1]:
+            # Boxes of different shapes can make a smaller level narrower
+            current = img
+        levels[size] = current = downscale(current, size)
+    return levels
+
+def shared_view(img):
+    """A new Image object over the same pixel buffer, so threads can save it concurrently"""
+    return img._new(img.im)
+
+def _encode(img, output, fmt, save_options):
+    if is_path(output) and os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with timed('encode'):
+        img.save(output, FORMAT_REGISTRY[fmt]['pillow_format'], **save_options)
+
+def _convert_each(input_path, outputs, input_name, preset, encoder_options, reason):
+    """Fallback when the source can't be decoded once: convert every output separately"""
+    results = []
+    for spec in outputs:
+        fmt = spec['format'].upper()
+        if spec.get('size'):
+            results.append({'format': fmt, 'success': False, 'error': reason})
+            continue
+        success, actual_format, actual_output = convert_image(
+            input_path, spec['output'], fmt, input_name=input_name, preset=preset,
+            encoder_options=supported_encoder_options(fmt, encoder_options)
+        )
+        results.append({'format': fmt, 'success': success, 'actual_format': actual_format,
+                        'output': actual_output, 'size': None,
+                        'error': None if success else f"Conversion to {fmt} failed"})
+    return results
+
+def convert_image_multi(input_path, outputs, input_name=None, preset=None, encoder_options=None):
+    """
+    Convert one image to several formats and sizes, decoding it only once.
+    
+    Each distinct size and pixel mode is produced once and shared by every
+    output that needs it; the encoders then run concurrently on a thread
+    pool. Formats Pillow can't write are converted by ImageMagick from the
+    original input, or from a PNG of the resized image.
+    
+    Args:
+        input_path: Path to input image, or its bytes / a readable binary file object
+        outputs: List of dicts with 'format', 'output' (path or writable
+            stream) and optionally 'size', a (max_width, max_height) box
+        preset, encoder_options: As for convert_image; each output gets the
+            options its format supports
+    
+    Returns:
+        Manifest: one dict per output, in order, with 'format', 'success',
+        'actual_format', 'output' (where it was written), 'size' (pixel
+        dimensions, None if unknown) and 'error'
+    """
+    if isinstance(input_path, (bytes, bytearray, memoryview)):
+        input_path = io.BytesIO(input_path)
+    if not is_path(input_path):
+        # Every ImageMagick output needs its own copy of the source
+        input_path.seek(0)
+        input_path = io.BytesIO(input_path.read())
+    try:
+        img = open_image(input_path)
+    except Exception as e:
+        return _convert_each(input_path, outputs, input_name, preset, encoder_options,
+                             f"Resizing needs an input Pillow can read: {e}")
+    with img:
+        original_size = img.size
+        targets = {tuple(spec['size']): fit_size(original_size, spec['size']) for spec in outputs if spec.get('size')}
+        if (img.format == 'JPEG' and outputs and all(spec.get('size') for spec in outputs)
+                and original_size[0] * original_size[1] <= MAX_PIXELS):
+            # Only derivatives wanted: let libjpeg decode at the smallest
+            # DCT scale that still covers the largest of them
+            img.draft(img.mode, max(targets.values(), key=lambda s: s[0] * s[1]))
+        try:
+            fits = fit_memory_budget(img)
+        except ImageTooLarge as e:
+            return [{'format': spec['format'].upper(), 'success': False, 'error': str(e)} for spec in outputs]
+        if not fits or getattr(img, 'is_animated', False):
+            # Oversized images go through ImageMagick; animations need their frames
+            return _convert_each(input_path, outputs, input_name, preset, encoder_options,
+                                 'Resizing is not supported for this image')
+        with timed('decode'):
+            img.load()
+        with timed('resize'):
+            levels = build_pyramid(img, targets.values())
+        sized = {box: levels[size] for box, size in targets.items()}
+        sized[None] = img
+
+        modes = {}
+        futures = []
+        pool = get_encode_pool()
+        for spec in outputs:
+            fmt = spec['format'].upper()
+            box = tuple(spec['size']) if spec.get('size') else None
+            entry = {'format': fmt, 'success': False, 'actual_format': None, 'output': spec['output'],
+                     'size': None, 'error': None}
+            try:
+                save_options = resolve_encoder_options(fmt, preset, supported_encoder_options(fmt, encoder_options))
+            except InvalidEncoderOptions as e:
+                entry['error'] = str(e)
+                futures.append((entry, None))
+                continue
+            save_options.pop('max_fps', None)
+            source = sized[box]
+            if pillow_can_write(fmt):
+                registry = FORMAT_REGISTRY[fmt]
+                mode = source.mode if source.mode in registry['keep_modes'] else registry['convert_mode']
+                if (box, mode) not in modes:
+                    with timed('mode_convert'):
+                        modes[box, mode] = prepare_mode(source, fmt)
+                entry['actual_format'] = registry['result_format']
+                entry['size'] = list(source.size)
+                # Import the encoder here rather than racing to in the pool
+                load_pillow_plugin(registry['pillow_format'])
+                task = (_encode, shared_view(modes[box, mode]), spec['output'], fmt, save_options)
+            elif box is None:
+                original = input_path if is_path(input_path) else input_path.getvalue()
+                task = (convert_image, original, spec['output'], fmt, input_name)
+            else:
+                png = io.BytesIO()
+                save_with_pillow(source, png, 'PNG', {'compress_level': 1})
+                entry['size'] = list(source.size)
+                task = (convert_image, png.getvalue(), spec['output'], fmt, 'resized.png')
+            # Pool threads report their metrics back through this thread
+            futures.append((entry, pool.submit(metrics.call_collected, *task)))
+
+        results = []
+        for entry, future in futures:
+            if future is not None:
+                try:
+                    value, samples = future.result()
+                    metrics.merge(samples)
+                    if value is None:
+                        entry['success'] = True
+                    else:
+                        entry['success'], entry['actual_format'], entry['output'] = value
+                        if not entry['success']:
+                            entry['error'] = f"Conversion to {entry['format']} failed"
+                except Exception as e:
+                    print(f"Error encoding {entry['format']}: {e}")
+                    entry['error'] = str(e)
+            results.append(entry)
+        return results
+
 def convert_to_png(input_path, output_path):
     """
     Convert image to PNG format (backward compatibility).
@@ -0,0 +1,158 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+
+class Janitor:
+    """
+    Background sweeper for outputs/ and uploads/.
+
+    Deletes files older than `ttl` seconds, then the oldest files until the
+    directories together fit in `max_bytes`. Files are tracked in an
+    in-memory index fed by `track()`, so a sweep does not list the
+    directories; they are rescanned only every `rescan_every` sweeps to pick
+    up files written by other processes or left behind by crashes. Hidden
+    files (.gitkeep) are never touched. Processes sweeping the same
+    directories take turns through a lock file at `lock_path`, which by
+    default is in the temp directory, outside the (served) directories.
+    """
+
+    def __init__(self, directories, ttl=3600, max_bytes=1024 * 1024 * 1024, interval=60,
+                 rescan_every=10, on_remove=None, lock_path=None):
+        self.directories = [os.path.abspath(d) for d in directories]
+        if lock_path is None:
+            digest = hashlib.sha256('\0'.join(self.directories).encode()).hexdigest()[:16]
+            lock_path = os.path.join(tempfile.gettempdir(), f"formatly-janitor-{digest}.lock")
+        self.lock_path = lock_path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.rescan_every = rescan_every
+        self.on_remove = on_remove
+        self.removed = 0
+        self._files = {}
+        self._lock = threading.Lock()
+        self._sweeps = 0
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def track(self, path):
+        """Add a newly written file to the index"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            self._files[os.path.abspath(path)] = (st.st_mtime, st.st_size)
+
+    def forget(self, path):
+        with self._lock:
+            self._files.pop(os.path.abspath(path), None)
+
+    def rescan(self):
+        """Rebuild the index from the directories"""
+        files = {}
+        for directory in self.directories:
+            try:
+                entries = os.scandir(directory)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    files[entry.path] = (st.st_mtime, st.st_size)
+        with self._lock:
+            self._files = files
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(size for _, size in self._files.values())
+
+    def _remove(self, paths):
+        removed = []
+        for path in paths:
+            try:
+                os.remove(path)
+                removed.append(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Janitor could not remove {path}: {e}")
+                continue
+            self.forget(path)
+        self.removed += len(removed)
+        if removed and self.on_remove:
+            self.on_remove(removed)
+        return removed
+
+    def _try_lock(self):
+        # Only one process per host sweeps at a time; the others skip
+        fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def sweep(self, now=None):
+        """
+        Run one pass: expire by age, then evict oldest-first down to the quota.
+
+        Returns:
+            List of removed paths
+        """
+        fd = self._try_lock()
+        if fd is None:
+            return []
+        try:
+            if self._sweeps % self.rescan_every == 0:
+                self.rescan()
+            self._sweeps += 1
+            now = time.time() if now is None else now
+            with self._lock:
+                by_age = sorted(self._files.items(), key=lambda item: item[1][0])
+            expired = [path for path, (mtime, _) in by_age if now - mtime > self.ttl]
+            removed = self._remove(expired)
+
+            total = self.total_bytes()
+            expired = set(expired)
+            evict = []
+            for path, (mtime, size) in by_age:
+                if total <= self.max_bytes:
+                    break
+                if path not in expired:
+                    evict.append(path)
+                    total -= size
+            return removed + self._remove(evict)
+        finally:
+            os.close(fd)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Janitor sweep failed: {e}")
+
+    def start(self):
+        """Start the sweeper thread once per process (safe to call repeatedly)"""
+        if self.interval <= 0 or (self._pid == os.getpid() and self._thread.is_alive()):
+            return
+        # Threads do not survive fork, so a preloaded app starts one per worker
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='formatly-janitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,181 @@
+import json
+import os
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
+import metrics
+
+# Finished jobs are kept this long so clients can still poll their result
+JOB_RETENTION = 3600
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at capacity"""
+
+
+class JobTimeout(BaseException):
+    """
+    Raised inside a worker when a job exceeds its time limit.
+
+    A BaseException so the converters' catch-all handlers let it through.
+    """
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=10, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return closing(conn)
+
+
+def _set_state(db_path, job_id, state, result=None, error=None):
+    with _connect(db_path) as conn:
+        conn.execute(
+            'UPDATE jobs SET state = ?, result = ?, error = ?, updated = ? WHERE id = ?',
+            (state, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+        )
+
+
+def _on_alarm(signum, frame):
+    raise JobTimeout()
+
+
+def run_job(db_path, job_id, timeout, fn, args, kwargs):
+    """
+    Worker-side wrapper: mark the job running and enforce its time limit.
+
+    Returns (fn's value, metric samples to merge in the parent).
+    """
+    _set_state(db_path, job_id, 'running')
+    signal.signal(signal.SIGALRM, _on_alarm)
+    signal.alarm(max(1, int(timeout)))
+    try:
+        return metrics.call_collected(fn, *args, **kwargs)
+    finally:
+        signal.alarm(0)
+
+
+class JobQueue:
+    """
+    Bounded process pool with job state kept in SQLite.
+
+    Work runs in this process's pool, but state lives in a shared database so
+    any gunicorn worker can answer a status poll. `submit` raises QueueFull
+    once `max_pending` jobs are queued or running here.
+    """
+
+    def __init__(self, db_path, max_workers=None, max_pending=None, timeout=60):
+        self.db_path = db_path
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 4
+        self.timeout = timeout
+        self._executor = None
+        self._futures = {}
+        self._done = {}
+        self._lock = threading.Lock()
+        with _connect(db_path) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, state TEXT, result TEXT, error TEXT, '
+                'created REAL, updated REAL)'
+            )
+
+    def _get_executor(self):
+        # Created lazily so the pool is not forked along with a preloaded app
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def pending(self):
+        with self._lock:
+            return len(self._futures)
+
+    def running(self):
+        """Number of jobs a worker process is executing right now"""
+        with self._lock:
+            # The executor marks a few queued futures running early, so cap it
+            return min(sum(f.running() for f in self._futures.values()), self.max_workers)
+
+    def submit(self, fn, *args, on_result=None, on_error=None, **kwargs):
+        """
+        Queue `fn(*args, **kwargs)` and return the new job id.
+
+        Args:
+            on_result: Called in this process with fn's return value; its
+                return value (a JSON-serialisable dict) is stored as the job
+                result. Raising marks the job failed instead.
+            on_error: Called with the exception to build the stored error message
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            if len(self._futures) >= self.max_pending:
+                raise QueueFull()
+            with _connect(self.db_path) as conn:
+                conn.execute('DELETE FROM jobs WHERE updated < ?', (now - JOB_RETENTION,))
+                conn.execute(
+                    'INSERT INTO jobs (id, state, created, updated) VALUES (?, ?, ?, ?)',
+                    (job_id, 'queued', now, now)
+                )
+            future = self._get_executor().submit(run_job, self.db_path, job_id, self.timeout, fn, args, kwargs)
+            self._futures[job_id] = future
+            self._done[job_id] = threading.Event()
+        future.add_done_callback(lambda f: self._finish(job_id, f, on_result, on_error))
+        return job_id
+
+    def _finish(self, job_id, future, on_result, on_error):
+        try:
+            try:
+                value, samples = future.result()
+                metrics.merge(samples)
+                result = on_result(value) if on_result else value
+                _set_state(self.db_path, job_id, 'done', result=result)
+            except JobTimeout:
+                _set_state(self.db_path, job_id, 'failed', error=f'Conversion timed out after {self.timeout} seconds')
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM-killed); start a fresh pool for later jobs
+                with self._lock:
+                    self._executor = None
+                _set_state(self.db_path, job_id, 'failed', error='Conversion worker crashed')
+            except Exception as e:
+                _set_state(self.db_path, job_id, 'failed', error=on_error(e) if on_error else str(e))
+        finally:
+            with self._lock:
+                self._futures.pop(job_id, None)
+                done = self._done.pop(job_id, None)
+            if done is not None:
+                done.set()
+
+    def get(self, job_id):
+        """Return the job's state as a dict, or None if it is unknown"""
+        with _connect(self.db_path) as conn:
+            row = conn.execute(
+                'SELECT id, state, result, error, created, updated FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'state': row[1],
+            'result': json.loads(row[2]) if row[2] else None,
+            'error': row[3],
+            'created': row[4],
+            'updated': row[5],
+        }
+
+    def wait(self, job_id, timeout=None):
+        """Block until a job submitted by this process finishes, then return it"""
+        with self._lock:
+            done = self._done.get(job_id)
+        if done is not None:
+            done.wait(timeout if timeout is not None else self.timeout + 5)
+        return self.get(job_id)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,170 @@
+"""
+Load test a running Formatly server, e.g. to check a gunicorn.conf.py
+change: N concurrent clients upload images to /upload?wait=1 and the run
+reports throughput, latency percentiles and how many requests were shed.
+
+    gunicorn -c gunicorn.conf.py wsgi:app &
+    python loadtest.py --url http://127.0.0.1:8000 --concurrency 16 --duration 30 --max-p95-ms 2000
+
+All clients come from one IP, so run the server with RATE_LIMIT=0, or list
+keys from its API_KEYS with --api-key to spread clients over their buckets.
+The global admission limit still applies.
+"""
+import argparse
+import io
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from benchmark import percentile, synthetic_image
+
+
+def multipart_body(fields, files):
+    """
+    Encode a multipart/form-data body.
+
+    Args:
+        fields: Dict of form field name -> value
+        files: Dict of field name -> (filename, bytes)
+
+    Returns:
+        (body bytes, content type)
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def sample_upload(size, input_format='JPEG'):
+    buf = io.BytesIO()
+    synthetic_image(size, 'RGB').save(buf, input_format)
+    return buf.getvalue()
+
+
+def send(url, body, content_type, api_key, timeout):
+    """POST one upload; returns (status code, seconds, Retry-After seconds or 0)"""
+    headers = {'Content-Type': content_type}
+    if api_key:
+        headers['X-API-Key'] = api_key
+    req = urllib.request.Request(url, data=body, method='POST', headers=headers)
+    start = time.perf_counter()
+    retry_after = 0
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+        retry_after = float(e.headers.get('Retry-After') or 0)
+    except OSError:
+        status = 0
+    return status, time.perf_counter() - start, retry_after
+
+
+def run(url, concurrency, duration, make_request, timeout=120, api_keys=None):
+    """
+    Upload from `concurrency` threads for `duration` seconds.
+
+    make_request() returns the (body, content type) of the next upload.
+    Clients take turns over api_keys, if given, for their X-API-Key.
+    Clients that are shed wait out Retry-After like a well-behaved client.
+
+    Returns:
+        List of (status, seconds); status 0 means the connection failed
+    """
+    results = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(api_key):
+        while time.monotonic() < deadline:
+            status, seconds, retry_after = send(url, *make_request(), api_key, timeout)
+            with lock:
+                results.append((status, seconds))
+            if retry_after:
+                time.sleep(max(0, min(retry_after, deadline - time.monotonic())))
+
+    threads = [threading.Thread(target=client, args=(api_keys[i % len(api_keys)] if api_keys else None,))
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(results, elapsed):
+    """Throughput, latency percentiles of successful requests and counts by status"""
+    ok = [seconds for status, seconds in results if status == 200]
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': len(results),
+        'ok': len(ok),
+        'shed': statuses.get('429', 0) + statuses.get('503', 0),
+        'errors': len(results) - len(ok) - statuses.get('429', 0) - statuses.get('503', 0),
+        'rps': round(len(ok) / elapsed, 2) if elapsed else 0,
+        'p50_ms': round(percentile(ok, 50) * 1000, 1) if ok else None,
+        'p95_ms': round(percentile(ok, 95) * 1000, 1) if ok else None,
+        'p99_ms': round(percentile(ok, 99) * 1000, 1) if ok else None,
+        'statuses': statuses,
+    }
+
+
+def check(summary, max_p95_ms=None, max_error_rate=0.01):
+    """Return a list of failed expectations"""
+    failures = []
+    if not summary['ok']:
+        failures.append('no request succeeded')
+    if summary['requests'] and summary['errors'] / summary['requests'] > max_error_rate:
+        failures.append(f"error rate {summary['errors'] / summary['requests']:.1%} over {max_error_rate:.1%}")
+    if max_p95_ms and summary['p95_ms'] and summary['p95_ms'] > max_p95_ms:
+        failures.append(f"p95 {summary['p95_ms']}ms over {max_p95_ms}ms")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test a running Formatly server')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20, help='Seconds to run')
+    parser.add_argument('--size', default='640x480', help='Upload dimensions, WxH')
+    parser.add_argument('--format', default='WEBP', help='Output format to request')
+    parser.add_argument('--cache-hits', action='store_true', help='Send identical bytes so the result cache answers')
+    parser.add_argument('--api-key', action='append', help="One of the server's API_KEYS; repeat to use several")
+    parser.add_argument('--max-p95-ms', type=float, help='Fail if p95 latency is higher')
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help='Fail above this share of errors')
+    args = parser.parse_args(argv)
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    image = sample_upload((width, height))
+
+    def make_request():
+        # Bytes after the JPEG end marker are ignored by decoders but make
+        # every upload distinct, so each one is really converted
+        data = image if args.cache_hits else image + uuid.uuid4().bytes
+        return multipart_body({'output_format': args.format}, {'file': ('load.jpg', data)})
+
+    url = args.url.rstrip('/') + '/upload?wait=1'
+    start = time.monotonic()
+    results = run(url, args.concurrency, args.duration, make_request, api_keys=args.api_key)
+    summary = summarize(results, time.monotonic() - start)
+    print(json.dumps(summary, indent=2))
+    failures = check(summary, args.max_p95_ms, args.max_error_rate)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
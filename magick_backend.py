@@ -0,0 +1,208 @@
+import json
+import os
+import queue
+import select
+import subprocess
+import sys
+import threading
+import time
+
+# 'subprocess' forks `magick` per conversion; 'pool' keeps long-lived Wand
+# workers so ImageMagick startup and delegate loading are paid once
+BACKEND = os.environ.get('FORMATLY_MAGICK_BACKEND', 'subprocess')
+POOL_SIZE = int(os.environ.get('FORMATLY_MAGICK_WORKERS', 1))
+STARTUP_TIMEOUT = 10
+WORKER_COMMAND = [sys.executable, os.path.abspath(__file__)]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class WorkerUnavailable(Exception):
+    """Raised when a persistent ImageMagick worker cannot be started"""
+
+
+class MagickWorker:
+    """One long-lived worker process speaking JSON lines over stdin/stdout"""
+
+    def __init__(self, command):
+        self.command = command
+        try:
+            self.process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, text=True, bufsize=1
+            )
+            line = self._readline(STARTUP_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            self.kill()
+            raise WorkerUnavailable(str(e))
+        if line != 'ready':
+            self.kill()
+            raise WorkerUnavailable(line or 'worker exited during startup')
+
+    def _readline(self, timeout):
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            raise subprocess.TimeoutExpired(self.command, timeout)
+        return self.process.stdout.readline().strip()
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def kill(self):
+        process = getattr(self, 'process', None)
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+
+    def convert(self, input_path, output_path, timeout):
+        """Run one conversion, raising the same errors as subprocess.run(check=True)"""
+        request = {'input': os.path.abspath(input_path), 'output': os.path.abspath(output_path)}
+        try:
+            self.process.stdin.write(json.dumps(request) + '\n')
+            self.process.stdin.flush()
+            line = self._readline(timeout)
+        except OSError as e:
+            self.kill()
+            raise subprocess.CalledProcessError(1, self.command, stderr=str(e).encode())
+        except BaseException:
+            # Timed out or interrupted (e.g. JobTimeout): the reply may still
+            # arrive and would be read by the next caller, so the worker goes
+            self.kill()
+            raise
+        if not line:
+            self.kill()
+            raise subprocess.CalledProcessError(1, self.command, stderr=b'ImageMagick worker exited')
+        response = json.loads(line)
+        if not response['ok']:
+            raise subprocess.CalledProcessError(1, self.command, stderr=response['error'].encode())
+
+
+class MagickPool:
+    """
+    Fixed-size pool of MagickWorker processes.
+
+    Workers are started on demand and replaced after a timeout or crash.
+    If one fails to start (e.g. Wand isn't installed) no more are tried;
+    every later run raises WorkerUnavailable straight away.
+    """
+
+    def __init__(self, size=POOL_SIZE, command=None):
+        self.size = size
+        self.command = command or WORKER_COMMAND
+        self.unavailable = None
+        self._idle = queue.LifoQueue()
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self, timeout):
+        if self.unavailable is not None:
+            raise WorkerUnavailable(self.unavailable)
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_start = self._started < self.size
+            if can_start:
+                self._started += 1
+        if can_start:
+            try:
+                return MagickWorker(self.command)
+            except WorkerUnavailable as e:
+                with self._lock:
+                    self._started -= 1
+                    if self.unavailable is None:
+                        print(f"ImageMagick worker pool unavailable ({e}), falling back to subprocess")
+                    self.unavailable = str(e)
+                raise
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise subprocess.TimeoutExpired(self.command, timeout)
+
+    def _release(self, worker):
+        if worker.alive():
+            self._idle.put(worker)
+        else:
+            with self._lock:
+                self._started -= 1
+
+    def run(self, input_path, output_path, timeout=30):
+        """Convert with a worker; `timeout` covers waiting for one as well as the conversion"""
+        deadline = time.monotonic() + timeout
+        worker = self._acquire(timeout)
+        try:
+            worker.convert(input_path, output_path, max(0, deadline - time.monotonic()))
+        finally:
+            self._release(worker)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._started = 0
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = MagickPool()
+        return _pool
+
+
+def _reset_after_fork():
+    # A forked child must not share the parent's worker pipes
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def run_conversion(magick_cmd, input_path, output_path, timeout=30, limits=None):
+    """
+    Convert a file with ImageMagick using the configured backend.
+
+    `limits` are extra `-limit` arguments; they are per-command, so such
+    conversions always go through a fresh subprocess.
+
+    Raises subprocess.TimeoutExpired or subprocess.CalledProcessError on
+    failure, whichever backend ran the conversion.
+    """
+    if BACKEND == 'pool' and not limits:
+        try:
+            get_pool().run(input_path, output_path, timeout)
+            return
+        except WorkerUnavailable:
+            pass
+    cmd = [magick_cmd] + (limits or []) + [input_path, output_path]
+    subprocess.run(cmd, capture_output=True, check=True, timeout=timeout)
+
+
+def serve():
+    """Worker process main loop: convert files named on stdin with Wand"""
+    try:
+        from wand.image import Image as WandImage  # type: ignore
+    except ImportError as e:
+        print(f"Wand is not installed: {e}", flush=True)
+        return
+    print('ready', flush=True)
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            with WandImage(filename=request['input']) as img:
+                img.save(filename=request['output'])
+            response = {'ok': True}
+        except Exception as e:
+            response = {'ok': False, 'error': str(e)}
+        print(json.dumps(response), flush=True)
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,206 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers fast in-memory encodes up to the job timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REGISTRY = {}
+
+# Set while call_collected() runs, so worker processes can ship their
+# observations back to the parent instead of recording into their own copy
+_local = threading.local()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _record(self, key, value):
+        raise NotImplementedError
+
+    def _observe(self, value, labels):
+        key = self._key(labels)
+        pending = getattr(_local, 'pending', None)
+        if pending is not None:
+            pending.append((self.name, key, value))
+        else:
+            self._record(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self._observe(amount, labels)
+
+    def _record(self, key, value):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [('_total', key, (), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    """Gauge whose value is read from a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function=None):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        if self.function is None:
+            return []
+        return [('', (), (), self.function())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        self._observe(value, labels)
+
+    def _record(self, key, value):
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+        return counts[-1]
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    samples.append(('_bucket', key, (('le', _format_value(float(bound))),), count))
+                samples.append(('_sum', key, (), total))
+                samples.append(('_count', key, (), counts[-1]))
+        return samples
+
+
+STAGE_SECONDS = Histogram(
+    'formatly_stage_seconds', 'Time spent in each conversion stage', ['stage']
+)
+CONVERSIONS = Counter(
+    'formatly_conversions', 'Conversions by input format, output format and result', ['input', 'output', 'result']
+)
+BYTES_IN = Counter(
+    'formatly_bytes_in', 'Uploaded bytes converted, by format pair', ['input', 'output']
+)
+BYTES_OUT = Counter(
+    'formatly_bytes_out', 'Converted output bytes, by format pair', ['input', 'output']
+)
+QUEUE_DEPTH = Gauge('formatly_queue_depth', 'Conversion jobs queued or running in this process')
+WORKERS_BUSY = Gauge('formatly_workers_busy', 'Conversion worker processes currently running a job')
+WORKER_UTILIZATION = Gauge('formatly_worker_utilization', 'Fraction of conversion workers that are busy')
+REJECTIONS = Counter(
+    'formatly_rejections', 'Requests refused before reading the body, by reason', ['reason']
+)
+INFLIGHT = Gauge('formatly_inflight_requests', 'Conversion requests in flight across all workers on this host')
+
+
+@contextmanager
+def timed(stage):
+    """Record how long the block takes under formatly_stage_seconds{stage=...}"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_conversion(input_name, output_format, success, bytes_in=0, bytes_out=0):
+    """Count a finished conversion; the input format is taken from the file extension"""
+    extension = input_name.rsplit('.', 1)[1] if input_name and '.' in input_name else ''
+    input_format = extension.upper() or 'UNKNOWN'
+    CONVERSIONS.inc(input=input_format, output=output_format, result='success' if success else 'failure')
+    if success:
+        BYTES_IN.inc(bytes_in, input=input_format, output=output_format)
+        BYTES_OUT.inc(bytes_out, input=input_format, output=output_format)
+
+
+def call_collected(fn, *args, **kwargs):
+    """
+    Run fn and return (value, samples) instead of recording its metrics.
+
+    Used in worker processes; pass the samples to merge() in the parent.
+    """
+    _local.pending = []
+    try:
+        value = fn(*args, **kwargs)
+        return value, _local.pending
+    finally:
+        _local.pending = None
+
+
+def merge(samples):
+    """Record observations collected by call_collected() in another process or thread"""
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        # Nested collection: pass them on to whoever is collecting here
+        pending.extend(samples)
+        return
+    for name, key, value in samples:
+        REGISTRY[name]._record(key, value)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    return '\n'.join(metric.render() for metric in REGISTRY.values()) + '\n'
@@ -0,0 +1,117 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class RateLimiter:
+    """
+    Per-client token buckets plus a host-wide cap on in-flight requests.
+
+    State lives in a small SQLite database so every gunicorn worker on the
+    host enforces the same limits. Each bucket holds up to `burst` tokens
+    and refills at `rate` tokens per second; a request spends one. Admission
+    slots are rows in the same database, and slots left behind by a crashed
+    worker expire after `slot_ttl` seconds. `rate=0` or `max_inflight=0`
+    disables that check.
+    """
+
+    def __init__(self, db_path, rate=2.0, burst=20, max_inflight=0, slot_ttl=300, idle_ttl=3600):
+        self.db_path = db_path
+        self.rate = rate
+        self.burst = burst
+        self.max_inflight = max_inflight
+        self.slot_ttl = slot_ttl
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()
+        self._checks = 0
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets (client TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS inflight (id TEXT PRIMARY KEY, started REAL)')
+
+    def _connect(self):
+        # Decisions sit on the request path, so each thread keeps its
+        # connection open instead of reconnecting per check
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Limiter state is disposable; don't wait on fsync for it
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        return conn
+
+    def consume(self, client, now=None):
+        """
+        Spend one token from client's bucket.
+
+        Returns:
+            0 if allowed, else seconds until a token is available
+        """
+        if self.rate <= 0:
+            return 0
+        now = time.time() if now is None else now
+        conn = self._transaction()
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE client = ?', (client,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+            retry_after = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not retry_after:
+                tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO buckets (client, tokens, updated) VALUES (?, ?, ?)',
+                         (client, tokens, now))
+            self._checks += 1
+            if self._checks % 1000 == 0:
+                # Full buckets of clients that went quiet carry no state worth keeping
+                conn.execute('DELETE FROM buckets WHERE updated < ?', (now - self.idle_ttl,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return retry_after
+
+    def admit(self, now=None):
+        """
+        Take an in-flight slot.
+
+        Returns:
+            Slot id to pass to release(), '' if admission is disabled, or
+            None when every slot is taken
+        """
+        if self.max_inflight <= 0:
+            return ''
+        now = time.time() if now is None else now
+        conn = self._transaction()
+        try:
+            conn.execute('DELETE FROM inflight WHERE started < ?', (now - self.slot_ttl,))
+            (count,) = conn.execute('SELECT COUNT(*) FROM inflight').fetchone()
+            slot = None
+            if count < self.max_inflight:
+                slot = uuid.uuid4().hex
+                conn.execute('INSERT INTO inflight (id, started) VALUES (?, ?)', (slot, now))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return slot
+
+    def release(self, slot):
+        if slot:
+            self._connect().execute('DELETE FROM inflight WHERE id = ?', (slot,))
+
+    def inflight(self):
+        (count,) = self._connect().execute('SELECT COUNT(*) FROM inflight').fetchone()
+        return count
+
+
+def retry_after_header(seconds):
+    """Retry-After is whole seconds, at least 1"""
+    return str(max(1, math.ceil(seconds)))
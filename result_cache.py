@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CHUNK_SIZE = 64 * 1024
+
+
+def hash_stream(stream):
+    """
+    Hash a file-like object in chunks and rewind it.
+
+    Returns:
+        Hex sha256 digest of the stream contents
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def make_key(content_hash, output_format, options=None):
+    """Build a cache key from the input hash, target format and encoder options"""
+    payload = json.dumps([content_hash, output_format.upper(), options or {}], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed cache of conversion outputs.
+
+    Outputs live in `directory` as `<key>.<ext>` so they can be served by the
+    normal download route. Entries are evicted least-recently-used once the
+    total size exceeds `max_bytes`. The index is the SQLite database at
+    `db_path`, so every gunicorn worker shares one index and one budget, and
+    a restarted process keeps its warm cache. It lists every output, so keep
+    it out of `directory`, which is served. Hit and miss counters are per
+    process.
+    """
+
+    def __init__(self, directory, db_path, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, filename TEXT, format TEXT, size INTEGER, sha256 TEXT, '
+            'created REAL, last_used REAL, extra TEXT)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)')
+        conn.execute('CREATE INDEX IF NOT EXISTS entries_filename ON entries (filename)')
+
+    def _connect(self):
+        # Looked up on every upload, so each thread keeps its connection open
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key):
+        """Return the entry for `key` if its output is still on disk, else None"""
+        conn = self._connect()
+        row = conn.execute('SELECT filename, format, size, sha256, created, extra FROM entries WHERE key = ?',
+                           (key,)).fetchone()
+        if row is not None and not os.path.exists(self._path(row[0])):
+            conn.execute('DELETE FROM entries WHERE key = ? AND filename = ?', (key, row[0]))
+            row = None
+        if row is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        now = time.time()
+        conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (now, key))
+        filename, output_format, size, sha256, created, extra = row
+        return {'filename': filename, 'format': output_format, 'size': size, 'sha256': sha256, 'created': created,
+                'last_used': now, **json.loads(extra)}
+
+    def put(self, key, output_path, output_format, **extra):
+        """Record a finished conversion and evict old entries if over budget"""
+        with open(output_path, 'rb') as f:
+            sha256 = hash_stream(f)
+        entry = {
+            'filename': os.path.basename(output_path),
+            'format': output_format,
+            'size': os.path.getsize(output_path),
+            'sha256': sha256,
+            'created': time.time(),
+            'last_used': time.time(),
+            **extra,
+        }
+        evicted = []
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO entries (key, filename, format, size, sha256, created, last_used, extra) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, entry['filename'], output_format, entry['size'], sha256, entry['created'], entry['last_used'],
+                 json.dumps(extra))
+            )
+            (total,) = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()
+            if total > self.max_bytes:
+                # Oldest first, never the entry just added
+                for old_key, filename, size in conn.execute(
+                        'SELECT key, filename, size FROM entries WHERE key != ? ORDER BY last_used', (key,)).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute('DELETE FROM entries WHERE key = ?', (old_key,))
+                    evicted.append(filename)
+                    total -= size
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        for filename in evicted:
+            self._count('evictions')
+            try:
+                os.remove(self._path(filename))
+            except OSError:
+                pass
+        return dict(entry)
+
+    def content_hash(self, filename):
+        """sha256 of the bytes of the output named filename, or None if it isn't cached"""
+        row = self._connect().execute('SELECT sha256 FROM entries WHERE filename = ?', (filename,)).fetchone()
+        return row[0] if row else None
+
+    def discard(self, *filenames):
+        """Forget any entry whose output file is one of `filenames`"""
+        if filenames:
+            self._connect().execute(
+                f"DELETE FROM entries WHERE filename IN ({', '.join('?' * len(filenames))})", filenames)
+
+    def stats(self):
+        entries, total = self._connect().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        with self._lock:
+            return {
+                'entries': entries,
+                'bytes': total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
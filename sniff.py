@@ -0,0 +1,200 @@
+import io
+import os
+import struct
+import warnings
+from PIL import Image  # type: ignore
+import image_converter
+
+# Only the common plugins; sniff() imports others as their formats turn up
+Image.preinit()
+
+# How much of an upload is buffered to identify it; headers that need more
+# (e.g. JPEGs with huge EXIF blocks) are accepted and checked on decode
+SNIFF_BYTES = int(os.environ.get('FORMATLY_SNIFF_BYTES', 64 * 1024))
+
+# (offset, signature, format), checked before asking Pillow, which can't
+# identify every format uploads are accepted in
+MAGIC = [
+    (0, b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (0, b'\xff\xd8\xff', 'JPEG'),
+    (0, b'GIF87a', 'GIF'),
+    (0, b'GIF89a', 'GIF'),
+    (0, b'II*\x00', 'TIFF'),
+    (0, b'MM\x00*', 'TIFF'),
+    (0, b'8BPS', 'PSD'),
+    (0, b'%PDF', 'PDF'),
+    (0, b'%!PS', 'EPS'),
+    (0, b'\xc5\xd0\xd3\xc6', 'EPS'),
+    (0, b'v/1\x01', 'EXR'),
+    (0, b'gimp xcf', 'XCF'),
+    (0, b'DDS ', 'DDS'),
+    (0, b'\x1f\x8b', 'GZIP'),
+]
+
+# ISO base media brands at offset 8 of an 'ftyp' box
+HEIF_BRANDS = {b'heic': 'HEIC', b'heix': 'HEIC', b'hevc': 'HEIC', b'mif1': 'HEIC', b'msf1': 'HEIC',
+               b'avif': 'AVIF', b'avis': 'AVIF'}
+
+# Upload extensions each detected format may carry
+FORMAT_EXTENSIONS = {
+    'PNG': {'png', 'apng'},
+    'JPEG': {'jpg', 'jpeg', 'jfif'},
+    'MPO': {'jpg', 'jpeg', 'jfif'},
+    'TIFF': {'tiff', 'tif', 'dng'},
+    'PDF': {'pdf', 'ai'},
+    'EPS': {'eps', 'ai'},
+    'HEIC': {'heic', 'avif'},
+    'AVIF': {'avif', 'heic'},
+    'HEIF': {'heic', 'avif'},
+    'GZIP': {'svgz'},
+}
+
+# No reliable signature: camera raw is a family of formats and PIC covers
+# several unrelated ones, so these are left for the decoder to validate
+UNSNIFFABLE = {'raw', 'pic'}
+
+
+class UploadRejected(Exception):
+    """Raised while an upload is still streaming in, to stop reading it"""
+
+    def __init__(self, message, status=415):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if filename and '.' in filename else ''
+
+
+def detect_magic(header):
+    """Identify a format from its signature, or None"""
+    for offset, signature, fmt in MAGIC:
+        if header[offset:offset + len(signature)] == signature:
+            return fmt
+    if header[:4] == b'RIFF':
+        if header[8:12] == b'WEBP':
+            return 'WEBP'
+        if header[8:11] == b'CDR':
+            return 'CDR'
+    if header[4:8] == b'ftyp':
+        return HEIF_BRANDS.get(header[8:12])
+    # SVG is XML, possibly behind a declaration, doctype or comments
+    text = header[:4096].lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    if text.startswith(b'<') and b'<svg' in text:
+        return 'SVG'
+    return None
+
+
+def webp_size(header):
+    """Canvas size from a WEBP header; Pillow's plugin needs the whole file"""
+    chunk = header[12:16]
+    try:
+        if chunk == b'VP8X':
+            width = int.from_bytes(header[24:27], 'little') + 1
+            height = int.from_bytes(header[27:30], 'little') + 1
+            return width, height
+        if chunk == b'VP8 ' and header[23:26] == b'\x9d\x01\x2a':
+            width, height = struct.unpack('<HH', header[26:30])
+            return width & 0x3fff, height & 0x3fff
+        if chunk == b'VP8L' and header[20:21] == b'\x2f':
+            bits = int.from_bytes(header[21:25], 'little')
+            return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    except struct.error:
+        pass
+    return None
+
+
+def pillow_identify(header):
+    """Format and size from Pillow's header parser, or (None, None)"""
+    try:
+        with warnings.catch_warnings():
+            # Truncated headers make some plugins warn (e.g. TIFF EXIF)
+            warnings.simplefilter('ignore')
+            with Image.open(io.BytesIO(header)) as img:
+                return img.format, img.size
+    except Image.DecompressionBombError:
+        raise UploadRejected('Image dimensions are too large', status=413)
+    except Exception:
+        return None, None
+
+
+def sniff(header, filename, complete=False):
+    """
+    Check an upload's leading bytes against its filename.
+
+    Args:
+        header: The first bytes of the file
+        filename: Client-supplied filename
+        complete: True once header holds the whole file or SNIFF_BYTES
+
+    Returns:
+        Dict with 'format' and 'size' (either may be None) once a decision
+        is made, or None if more bytes are needed. Raises UploadRejected.
+    """
+    ext = extension(filename)
+    fmt = detect_magic(header)
+    # Formats without a signature (ICO, TGA, PCX) are expected from their extension
+    image_converter.load_pillow_plugin(fmt or ext)
+    pillow_format, size = pillow_identify(header)
+    if fmt is None:
+        fmt = pillow_format
+    if fmt == 'WEBP':
+        size = webp_size(header)
+
+    if fmt is None:
+        if not complete:
+            return None
+        if ext in UNSNIFFABLE:
+            return {'format': None, 'size': None}
+        raise UploadRejected('File is not a recognised image')
+
+    if ext not in UNSNIFFABLE and ext not in FORMAT_EXTENSIONS.get(fmt, {fmt.lower()}):
+        raise UploadRejected(f"File content is {fmt}, which does not match its .{ext} extension")
+
+    if size is None and not complete and fmt in Image.OPEN:
+        # Pillow can read this format but hasn't seen enough of the header yet
+        return None
+    if size is not None and size[0] * size[1] > image_converter.MAX_PIXELS:
+        raise UploadRejected(f"{size[0]}x{size[1]} exceeds the {image_converter.MAX_PIXELS} pixel limit", status=413)
+    return {'format': fmt, 'size': size}
+
+
+class SniffingStream:
+    """
+    File container for the multipart parser that vets an upload as it arrives.
+
+    The first bytes are held back until sniff() accepts them, then everything
+    is passed through to `target` (the spool the conversion reads from). A
+    rejection raises UploadRejected from write(), which aborts parsing so the
+    rest of the body is never buffered.
+    """
+
+    def __init__(self, target, filename, sniff_bytes=None):
+        self.target = target
+        self.filename = filename
+        self.sniff_bytes = sniff_bytes or SNIFF_BYTES
+        self.info = None
+        self._header = bytearray()
+
+    def _decide(self, complete):
+        self.info = sniff(bytes(self._header), self.filename, complete)
+        if self.info is not None:
+            self.target.write(self._header)
+            self._header = None
+
+    def write(self, data):
+        if self.info is not None:
+            return self.target.write(data)
+        self._header += data
+        self._decide(complete=len(self._header) >= self.sniff_bytes)
+        return len(data)
+
+    def seek(self, *args):
+        # The parser rewinds the container once the part has been read
+        if self.info is None:
+            self._decide(complete=True)
+        return self.target.seek(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
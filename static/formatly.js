@@ -0,0 +1,269 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const formatSelect = document.getElementById('formatSelect');
+    formatSelect.addEventListener('change', () => {
+        formatSelect.style.transform = 'scale(1.05)';
+        setTimeout(() => {
+            formatSelect.style.transform = 'scale(1)';
+        }, 150);
+    });
+});
+const uploadArea = document.getElementById('uploadArea');
+const fileInput = document.getElementById('fileInput');
+const progressContainer = document.getElementById('progressContainer');
+const progressFill = document.getElementById('progressFill');
+const progressText = document.getElementById('progressText');
+const resultContainer = document.getElementById('resultContainer');
+const errorContainer = document.getElementById('errorContainer');
+const downloadBtn = document.getElementById('downloadBtn');
+const resultText = document.getElementById('resultText');
+const errorText = document.getElementById('errorText');
+const hiddenFormatInput = document.getElementById('formatSelect');
+const presetSelect = document.getElementById('presetSelect');
+const selectedFileContainer = document.getElementById('selectedFileContainer');
+const selectedFileName = document.getElementById('selectedFileName');
+const removeFileBtn = document.getElementById('removeFileBtn');
+
+// Add smooth scroll behavior
+document.documentElement.style.scrollBehavior = 'smooth';
+
+// Enhanced drag and drop with visual feedback
+uploadArea.addEventListener('dragover', (e) => {
+    e.preventDefault();
+    uploadArea.classList.add('dragover');
+});
+
+uploadArea.addEventListener('dragleave', () => {
+    uploadArea.classList.remove('dragover');
+});
+
+uploadArea.addEventListener('drop', (e) => {
+    e.preventDefault();
+    uploadArea.classList.remove('dragover');
+    const files = e.dataTransfer.files;
+    if (files.length > 0) {
+        handleFile(files[0]);
+    }
+});
+
+// Update file name display when a file is selected
+fileInput.addEventListener('change', (e) => {
+    if (e.target.files.length > 0) {
+        handleFile(e.target.files[0]);
+    }
+});
+
+// Remove file button functionality
+removeFileBtn.addEventListener('click', (e) => {
+    e.stopPropagation();
+    resetForm();
+});
+
+function handleFile(file) {
+    if (file.size > 16 * 1024 * 1024) {
+        showError('File size must be less than 16MB');
+        return;
+    }
+
+    const fileName = file.name.toLowerCase();
+    const fileExtension = fileName.split('.').pop();
+    const isImageByExtension = ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'tiff', 'webp', 'heic', 'raw', 'psd', 'exr', 'ico', 'svg', 'eps', 'pdf', 'ai', 'cdr', 'apng', 'svgz', 'dds', 'tga', 'jfif', 'avif', 'pic', 'xcf', 'dng', 'pcx', 'png'].includes(fileExtension);
+    const isImageByMime = file.type.startsWith('image/') || file.type === 'application/pdf' || file.type === 'image/svg+xml';
+
+    if (!isImageByExtension && !isImageByMime) {
+        showError('Please select a valid image file');
+        return;
+    }
+
+    // Show selected file in bubble
+    selectedFileName.textContent = file.name;
+    selectedFileContainer.style.display = 'block';
+    uploadArea.style.display = 'none'; // Hide upload area when file is selected
+    hideError();
+
+    uploadFile(file);
+}
+
+function uploadFile(file) {
+    const formData = new FormData();
+    formData.append('file', file);
+    formData.append('output_format', hiddenFormatInput.value);
+    formData.append('preset', presetSelect.value);
+
+    showProgress();
+    hideError();
+    hideResult();
+
+    fetch('/upload', {
+        method: 'POST',
+        body: formData
+    })
+    .then(response => {
+        if (response.status === 429) {
+            throw new Error('busy');
+        }
+        return response.json();
+    })
+    .then(data => {
+        if (data.job_id) {
+            setProgress(30, 'Queued...');
+            pollJob(data.job_id, file.name);
+        } else {
+            finishUpload(data, file.name);
+        }
+    })
+    .catch(error => {
+        console.error('Upload error:', error);
+        hideProgress();
+        showError(error.message === 'busy' ? 'The server is busy. Please try again in a few seconds.' : 'Network error. Please try again.');
+    });
+}
+
+function pollJob(jobId, originalName) {
+    fetch(`/jobs/${jobId}`)
+    .then(response => response.json())
+    .then(data => {
+        if (data.state === 'done' || data.state === 'failed' || data.error) {
+            finishUpload(data, originalName);
+            return;
+        }
+        if (data.state === 'running') {
+            setProgress(60, 'Converting...');
+        }
+        setTimeout(() => pollJob(jobId, originalName), 500);
+    })
+    .catch(error => {
+        console.error('Status error:', error);
+        hideProgress();
+        showError('Network error. Please try again.');
+    });
+}
+
+function finishUpload(data, originalName) {
+    hideProgress();
+    if (data.success) {
+        showResult(data.filename, originalName, data.forced_message);
+    } else {
+        showError(data.error || 'Conversion failed');
+    }
+}
+
+function showProgress() {
+    progressContainer.style.display = 'block';
+    setProgress(10, 'Uploading...');
+}
+
+function setProgress(percent, label) {
+    progressFill.style.width = percent + '%';
+    progressText.innerHTML = `<span class="spinner"></span>${label}`;
+}
+
+function hideProgress() {
+    progressContainer.style.display = 'none';
+    progressFill.style.width = '100%';
+    setTimeout(() => {
+        progressFill.style.width = '0%';
+    }, 300);
+}
+
+function showResult(filename, originalName, forcedMessage) {
+    if (forcedMessage) {
+        document.getElementById('forcedWarning').textContent = forcedMessage;
+        document.getElementById('forcedWarning').style.display = 'block';
+    } else {
+        document.getElementById('forcedWarning').style.display = 'none';
+    }
+
+    // Update file name and format
+    document.getElementById('resultText').textContent = originalName;
+    const fileExtension = filename.split('.').pop().toUpperCase();
+    document.getElementById('resultFormat').textContent = `Format: ${fileExtension}`;
+
+    // Update download button
+    downloadBtn.href = `/download/${filename}`;
+    downloadBtn.download = `converted_${originalName.replace(/\.[^/.]+$/, '')}.${filename.split('.').pop()}`;
+
+    resultContainer.style.display = 'block';
+
+    // Add success animation
+    resultContainer.style.animation = 'none';
+    resultContainer.offsetHeight; // Trigger reflow
+    resultContainer.style.animation = 'resultFadeIn 0.5s cubic-bezier(0.4, 0, 0.2, 1)';
+}
+
+function hideResult() {
+    resultContainer.style.display = 'none';
+}
+
+function showError(message) {
+    errorText.textContent = message;
+    errorContainer.style.display = 'block';
+
+    // Add error animation
+    errorContainer.style.animation = 'none';
+    errorContainer.offsetHeight; // Trigger reflow
+    errorContainer.style.animation = 'errorShake 0.5s ease-in-out';
+}
+
+function hideError() {
+    errorContainer.style.display = 'none';
+}
+
+function resetForm() {
+    hideProgress();
+    hideResult();
+    hideError();
+    fileInput.value = '';
+    selectedFileName.textContent = ''; // Clear file name display
+    selectedFileContainer.style.display = 'none'; // Hide selected file bubble
+    document.getElementById('forcedWarning').style.display = 'none';
+
+    // Show upload area again
+    uploadArea.style.display = 'block';
+
+    // Add reset animation
+    uploadArea.style.animation = 'none';
+    uploadArea.offsetHeight;
+    uploadArea.style.animation = 'uploadAreaFadeIn 0.8s ease-out';
+}
+
+// Add parallax effect to background elements
+document.addEventListener('mousemove', (e) => {
+    const moveX = (e.clientX - window.innerWidth / 2) * 0.01;
+    const moveY = (e.clientY - window.innerHeight / 2) * 0.01;
+
+    document.body.style.setProperty('--mouse-x', moveX + 'px');
+    document.body.style.setProperty('--mouse-y', moveY + 'px');
+});
+
+// Icons are initialized by the dedicated script in the head
+
+// Ensure file type banner icons are initialized
+function initializeFileTypeIcons() {
+    if (typeof lucide !== 'undefined') {
+        // Re-initialize icons to ensure file type banner icons are created
+        lucide.createIcons();
+    }
+}
+
+// Force animation to start immediately
+function startFileTypeAnimation() {
+    const scrollElement = document.querySelector('.file-types-scroll');
+    if (scrollElement) {
+        // Force a reflow to ensure animation starts immediately
+        scrollElement.style.animation = 'none';
+        scrollElement.offsetHeight; // Trigger reflow
+        scrollElement.style.animation = null;
+    }
+}
+
+// Initialize file type icons and start animation when page loads
+document.addEventListener('DOMContentLoaded', function() {
+    initializeFileTypeIcons();
+    startFileTypeAnimation();
+});
+
+// Also start animation immediately if DOM is already loaded
+if (document.readyState === 'complete' || document.readyState === 'interactive') {
+    initializeFileTypeIcons();
+    startFileTypeAnimation();
+}
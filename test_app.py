@@ -0,0 +1,450 @@
+import unittest
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+import zlib
+from unittest import mock
+from PIL import Image  # type: ignore
+from werkzeug.middleware.proxy_fix import ProxyFix  # type: ignore
+import app as app_module
+import metrics
+from result_cache import ResultCache
+from jobs import JobQueue
+from janitor import Janitor
+from ratelimit import RateLimiter
+from sniff import SniffingStream
+
+
+class TestApp(unittest.TestCase):
+    def setUp(self):
+        """Point the app at temporary upload/output folders."""
+        self.test_dir = tempfile.mkdtemp()
+        self.upload_dir = os.path.join(self.test_dir, 'uploads')
+        self.output_dir = os.path.join(self.test_dir, 'outputs')
+        os.makedirs(self.upload_dir)
+        os.makedirs(self.output_dir)
+        self.saved_config = dict(app_module.app.config)
+        self.saved_cache = app_module.result_cache
+        self.saved_queue = app_module.job_queue
+        app_module.app.config['UPLOAD_FOLDER'] = self.upload_dir
+        app_module.app.config['OUTPUT_FOLDER'] = self.output_dir
+        app_module.result_cache = ResultCache(self.output_dir, os.path.join(self.test_dir, 'cache.sqlite3'))
+        app_module.job_queue = JobQueue(os.path.join(self.test_dir, 'jobs.sqlite3'), max_workers=2)
+        self.saved_janitor = app_module.janitor
+        app_module.janitor = Janitor([self.output_dir, self.upload_dir], interval=0,
+                                     on_remove=app_module.forget_outputs,
+                                     lock_path=os.path.join(self.test_dir, 'janitor.lock'))
+        self.saved_limiter = app_module.rate_limiter
+        app_module.rate_limiter = RateLimiter(os.path.join(self.test_dir, 'ratelimit.sqlite3'), rate=0)
+        self.client = app_module.app.test_client()
+
+    def tearDown(self):
+        """Restore app state and clean up."""
+        app_module.app.config.update(self.saved_config)
+        app_module.job_queue.shutdown()
+        app_module.result_cache = self.saved_cache
+        app_module.job_queue = self.saved_queue
+        app_module.janitor = self.saved_janitor
+        app_module.rate_limiter = self.saved_limiter
+        shutil.rmtree(self.test_dir)
+
+    def image_bytes(self, fmt='PNG', size=(64, 48), mode='RGB', color=(255, 0, 0)):
+        buf = io.BytesIO()
+        Image.new(mode, size, color).save(buf, fmt)
+        return buf.getvalue()
+
+    def upload(self, data, filename='image.png', output_format='WEBP', wait=True, headers=None, **fields):
+        form = {'file': (io.BytesIO(data), filename), 'output_format': output_format}
+        form.update(fields)
+        url = '/upload?wait=1' if wait else '/upload'
+        return self.client.post(url, data=form, content_type='multipart/form-data', headers=headers)
+
+    def test_upload_converts_without_touching_uploads(self):
+        """Test that small uploads are converted in memory."""
+        response = self.upload(self.image_bytes())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json['success'])
+        self.assertEqual(response.json['output_format'], 'WEBP')
+        self.assertEqual(os.listdir(self.upload_dir), [])
+        with Image.open(os.path.join(self.output_dir, response.json['filename'])) as img:
+            self.assertEqual(img.format, 'WEBP')
+
+    def test_repeat_upload_hits_cache(self):
+        """Test that converting the same bytes twice reuses the first output."""
+        data = self.image_bytes()
+        first = self.upload(data)
+        second = self.upload(data, filename='renamed.png')
+
+        self.assertFalse(first.json['cached'])
+        self.assertTrue(second.json['cached'])
+        self.assertEqual(first.json['filename'], second.json['filename'])
+        stats = self.client.get('/cache/stats').json
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_preset_is_part_of_cache_key(self):
+        """Test that a different preset is not served from another preset's cache entry."""
+        data = self.image_bytes()
+        fast = self.upload(data, output_format='PNG', preset='fast')
+        small = self.upload(data, output_format='PNG', preset='small')
+        self.assertFalse(small.json['cached'])
+        self.assertNotEqual(fast.json['filename'], small.json['filename'])
+
+    def test_invalid_encoder_option_rejected(self):
+        """Test that options the format cannot use are refused up front."""
+        response = self.upload(self.image_bytes(), output_format='PNG', quality='80')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('quality', response.json['error'])
+        response = self.upload(self.image_bytes(), output_format='JPEG', quality='high')
+        self.assertEqual(response.status_code, 400)
+
+    def test_async_upload_returns_job(self):
+        """Test that /upload enqueues a job which can be polled to completion."""
+        response = self.upload(self.image_bytes(), output_format='JPEG', wait=False)
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json['job_id']
+
+        app_module.job_queue.wait(job_id)
+        status = self.client.get(f'/jobs/{job_id}').json
+        self.assertEqual(status['state'], 'done')
+        self.assertTrue(status['success'])
+        self.assertEqual(status['output_format'], 'JPEG')
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, status['filename'])))
+
+    def test_failed_job_reports_error(self):
+        """Test that a corrupt upload ends as a failed job with a message."""
+        # A valid header gets past intake sniffing; the pixel data is garbage
+        response = self.upload(self.image_bytes()[:60] + b'not really a png', wait=False)
+        job_id = response.json['job_id']
+
+        app_module.job_queue.wait(job_id)
+        status = self.client.get(f'/jobs/{job_id}').json
+        self.assertEqual(status['state'], 'failed')
+        self.assertIn('Conversion failed', status['error'])
+
+    def test_unknown_job(self):
+        """Test polling a job id that does not exist."""
+        self.assertEqual(self.client.get('/jobs/nope').status_code, 404)
+
+    def test_full_queue_returns_429(self):
+        """Test backpressure when the job queue is at capacity."""
+        app_module.job_queue.max_pending = 0
+        response = self.upload(self.image_bytes(), wait=False)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+
+    def test_multi_output_upload(self):
+        """Test converting one upload to several formats and sizes in one job."""
+        data = self.image_bytes(size=(200, 100))
+        form = {'file': (io.BytesIO(data), 'image.png'), 'outputs': ['WEBP', 'JPEG@100x100,PNG@x20'], 'quality': '60'}
+        response = self.client.post('/upload/multi?wait=1', data=form, content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json['success'])
+        outputs = response.json['outputs']
+        self.assertEqual([o['output_format'] for o in outputs], ['WEBP', 'JPEG', 'PNG'])
+        self.assertEqual([o['dimensions'] for o in outputs], [[200, 100], [100, 50], [40, 20]])
+        for output in outputs:
+            with Image.open(os.path.join(self.output_dir, output['filename'])) as img:
+                self.assertEqual(list(img.size), output['dimensions'])
+
+        # The unsized WEBP shares its cache entry with /upload
+        single = self.upload(data, output_format='WEBP', quality='60')
+        self.assertTrue(single.json['cached'])
+        self.assertEqual(single.json['filename'], outputs[0]['filename'])
+
+        form['file'] = (io.BytesIO(data), 'again.png')
+        again = self.client.post('/upload/multi', data=form, content_type='multipart/form-data')
+        self.assertEqual(again.status_code, 200)
+        self.assertTrue(all(o['cached'] for o in again.json['outputs']))
+        self.assertEqual(again.json['outputs'][1]['dimensions'], [100, 50])
+
+    def test_upload_with_responsive_widths(self):
+        """Test that /upload can emit width derivatives next to the full-size output."""
+        response = self.upload(self.image_bytes(size=(800, 400)), output_format='JPEG', widths='200,400,1000')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['dimensions'], [800, 400])
+        self.assertEqual(response.json['original_name'], 'image.png')
+        derivatives = response.json['derivatives']
+        self.assertEqual([d['max_size'] for d in derivatives], [[200, 0], [400, 0], [1000, 0]])
+        self.assertEqual([d['dimensions'] for d in derivatives], [[200, 100], [400, 200], [800, 400]])
+        with Image.open(os.path.join(self.output_dir, derivatives[0]['filename'])) as img:
+            self.assertEqual((img.format, img.size), ('JPEG', (200, 100)))
+        self.assertEqual(self.upload(self.image_bytes(), widths='0,big').status_code, 400)
+
+    def test_multi_output_validation(self):
+        """Test that bad output specs and unusable options are refused."""
+        def post(**fields):
+            form = {'file': (io.BytesIO(self.image_bytes()), 'image.png')}
+            form.update(fields)
+            return self.client.post('/upload/multi', data=form, content_type='multipart/form-data')
+
+        self.assertEqual(post().status_code, 400)
+        self.assertEqual(post(outputs='NOPE').status_code, 400)
+        self.assertEqual(post(outputs='PNG@x').status_code, 400)
+        response = post(outputs='PNG,GIF', quality='80')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('quality', response.json['error'])
+        self.assertEqual(post(outputs='JPEG,PNG', quality='500').status_code, 400)
+
+    def test_rate_limit_per_client(self):
+        """Test that a client over its burst gets 429 before its body is read."""
+        app_module.rate_limiter = RateLimiter(os.path.join(self.test_dir, 'limited.sqlite3'), rate=0.1, burst=2)
+        data = self.image_bytes()
+        self.assertEqual(self.upload(data).status_code, 200)
+        self.assertEqual(self.upload(data).status_code, 200)
+        with mock.patch('app.hash_stream') as hash_stream:
+            response = self.upload(data)
+        hash_stream.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 5)
+
+        # Configured API keys and other IPs have their own buckets
+        app_module.app.config['API_KEYS'] = {'abc'}
+        self.assertEqual(self.upload(data, headers={'X-API-Key': 'abc'}).status_code, 200)
+        other = self.client.post('/upload?wait=1', data={'file': (io.BytesIO(data), 'image.png')},
+                                 content_type='multipart/form-data', environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(other.status_code, 200)
+        self.assertEqual(self.client.get('/cache/stats').status_code, 200)
+
+    def test_unknown_api_key_limited_by_ip(self):
+        """Test that made-up API keys share their IP's bucket rather than getting fresh ones."""
+        app_module.rate_limiter = RateLimiter(os.path.join(self.test_dir, 'limited.sqlite3'), rate=0.1, burst=1)
+        app_module.app.config['API_KEYS'] = {'abc'}
+        data = self.image_bytes()
+        self.assertEqual(self.upload(data, headers={'X-API-Key': 'made-up-1'}).status_code, 200)
+        self.assertEqual(self.upload(data, headers={'X-API-Key': 'made-up-2'}).status_code, 429)
+        self.assertEqual(self.upload(data).status_code, 429)
+        self.assertEqual(self.upload(data, headers={'X-API-Key': 'abc'}).status_code, 200)
+
+    def test_forwarded_clients_limited_separately_behind_proxy(self):
+        """Test that behind a trusted proxy each X-Forwarded-For client gets its own bucket."""
+        app_module.rate_limiter = RateLimiter(os.path.join(self.test_dir, 'limited.sqlite3'), rate=0.1, burst=1)
+        data = self.image_bytes()
+        # Untrusted, the header is ignored and everyone is the proxy's address
+        self.assertEqual(self.upload(data, headers={'X-Forwarded-For': '203.0.113.1'}).status_code, 200)
+        self.assertEqual(self.upload(data, headers={'X-Forwarded-For': '203.0.113.2'}).status_code, 429)
+
+        app_module.app.config['TRUSTED_PROXIES'] = 1
+        with mock.patch.object(app_module.app, 'wsgi_app', ProxyFix(app_module.app.wsgi_app, x_for=1)):
+            self.assertEqual(self.upload(data, headers={'X-Forwarded-For': '203.0.113.1'}).status_code, 200)
+            self.assertEqual(self.upload(data, headers={'X-Forwarded-For': '203.0.113.2'}).status_code, 200)
+            self.assertEqual(self.upload(data, headers={'X-Forwarded-For': '203.0.113.1'}).status_code, 429)
+
+    def test_admission_sheds_load_with_503(self):
+        """Test the host-wide in-flight cap and that slots are released."""
+        limiter = app_module.rate_limiter = RateLimiter(os.path.join(self.test_dir, 'admit.sqlite3'), rate=0,
+                                                        max_inflight=1)
+        slot = limiter.admit()
+        response = self.upload(self.image_bytes())
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        limiter.release(slot)
+        self.assertEqual(self.upload(self.image_bytes()).status_code, 200)
+        self.assertEqual(limiter.inflight(), 0)
+
+    def test_batch_streams_zip(self):
+        """Test converting several files at once into a ZIP archive."""
+        files = [
+            (io.BytesIO(self.image_bytes()), 'a.png'),
+            (io.BytesIO(self.image_bytes('JPEG')), 'a.jpg'),
+            (io.BytesIO(self.image_bytes('GIF', mode='P', color=1)), 'photos/b.gif'),
+            (io.BytesIO(b'corrupt'), 'broken.png'),
+        ]
+        response = self.client.post('/batch', data={'files': files, 'output_format': 'WEBP'},
+                                    content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            names = set(archive.namelist())
+            self.assertEqual(names, {'a.webp', 'a_1.webp', 'photos/b.webp', 'errors.txt'})
+            self.assertIn('broken.png', archive.read('errors.txt').decode())
+            with Image.open(io.BytesIO(archive.read('photos/b.webp'))) as img:
+                self.assertEqual(img.format, 'WEBP')
+
+    def test_batch_requires_files(self):
+        """Test that an empty batch is rejected."""
+        response = self.client.post('/batch', data={'output_format': 'PNG'}, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 400)
+
+    def test_healthz(self):
+        """Test that the liveness probe answers without rendering the page."""
+        with mock.patch('app.render_template') as render:
+            response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {'status': 'ok'})
+        render.assert_not_called()
+
+    def test_readyz_reports_backend_disk_and_queue(self):
+        """Test that readiness reads cached state and fails on a full queue or a full disk."""
+        with mock.patch('capabilities.probe_imagemagick') as blocking_probe:
+            response = self.client.get('/readyz')
+        blocking_probe.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json['ready'])
+        self.assertEqual(set(response.json['disk']), {'quota_free_bytes', 'uploads_free_bytes', 'outputs_free_bytes'})
+        self.assertEqual(response.json['queue']['max_pending'], app_module.job_queue.max_pending)
+        self.assertEqual(response.headers['Cache-Control'], 'no-store')
+
+        with mock.patch.object(app_module.job_queue, 'pending', return_value=app_module.job_queue.max_pending):
+            response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json['queue']['saturation'], 1.0)
+        self.assertEqual(response.json['problems'], ['job queue is saturated'])
+
+        app_module.app.config['READY_MIN_FREE_BYTES'] = 1 << 62
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json['problems'], ['uploads is low on disk space', 'outputs is low on disk space'])
+
+    def test_index_rendered_once_and_compressed(self):
+        """Test that the page is rendered once per capability state and sent pre-compressed with an ETag."""
+        app_module.index_pages.clear()
+        render = mock.Mock(wraps=app_module.render_template)
+        with mock.patch('app.cached_capabilities', return_value=None), mock.patch('app.render_template', render):
+            first = self.client.get('/', headers={'Accept-Encoding': 'gzip'})
+            plain = self.client.get('/')
+            revalidated = self.client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': first.headers['ETag']})
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(zlib.decompress(first.data, 16 + zlib.MAX_WBITS), plain.data)
+        self.assertTrue(first.cache_control.no_cache)
+        self.assertEqual(revalidated.status_code, 304)
+
+        # Linked CSS and JS are fingerprinted and cached for good
+        for url in re.findall(r'/static/[^"]+', plain.data.decode()):
+            asset = self.client.get(url)
+            self.assertEqual(asset.status_code, 200)
+            self.assertTrue(asset.cache_control.immutable)
+        self.assertEqual(self.client.get('/static/missing.css').status_code, 404)
+
+    def test_index_does_not_wait_for_imagemagick_probe(self):
+        """Test that the first page load starts the probe in the background instead of running it."""
+        with mock.patch('app.cached_capabilities', return_value=None), \
+                mock.patch('app.probe_in_background') as probe, \
+                mock.patch('capabilities.probe_imagemagick') as blocking_probe:
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        probe.assert_called()
+        blocking_probe.assert_not_called()
+        self.assertNotIn(b'require ImageMagick', response.data)
+
+    def test_metrics_record_stages_and_bytes(self):
+        """Test that /metrics exposes worker-side stage timings and byte counts."""
+        before = metrics.STAGE_SECONDS.count(stage='encode')
+        data = self.image_bytes()
+        self.upload(data, filename='photo.png', output_format='JPEG')
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertEqual(metrics.STAGE_SECONDS.count(stage='encode'), before + 1)
+        self.assertGreaterEqual(metrics.BYTES_IN.get(input='PNG', output='JPEG'), len(data))
+        body = response.get_data(as_text=True)
+        self.assertIn('formatly_stage_seconds_bucket{stage="decode",le="+Inf"}', body)
+        self.assertIn('formatly_queue_depth 0', body)
+        self.assertIn('formatly_worker_utilization', body)
+
+    def test_janitor_sweep_evicts_cached_output(self):
+        """Test that expired outputs are deleted and dropped from the result cache."""
+        data = self.image_bytes()
+        filename = self.upload(data).json['filename']
+        output_path = os.path.join(self.output_dir, filename)
+        self.assertIn(os.path.abspath(output_path), app_module.janitor._files)
+
+        removed = app_module.janitor.sweep(now=time.time() + app_module.janitor.ttl + 1)
+        self.assertEqual(removed, [os.path.abspath(output_path)])
+        self.assertFalse(os.path.exists(output_path))
+        self.assertFalse(self.upload(data).json['cached'])
+
+    def test_download_supports_etag_and_range(self):
+        """Test conditional and partial downloads of a content-addressed output."""
+        filename = self.upload(self.image_bytes(fmt='BMP', size=(200, 200)), filename='image.bmp', output_format='TIFF').json['filename']
+        response = self.client.get(f'/download/{filename}')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        full = response.data
+        # A strong validator made from the output bytes, not the cache key
+        self.assertEqual(etag, f'"{hashlib.sha256(full).hexdigest()}"')
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+
+        response = self.client.get(f'/download/{filename}', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(f'/download/{filename}', headers={'Range': 'bytes=100-199', 'If-Range': etag})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, full[100:200])
+
+        # A stale or weak validator in If-Range gets the whole file
+        for stale in ('"0123"', f'W/{etag}'):
+            response = self.client.get(f'/download/{filename}', headers={'Range': 'bytes=100-199', 'If-Range': stale})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, full)
+
+    def test_download_x_sendfile_leaves_ranges_to_server(self):
+        """Test that with X-Sendfile the app doesn't answer a Range it isn't sending."""
+        filename = self.upload(self.image_bytes(fmt='BMP', size=(200, 200)), filename='image.bmp', output_format='TIFF').json['filename']
+        app_module.app.config['USE_X_SENDFILE'] = True
+        response = self.client.get(f'/download/{filename}', headers={'Range': 'bytes=100-199'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Range', response.headers)
+        self.assertEqual(response.headers['X-Sendfile'], os.path.join(os.path.abspath(self.output_dir), filename))
+
+    def test_download_x_accel_handoff(self):
+        """Test that nginx handoff returns a redirect header instead of the body."""
+        filename = self.upload(self.image_bytes()).json['filename']
+        app_module.app.config['DOWNLOAD_HANDOFF'] = 'x-accel'
+        response = self.client.get(f'/download/{filename}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Accel-Redirect'], f'/protected-outputs/{filename}')
+        self.assertEqual(response.data, b'')
+        self.assertEqual(self.client.get('/download/missing.png').status_code, 404)
+
+    def test_only_outputs_are_served(self):
+        """Test that other files in the output folder can't be downloaded or deleted."""
+        self.upload(self.image_bytes())
+        hidden = os.path.join(self.output_dir, '.result-cache.sqlite3')
+        with open(hidden, 'wb') as f:
+            f.write(b'index')
+        self.assertEqual(self.client.get('/download/.result-cache.sqlite3').status_code, 404)
+        self.assertEqual(self.client.delete('/cleanup/.result-cache.sqlite3').status_code, 404)
+        self.assertTrue(os.path.exists(hidden))
+
+    def test_upload_rejects_unrecognised_content(self):
+        """Test that non-image and mislabeled uploads are refused at intake."""
+        response = self.upload(b'<html>not an image</html>')
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(app_module.job_queue.pending(), 0)
+
+        response = self.upload(self.image_bytes(fmt='GIF'), filename='image.png')
+        self.assertEqual(response.status_code, 415)
+        self.assertIn('GIF', response.json['error'])
+
+    def test_upload_rejects_bomb_from_header(self):
+        """Test that oversized dimensions are refused before the body is read."""
+        png = self.image_bytes()
+        ihdr = b'IHDR' + (50000).to_bytes(4, 'big') * 2 + png[24:29]
+        bomb = png[:12] + ihdr + zlib.crc32(ihdr).to_bytes(4, 'big') + png[33:]
+        with mock.patch('sniff.SniffingStream.write', side_effect=SniffingStream.write, autospec=True) as write:
+            response = self.upload(bomb + b'\0' * (2 * 1024 * 1024))
+        self.assertEqual(response.status_code, 413)
+        # Rejected on the first chunk rather than after buffering 2MB
+        self.assertEqual(write.call_count, 1)
+
+    def test_upload_rejects_disallowed_extension(self):
+        """Test that unknown extensions are refused."""
+        response = self.upload(b'hello', filename='notes.txt')
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import unittest
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+from PIL import Image  # type: ignore
+import app as app_module
+import asgi
+from jobs import JobQueue
+from janitor import Janitor
+from loadtest import multipart_body
+from ratelimit import RateLimiter
+from result_cache import ResultCache
+
+
+class TestAsgi(unittest.TestCase):
+    def setUp(self):
+        """Point the app at temporary folders and drive it through a fresh adapter."""
+        self.test_dir = tempfile.mkdtemp()
+        self.upload_dir = os.path.join(self.test_dir, 'uploads')
+        self.output_dir = os.path.join(self.test_dir, 'outputs')
+        os.makedirs(self.upload_dir)
+        os.makedirs(self.output_dir)
+        self.saved_config = dict(app_module.app.config)
+        self.saved = (app_module.result_cache, app_module.job_queue, app_module.janitor, app_module.rate_limiter)
+        app_module.app.config['UPLOAD_FOLDER'] = self.upload_dir
+        app_module.app.config['OUTPUT_FOLDER'] = self.output_dir
+        app_module.result_cache = ResultCache(self.output_dir, os.path.join(self.test_dir, 'cache.sqlite3'))
+        app_module.job_queue = JobQueue(os.path.join(self.test_dir, 'jobs.sqlite3'), max_workers=2)
+        app_module.janitor = Janitor([self.output_dir, self.upload_dir], interval=0,
+                                     on_remove=app_module.forget_outputs,
+                                     lock_path=os.path.join(self.test_dir, 'janitor.lock'))
+        app_module.rate_limiter = RateLimiter(os.path.join(self.test_dir, 'ratelimit.sqlite3'), rate=0)
+        self.adapter = asgi.AsgiAdapter(app_module.app, threads=4)
+
+    def tearDown(self):
+        self.adapter.executor.shutdown()
+        app_module.app.config.update(self.saved_config)
+        app_module.job_queue.shutdown()
+        app_module.result_cache, app_module.job_queue, app_module.janitor, app_module.rate_limiter = self.saved
+        shutil.rmtree(self.test_dir)
+
+    def request(self, method, path, body=b'', headers=None, chunk_size=None, disconnect_at=None):
+        """
+        Run one request through the adapter.
+
+        The body arrives in chunk_size pieces; with disconnect_at the client
+        hangs up after that many pieces. Returns (status, headers, list of
+        body chunks, number of receive() calls).
+        """
+        path, _, query = path.partition('?')
+        headers = dict(headers or {})
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(),
+                 'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+                 'client': ('127.0.0.1', 50000), 'server': ('testserver', 80)}
+        chunk_size = chunk_size or max(1, len(body))
+        pieces = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b'']
+        messages = [{'type': 'http.request', 'body': piece, 'more_body': i < len(pieces) - 1}
+                    for i, piece in enumerate(pieces)]
+        if disconnect_at is not None:
+            messages = messages[:disconnect_at] + [{'type': 'http.disconnect'}]
+        sent = []
+        receives = [0]
+
+        async def receive():
+            receives[0] += 1
+            if messages:
+                return messages.pop(0)
+            # Like a server: nothing more until the client goes away
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.adapter(scope, receive, send))
+        if not sent:
+            return None, {}, [], receives[0]
+        start = sent[0]
+        response_headers = {k.decode(): v.decode() for k, v in start['headers']}
+        chunks = [m['body'] for m in sent[1:] if m['body']]
+        return start['status'], response_headers, chunks, receives[0]
+
+    def upload_body(self, size=(64, 48), output_format='WEBP'):
+        buf = io.BytesIO()
+        Image.new('RGB', size, (255, 0, 0)).save(buf, 'PNG')
+        return multipart_body({'output_format': output_format}, {'file': ('image.png', buf.getvalue())})
+
+    def test_upload_and_streamed_download(self):
+        """Test that a chunked upload converts and its download is sent in chunks from the file."""
+        body, content_type = self.upload_body(size=(640, 480), output_format='BMP')
+        status, _, chunks, _ = self.request('POST', '/upload?wait=1', body, {'Content-Type': content_type},
+                                            chunk_size=1000)
+        self.assertEqual(status, 200)
+        result = json.loads(b''.join(chunks))
+        self.assertTrue(result['success'])
+
+        status, headers, chunks, _ = self.request('GET', f"/download/{result['filename']}")
+        with open(os.path.join(self.output_dir, result['filename']), 'rb') as f:
+            expected = f.read()
+        self.assertEqual(status, 200)
+        self.assertEqual(b''.join(chunks), expected)
+        self.assertEqual(len(chunks), -(-len(expected) // asgi.CHUNK_SIZE))
+        self.assertEqual(headers['content-length'], str(len(expected)))
+
+        status, _, chunks, _ = self.request('GET', f"/download/{result['filename']}", headers={'Range': 'bytes=10-19'})
+        self.assertEqual(status, 206)
+        self.assertEqual(b''.join(chunks), expected[10:20])
+
+    def test_rate_limited_request_is_refused_before_body(self):
+        """Test that a throttled upload is answered without receiving any of its body."""
+        app_module.rate_limiter = RateLimiter(os.path.join(self.test_dir, 'limited.sqlite3'), rate=0.01, burst=1)
+        body, content_type = self.upload_body()
+        headers = {'Content-Type': content_type, 'Content-Length': str(len(body))}
+        self.assertEqual(self.request('POST', '/upload?wait=1', body, headers)[0], 200)
+
+        status, response_headers, _, receives = self.request('POST', '/upload?wait=1', body, headers)
+        self.assertEqual(status, 429)
+        self.assertIn('retry-after', response_headers)
+        self.assertEqual(receives, 0)
+
+    def test_oversized_body_rejected_and_slot_released(self):
+        """Test that bodies over the limit get 413 (declared or not) and give back their slot."""
+        app_module.rate_limiter = RateLimiter(os.path.join(self.test_dir, 'slots.sqlite3'), rate=0, max_inflight=1)
+        app_module.app.config['MAX_CONTENT_LENGTH'] = 500
+        body, content_type = self.upload_body(size=(200, 200))
+        self.assertGreater(len(body), 600)
+
+        status, _, _, receives = self.request('POST', '/upload', body, {'Content-Type': content_type,
+                                                                         'Content-Length': str(len(body))})
+        self.assertEqual(status, 413)
+        self.assertEqual(receives, 0)
+        status, _, _, receives = self.request('POST', '/upload', body, {'Content-Type': content_type}, chunk_size=200)
+        self.assertEqual(status, 413)
+        self.assertEqual(receives, 3)
+        self.assertEqual(app_module.rate_limiter.inflight(), 0)
+
+    def test_disconnect_mid_upload_releases_slot(self):
+        """Test that a client hanging up during the upload gets no response and frees its slot."""
+        app_module.rate_limiter = RateLimiter(os.path.join(self.test_dir, 'slots.sqlite3'), rate=0, max_inflight=1)
+        body, content_type = self.upload_body()
+        status, _, _, _ = self.request('POST', '/upload', body, {'Content-Type': content_type},
+                                       chunk_size=100, disconnect_at=2)
+        self.assertIsNone(status)
+        self.assertEqual(app_module.rate_limiter.inflight(), 0)
+        self.assertEqual(os.listdir(self.upload_dir), [])
+
+    def test_lifespan(self):
+        """Test that startup and shutdown are acknowledged."""
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(self.adapter({'type': 'lifespan'}, receive, send))
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+
+if __name__ == '__main__':
+    unittest.main()
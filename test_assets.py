@@ -0,0 +1,75 @@
+import unittest
+import gzip
+import os
+import shutil
+import tempfile
+from flask import Flask, request  # type: ignore
+import assets
+from assets import EncodedBody, StaticAssets
+
+
+class TestAssets(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.data = b'body { color: red; }\n' * 200
+
+    def respond(self, body, headers=None, immutable=False):
+        with self.app.test_request_context('/', headers=headers or {}):
+            return body.respond(request, immutable=immutable)
+
+    def test_negotiates_encoding(self):
+        """Test that the preferred accepted encoding is sent, each with its own ETag."""
+        body = EncodedBody(self.data, 'text/css')
+        response = self.respond(body, {'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.content_encoding, 'gzip')
+        self.assertEqual(gzip.decompress(response.get_data()), self.data)
+        self.assertEqual(response.get_etag(), (f'{body.etag}-gzip', False))
+        self.assertIn('Accept-Encoding', response.vary)
+
+        response = self.respond(body, {'Accept-Encoding': 'gzip;q=0, identity'})
+        self.assertIsNone(response.content_encoding)
+        self.assertEqual(response.get_data(), self.data)
+        if 'br' in assets.COMPRESSORS:
+            self.assertEqual(self.respond(body, {'Accept-Encoding': 'gzip, deflate, br'}).content_encoding, 'br')
+            self.assertEqual(self.respond(body, {'Accept-Encoding': 'gzip, br;q=0.5'}).content_encoding, 'gzip')
+
+    def test_small_bodies_are_not_compressed(self):
+        """Test that bodies too small to gain from compression are always sent as they are."""
+        response = self.respond(EncodedBody(b'tiny', 'text/plain'), {'Accept-Encoding': 'gzip, br'})
+        self.assertIsNone(response.content_encoding)
+        self.assertEqual(response.get_data(), b'tiny')
+
+    def test_conditional_and_cache_headers(self):
+        """Test 304 on a matching ETag and the cache policy of mutable and immutable bodies."""
+        body = EncodedBody(self.data, 'text/css')
+        etag = f'"{body.etag}-gzip"'
+        response = self.respond(body, {'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(self.respond(body).cache_control.no_cache)
+        cache_control = self.respond(body, immutable=True).cache_control
+        self.assertEqual((cache_control.max_age, cache_control.immutable), (assets.IMMUTABLE_MAX_AGE, True))
+
+    def test_static_assets_fingerprinted(self):
+        """Test that fingerprinted names are immutable and change with the file."""
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        with open(os.path.join(folder, 'site.css'), 'wb') as f:
+            f.write(self.data)
+        static = StaticAssets(folder)
+        url = static.url('site.css')
+        self.assertRegex(url, r'^/static/site\.[0-9a-f]{12}\.css$')
+        with self.app.test_request_context('/'):
+            self.assertTrue(static.respond(url[len('/static/'):], request).cache_control.immutable)
+            self.assertTrue(static.respond('site.css', request).cache_control.no_cache)
+            self.assertIsNone(static.respond('missing.css', request))
+
+        with open(os.path.join(folder, 'site.css'), 'ab') as f:
+            f.write(b'a { color: blue; }\n')
+        self.assertEqual(static.url('site.css'), url)
+        static.refresh()
+        self.assertNotEqual(static.url('site.css'), url)
+        self.assertEqual(static.url('other.js'), '/static/other.js')
+
+
+if __name__ == '__main__':
+    unittest.main()
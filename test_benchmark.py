@@ -0,0 +1,56 @@
+import unittest
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_corpus_covers_modes(self):
+        """Test that the corpus skips format/mode pairs the encoder rejects."""
+        corpus = benchmark.build_corpus(['small'], ['RGBA', 'P'], ['PNG', 'JPEG'])
+        pairs = {(sample['input'], sample['mode']) for sample in corpus}
+        self.assertIn(('PNG', 'RGBA'), pairs)
+        self.assertIn(('PNG', 'P'), pairs)
+        self.assertNotIn(('JPEG', 'RGBA'), pairs)
+
+    def test_run_reports_each_pair(self):
+        """Test that every input x output pair gets latency and size figures."""
+        report = benchmark.run_benchmark(['small'], ['RGB'], ['PNG', 'BMP'], ['JPEG', 'WEBP'], iterations=2)
+        self.assertEqual(len(report['results']), 4)
+        for result in report['results']:
+            self.assertGreater(result['output_bytes'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+        self.assertIn('pillow', report['meta'])
+
+    def test_compare_flags_regressions(self):
+        """Test the threshold check on latency and output size."""
+        result = {'input': 'PNG', 'output': 'JPEG', 'size': 'small', 'mode': 'RGB',
+                  'p50_ms': 10.0, 'output_bytes': 1000}
+        baseline = {'results': [result]}
+        self.assertEqual(benchmark.compare(baseline, {'results': [dict(result, p50_ms=11.0)]}, 0.2), [])
+        self.assertEqual(len(benchmark.compare(baseline, {'results': [dict(result, p50_ms=13.0)]}, 0.2)), 1)
+        self.assertEqual(len(benchmark.compare(baseline, {'results': [dict(result, output_bytes=2000)]}, 0.2)), 1)
+
+    def test_imagemagick_route_restores_plugins(self):
+        """Test that comparing routes leaves the format registry as it was."""
+        from image_converter import FORMAT_REGISTRY, pillow_can_write
+        before = dict(FORMAT_REGISTRY)
+        with benchmark.imagemagick_route(['WEBP']):
+            self.assertFalse(pillow_can_write('WEBP'))
+        self.assertEqual(FORMAT_REGISTRY, before)
+        self.assertTrue(pillow_can_write('WEBP'))
+
+    def test_route_summary(self):
+        """Test grouping results per format and route."""
+        sample = {'input': 'PNG', 'size': 'small', 'mode': 'RGB'}
+        report = {'results': [
+            dict(sample, output='AVIF', route='native', p50_ms=5.0, output_bytes=100),
+            dict(sample, output='AVIF', route='imagemagick', p50_ms=40.0, output_bytes=120),
+            dict(sample, output='PNG', p50_ms=1.0, output_bytes=300),
+        ]}
+        summary = benchmark.route_summary(report)
+        self.assertEqual(summary['AVIF']['imagemagick'], {'p50_ms': 40.0, 'output_bytes': 120})
+        self.assertEqual(list(summary['PNG']), ['native'])
+        self.assertTrue(benchmark.result_key(report['results'][1]).endswith('via imagemagick'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from PIL import Image  # type: ignore
+import bulk
+
+
+class TestBulk(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.test_dir, 'src')
+        self.dest = os.path.join(self.test_dir, 'dst')
+        os.makedirs(os.path.join(self.source, 'albums', '2019'))
+        os.makedirs(os.path.join(self.source, '.cache'))
+        for i in range(3):
+            Image.new('RGB', (40, 30), (i * 50, 0, 0)).save(os.path.join(self.source, 'albums', '2019', f'{i}.png'))
+        Image.new('RGB', (40, 30)).save(os.path.join(self.source, 'cover.jpg'))
+        Image.new('RGB', (4, 4)).save(os.path.join(self.source, '.cache', 'thumb.png'))
+        with open(os.path.join(self.source, 'notes.txt'), 'w') as f:
+            f.write('not an image')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def run_bulk(self, **kwargs):
+        return bulk.run(self.source, self.dest, kwargs.pop('output_format', 'WEBP'), workers=2, **kwargs)
+
+    def test_converts_tree_preserving_structure(self):
+        """Test that every image lands at the same relative path, hidden and non-image files skipped."""
+        summary = self.run_bulk()
+        self.assertEqual((summary['converted'], summary['failed']), (4, 0))
+        outputs = sorted(os.path.relpath(os.path.join(root, name), self.dest)
+                         for root, _, files in os.walk(self.dest) for name in files if not name.startswith('.'))
+        self.assertEqual(outputs, ['albums/2019/0.png.webp', 'albums/2019/1.png.webp', 'albums/2019/2.png.webp',
+                                   'cover.jpg.webp'])
+        with Image.open(os.path.join(self.dest, 'cover.jpg.webp')) as img:
+            self.assertEqual(img.format, 'WEBP')
+
+    def test_same_name_different_extension(self):
+        """Test that photo.jpg and photo.png get separate outputs."""
+        Image.new('RGB', (40, 30)).save(os.path.join(self.source, 'cover.png'))
+        self.assertEqual(self.run_bulk()['converted'], 5)
+        for name in ('cover.jpg.webp', 'cover.png.webp'):
+            self.assertTrue(os.path.exists(os.path.join(self.dest, name)))
+
+    def test_rerun_skips_up_to_date_outputs(self):
+        """Test mtime skips, hash checks on touched files and reconversion on change."""
+        self.run_bulk()
+        self.assertEqual(self.run_bulk()['skipped'], 4)
+
+        touched = os.path.join(self.source, 'cover.jpg')
+        os.utime(touched, ns=(0, 0))
+        summary = self.run_bulk()
+        self.assertEqual((summary['unchanged'], summary['converted']), (1, 0))
+
+        Image.new('RGB', (80, 60), 'blue').save(os.path.join(self.source, 'albums', '2019', '1.png'))
+        summary = self.run_bulk()
+        self.assertEqual((summary['converted'], summary['skipped']), (1, 3))
+        with Image.open(os.path.join(self.dest, 'albums', '2019', '1.png.webp')) as img:
+            self.assertEqual(img.size, (80, 60))
+
+        # Different settings make every output stale
+        self.assertEqual(self.run_bulk(encoder_options={'quality': 50})['converted'], 4)
+
+    def test_resumes_from_checkpoint(self):
+        """Test that a manifest cut short by a crash only redoes the unfinished files."""
+        self.run_bulk()
+        manifest = os.path.join(self.dest, bulk.MANIFEST_FILENAME)
+        with open(manifest) as f:
+            lines = f.readlines()
+        with open(manifest, 'w') as f:
+            f.writelines(lines[:2])
+            f.write(lines[2][:10])
+        summary = self.run_bulk()
+        self.assertEqual((summary['skipped'], summary['converted'] + summary['unchanged']), (2, 2))
+        with open(manifest) as f:
+            self.assertEqual(len([json.loads(line) for line in f]), 4)
+
+    def test_failures_are_retried(self):
+        """Test that broken files are reported and not marked done."""
+        with open(os.path.join(self.source, 'broken.png'), 'wb') as f:
+            f.write(b'not really a png')
+        self.assertEqual(self.run_bulk()['failed'], 1)
+        self.assertEqual(self.run_bulk()['failed'], 1)
+        self.assertFalse(any('.tmp' in name for _, _, files in os.walk(self.dest) for name in files))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+import coldstart
+
+# What Image.preinit() loads; anything more is imported on the startup path
+PREINIT_PLUGINS = {'BmpImagePlugin', 'GifImagePlugin', 'JpegImagePlugin', 'PngImagePlugin', 'PpmImagePlugin'}
+
+
+class TestColdStart(unittest.TestCase):
+    def test_first_response_loads_only_common_plugins(self):
+        """Test that importing the app and serving /healthz leave Pillow's other plugins unloaded."""
+        report = coldstart.measure('wsgi', '/healthz', env={'JANITOR_INTERVAL': '0'})
+        self.assertEqual(report['status'], 200)
+        self.assertLessEqual(set(report['pillow_plugins']), PREINIT_PLUGINS)
+        self.assertGreater(report['total_ms'], report['import_ms'])
+
+    def test_summarize_takes_medians(self):
+        """Test that the summary reports the median of each timing."""
+        runs = [{'status': 200, 'import_ms': ms, 'first_response_ms': ms / 10, 'total_ms': ms * 2,
+                 'modules': 300, 'pillow_plugins': []} for ms in (100, 300, 200)]
+        summary = coldstart.summarize(runs)
+        self.assertEqual((summary['import_ms'], summary['first_response_ms'], summary['total_ms']), (200, 20, 400))
+        self.assertEqual(summary['statuses'], [200])
+
+
+if __name__ == '__main__':
+    unittest.main()
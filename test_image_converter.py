@@ -1,10 +1,17 @@
 import unittest
+import io
 import os
 import tempfile
-from PIL import Image  # type: ignore
+from PIL import Image, ImageChops  # type: ignore
 import numpy as np  # type: ignore
 from image_converter import convert_image, convert_to_png, pillow_can_write, check_imagemagick
 import shutil
+import subprocess
+import sys
+import json
+import threading
+from unittest import mock
+import capabilities
 
 
 class TestImageConverter(unittest.TestCase):
@@ -37,8 +44,10 @@ class TestImageConverter(unittest.TestCase):
                 self.assertTrue(pillow_can_write(fmt))
                 self.assertTrue(pillow_can_write(fmt.lower()))
         
+        # AVIF and HEIC become writable when their codec plugins are installed
+        from image_converter import PLUGIN_FORMATS
         unsupported_formats = ['SVG', 'PDF', 'AVIF', 'HEIC', 'UNSUPPORTED_FORMAT']
-        for fmt in unsupported_formats:
+        for fmt in [fmt for fmt in unsupported_formats if fmt not in PLUGIN_FORMATS]:
             with self.subTest(format=fmt):
                 self.assertFalse(pillow_can_write(fmt))
     
@@ -584,5 +593,509 @@ class TestImageConverter(unittest.TestCase):
             self.assertEqual(img.format, 'PNG')
 
 
+    def test_convert_from_bytes_to_stream(self):
+        """Test the in-memory API: bytes in, file object out."""
+        source = io.BytesIO()
+        Image.new('RGBA', (40, 30), (0, 0, 255, 128)).save(source, 'PNG')
+        output = io.BytesIO()
+        
+        success, actual_format, actual_output = convert_image(source.getvalue(), output, 'WEBP')
+        
+        self.assertTrue(success)
+        self.assertEqual(actual_format, 'WEBP')
+        self.assertIs(actual_output, output)
+        output.seek(0)
+        with Image.open(output) as img:
+            self.assertEqual(img.format, 'WEBP')
+            self.assertEqual(img.size, (40, 30))
+        self.assertEqual(os.listdir(self.test_dir), [])
+    
+    def test_convert_from_file_object_to_path(self):
+        """Test converting an open binary file object to a path."""
+        jpg_path = self.create_test_image('jpg')
+        output_path = os.path.join(self.test_dir, "output.bmp")
+        
+        with open(jpg_path, 'rb') as f:
+            success, actual_format, actual_filename = convert_image(f, output_path, 'BMP')
+        
+        self.assertTrue(success)
+        self.assertEqual(actual_filename, output_path)
+        with Image.open(output_path) as img:
+            self.assertEqual(img.format, 'BMP')
+    
+    def test_streamed_input_reaches_imagemagick_as_path(self):
+        """Test that a streamed input is spilled to a real file for ImageMagick."""
+        source = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(source, 'PNG')
+        seen = {}
+        
+        def fake_run(cmd, **kwargs):
+            seen['input'] = cmd[1]
+            with open(cmd[1], 'rb') as f:
+                seen['data'] = f.read()
+            with open(cmd[2], 'wb') as f:
+                f.write(b'%PDF-1.4')
+        
+        output = io.BytesIO()
+        with mock.patch('image_converter.check_imagemagick', return_value='magick'), \
+                mock.patch('image_converter.imagemagick_can_write', return_value=True), \
+                mock.patch('image_converter.subprocess.run', side_effect=fake_run):
+            success, actual_format, _ = convert_image(source, output, 'PDF', input_name='scan.png')
+        
+        self.assertTrue(success)
+        self.assertEqual(actual_format, 'PDF')
+        self.assertTrue(seen['input'].endswith('.png'))
+        self.assertEqual(seen['data'], source.getvalue())
+        self.assertFalse(os.path.exists(seen['input']))
+        self.assertEqual(output.getvalue(), b'%PDF-1.4')
+
+    
+    def test_mode_copies_per_conversion(self):
+        """Benchmark pixel copies: the old dispatch chain made one per conversion."""
+        cases = [
+            # (source mode, output format, expected Image.convert calls);
+            # ICO is left out because its encoder resizes internally
+            ('RGBA', 'PNG', 0), ('RGBA', 'WEBP', 0), ('RGBA', 'TIFF', 0),
+            ('RGB', 'BMP', 0), ('RGB', 'TGA', 0), ('RGB', 'PCX', 0), ('RGB', 'JPEG', 0),
+            ('RGB', 'PNG', 0), ('P', 'GIF', 0),
+            ('RGBA', 'JPEG', 1), ('P', 'PNG', 1), ('L', 'BMP', 1), ('LA', 'WEBP', 1),
+        ]
+        for mode, format_name, expected in cases:
+            with self.subTest(mode=mode, format=format_name):
+                source = os.path.join(self.test_dir, f"source_{mode}.png")
+                Image.new(mode, (32, 32)).save(source, 'PNG')
+                output_path = os.path.join(self.test_dir, f"copies.{format_name.lower()}")
+                with mock.patch.object(Image.Image, 'convert', autospec=True, side_effect=Image.Image.convert) as convert:
+                    success, _, _ = convert_image(source, output_path, format_name)
+                self.assertTrue(success)
+                self.assertEqual(convert.call_count, expected)
+    
+    def test_register_custom_format(self):
+        """Test extending the registry with a new Pillow output format."""
+        from image_converter import register_format, FORMAT_REGISTRY, PILLOW_FORMATS
+        register_format('PPM', keep_modes=('RGB', 'L'))
+        try:
+            self.assertTrue(pillow_can_write('ppm'))
+            jpg_path = self.create_test_image('jpg')
+            output_path = os.path.join(self.test_dir, "output.ppm")
+            success, actual_format, _ = convert_image(jpg_path, output_path, 'PPM')
+            self.assertTrue(success)
+            self.assertEqual(actual_format, 'PPM')
+            with Image.open(output_path) as img:
+                self.assertEqual(img.format, 'PPM')
+        finally:
+            del FORMAT_REGISTRY['PPM']
+            PILLOW_FORMATS.discard('PPM')
+    
+    def test_encoder_presets(self):
+        """Test that 'fast' and 'small' presets trade speed for size."""
+        source = os.path.join(self.test_dir, "gradient.png")
+        Image.linear_gradient('L').resize((512, 512)).convert('RGB').save(source, 'PNG')
+        sizes = {}
+        for preset in ('fast', 'balanced', 'small'):
+            output_path = os.path.join(self.test_dir, f"{preset}.png")
+            success, _, _ = convert_image(source, output_path, 'PNG', preset=preset)
+            self.assertTrue(success)
+            sizes[preset] = os.path.getsize(output_path)
+        self.assertGreater(sizes['fast'], sizes['small'])
+        
+        jpeg_path = os.path.join(self.test_dir, "small.jpg")
+        convert_image(source, jpeg_path, 'JPEG', preset='small')
+        with Image.open(jpeg_path) as img:
+            self.assertTrue(img.info.get('progressive'))
+    
+    def test_encoder_options(self):
+        """Test explicit quality and lossless options."""
+        jpg_path = self.create_test_image('jpg', size=(64, 64))
+        output_path = os.path.join(self.test_dir, "lossless.webp")
+        success, _, _ = convert_image(jpg_path, output_path, 'WEBP', encoder_options={'lossless': True, 'quality': 50})
+        self.assertTrue(success)
+        with Image.open(output_path) as img:
+            self.assertEqual(img.format, 'WEBP')
+    
+    def test_invalid_encoder_options(self):
+        """Test per-format validation of presets and options."""
+        from image_converter import resolve_encoder_options, InvalidEncoderOptions
+        invalid = [
+            ('PNG', 'turbo', None),
+            ('PNG', None, {'quality': 80}),
+            ('JPEG', None, {'quality': 0}),
+            ('JPEG', None, {'quality': True}),
+            ('WEBP', None, {'lossless': 'yes'}),
+            ('PNG', None, {'dither': 1}),
+        ]
+        for fmt, preset, options in invalid:
+            with self.subTest(format=fmt, preset=preset, options=options):
+                with self.assertRaises(InvalidEncoderOptions):
+                    resolve_encoder_options(fmt, preset, options)
+        
+        self.assertEqual(resolve_encoder_options('PNG', 'fast'), {'compress_level': 1})
+        self.assertEqual(resolve_encoder_options('JPG', None, {'quality': 70}), {'quality': 70})
+        self.assertEqual(resolve_encoder_options('PDF', 'small'), {})
+        
+        jpg_path = self.create_test_image('jpg')
+        output_path = os.path.join(self.test_dir, "invalid.png")
+        success, _, _ = convert_image(jpg_path, output_path, 'PNG', encoder_options={'quality': 80})
+        self.assertFalse(success)
+        self.assertFalse(os.path.exists(output_path))
+
+
+class TestCodecPlugins(unittest.TestCase):
+    def setUp(self):
+        import image_converter
+        self.plugins = image_converter.PLUGIN_FORMATS
+
+    def convert(self, fmt, **kwargs):
+        buf = io.BytesIO()
+        Image.new('RGBA', (64, 48), (0, 128, 255, 128)).save(buf, 'PNG')
+        output = io.BytesIO()
+        result = convert_image(buf.getvalue(), output, fmt, **kwargs)
+        return result, output.getvalue()
+
+    def test_avif_in_process(self):
+        """Test AVIF encoding through pillow-avif-plugin, with speed and quality."""
+        if 'AVIF' not in self.plugins:
+            self.skipTest('pillow-avif-plugin not installed')
+        with mock.patch('image_converter.run_imagemagick') as run_imagemagick:
+            (success, actual_format, _), data = self.convert('AVIF', encoder_options={'speed': 10, 'quality': 50})
+        run_imagemagick.assert_not_called()
+        self.assertEqual((success, actual_format), (True, 'AVIF'))
+        with Image.open(io.BytesIO(data)) as img:
+            self.assertEqual((img.format, img.mode, img.size), ('AVIF', 'RGBA', (64, 48)))
+        (success, _, _), _ = self.convert('AVIF', encoder_options={'speed': 11})
+        self.assertFalse(success)
+
+    def test_heic_in_process(self):
+        """Test HEIC encoding through pillow-heif, including presets."""
+        if 'HEIC' not in self.plugins:
+            self.skipTest('pillow-heif not installed')
+        for preset in ('fast', 'small'):
+            (success, actual_format, _), data = self.convert('HEIC', preset=preset, encoder_options={'quality': 60})
+            self.assertEqual((success, actual_format), (True, 'HEIC'))
+            with Image.open(io.BytesIO(data)) as img:
+                self.assertEqual((img.format, img.size), ('HEIF', (64, 48)))
+
+    def test_plugins_load_on_first_use(self):
+        """Test that codec plugins are imported by the first HEIC/AVIF conversion, not at import."""
+        if not self.plugins:
+            self.skipTest('no codec plugins installed')
+        fmt = sorted(self.plugins)[0]
+        script = f"""
+import io, sys
+from PIL import Image
+import image_converter
+assert not {{'pillow_heif', 'pillow_avif'}} & set(sys.modules), 'imported eagerly'
+buf = io.BytesIO()
+Image.new('RGB', (16, 16), 'red').save(buf, 'PNG')
+encoded = io.BytesIO()
+assert image_converter.convert_image(buf.getvalue(), encoded, '{fmt}')[0]
+"""
+        subprocess.run([sys.executable, '-c', script], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        # A fresh process decoding one of these loads the opener on demand
+        buf = io.BytesIO()
+        Image.new('RGB', (16, 16), 'red').save(buf, 'PNG')
+        encoded = io.BytesIO()
+        self.assertTrue(convert_image(buf.getvalue(), encoded, fmt)[0])
+        script = f"""
+import io, sys
+import image_converter
+output = io.BytesIO()
+assert image_converter.convert_image(sys.stdin.buffer.read(), output, 'PNG') == (True, 'PNG', output)
+"""
+        subprocess.run([sys.executable, '-c', script], check=True, input=encoded.getvalue(),
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestAnimation(unittest.TestCase):
+    def make_animation(self, fmt, frames=5, disposal=2):
+        """Moving square on a transparent canvas, each frame 10ms longer."""
+        images = []
+        for i in range(frames):
+            frame = Image.new('RGBA', (40, 40), (0, 0, 0, 0))
+            frame.paste((255, 0, 0, 255), (i * 8, i * 8, i * 8 + 8, i * 8 + 8))
+            images.append(frame)
+        buf = io.BytesIO()
+        images[0].save(buf, fmt, save_all=True, append_images=images[1:], loop=3, disposal=disposal,
+                       duration=[40 + 10 * i for i in range(frames)])
+        return buf.getvalue()
+
+    def read_frames(self, data):
+        frames = []
+        with Image.open(io.BytesIO(data)) as img:
+            loop = img.info.get('loop')
+            for i in range(img.n_frames):
+                img.seek(i)
+                img.load()
+                frame = Image.alpha_composite(Image.new('RGBA', img.size, 'white'), img.convert('RGBA'))
+                frames.append((frame, img.info.get('duration')))
+        return frames, loop
+
+    def test_frames_timing_and_loop_preserved(self):
+        """Test conversion between GIF, APNG and animated WEBP."""
+        for source_format, disposal in (('GIF', 2), ('GIF', 3), ('PNG', 2)):
+            source = self.make_animation(source_format, disposal=disposal)
+            expected, _ = self.read_frames(source)
+            for output_format in ('GIF', 'APNG', 'WEBP'):
+                with self.subTest(source=source_format, disposal=disposal, output=output_format):
+                    options = {'lossless': True} if output_format == 'WEBP' else None
+                    output = io.BytesIO()
+                    success, actual_format, _ = convert_image(source, output, output_format, encoder_options=options)
+                    self.assertTrue(success)
+                    self.assertEqual(actual_format, output_format)
+                    frames, loop = self.read_frames(output.getvalue())
+                    self.assertEqual(loop, 3)
+                    self.assertEqual([d for _, d in frames], [d for _, d in expected])
+                    for (frame, _), (reference, _) in zip(frames, expected):
+                        self.assertIsNone(ImageChops.difference(frame, reference).getbbox())
+
+    def test_max_fps_merges_frame_durations(self):
+        """Test that decimation drops frames but keeps total play time."""
+        output = io.BytesIO()
+        success, _, _ = convert_image(self.make_animation('GIF', frames=10), output, 'WEBP',
+                                      encoder_options={'max_fps': 10})
+        self.assertTrue(success)
+        frames, _ = self.read_frames(output.getvalue())
+        durations = [d for _, d in frames]
+        self.assertEqual(sum(durations), sum(40 + 10 * i for i in range(10)))
+        self.assertTrue(all(d >= 100 for d in durations))
+
+    def test_animation_memory_budget(self):
+        """Test that long animations are refused once frames outgrow the budget."""
+        from image_converter import ImageTooLarge, iter_frames
+        with Image.open(io.BytesIO(self.make_animation('GIF', frames=10))) as img:
+            with self.assertRaises(ImageTooLarge):
+                list(iter_frames(img, 'WEBP', [], [], budget=40 * 40 * 8 * 3))
+
+
+class TestConvertImageMulti(unittest.TestCase):
+    def source_bytes(self, size=(120, 80), mode='RGBA'):
+        buf = io.BytesIO()
+        Image.new(mode, size, (0, 128, 255, 200)).save(buf, 'PNG')
+        return buf.getvalue()
+
+    def test_one_decode_many_outputs(self):
+        """Test that every output is written from a single decode."""
+        from image_converter import convert_image_multi
+        outputs = [
+            {'format': 'PNG', 'output': io.BytesIO()},
+            {'format': 'JPEG', 'output': io.BytesIO()},
+            {'format': 'WEBP', 'output': io.BytesIO(), 'size': (60, 60)},
+            {'format': 'JPEG', 'output': io.BytesIO(), 'size': (0, 20)},
+        ]
+        with mock.patch('PIL.Image.open', wraps=Image.open) as image_open:
+            manifest = convert_image_multi(self.source_bytes(), outputs, encoder_options={'quality': 70})
+        self.assertEqual(image_open.call_count, 1)
+
+        self.assertTrue(all(entry['success'] for entry in manifest))
+        self.assertEqual([entry['size'] for entry in manifest], [[120, 80], [120, 80], [60, 40], [30, 20]])
+        for entry, (fmt, mode) in zip(manifest, [('PNG', 'RGBA'), ('JPEG', 'RGB'), ('WEBP', 'RGBA'), ('JPEG', 'RGB')]):
+            with Image.open(io.BytesIO(entry['output'].getvalue())) as img:
+                self.assertEqual((img.format, img.mode, list(img.size)), (fmt, mode, entry['size']))
+
+    def test_outputs_to_paths_and_non_pillow_formats(self):
+        """Test path outputs and the ImageMagick/PNG fallback route."""
+        from image_converter import convert_image_multi
+        test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, test_dir)
+        outputs = [
+            {'format': 'GIF', 'output': os.path.join(test_dir, 'out', 'a.gif')},
+            {'format': 'SVG', 'output': os.path.join(test_dir, 'a.svg'), 'size': (50, 50)},
+        ]
+        with mock.patch('image_converter.imagemagick_command', return_value=None):
+            manifest = convert_image_multi(self.source_bytes(), outputs)
+        self.assertTrue(manifest[0]['success'])
+        self.assertTrue(os.path.exists(manifest[0]['output']))
+        self.assertEqual(manifest[1]['actual_format'], 'PNG')
+        with Image.open(manifest[1]['output']) as img:
+            self.assertEqual(img.size, (50, 33))
+
+    def test_pyramid_cascades_from_previous_level(self):
+        """Test that each derivative is resized from the next larger one."""
+        # 1280 -> 320 is pre-shrunk 2x by reduce() before LANCZOS
+        from image_converter import build_pyramid
+        img = Image.fromarray((np.random.rand(900, 1600, 3) * 255).astype('uint8'))
+        with mock.patch.object(Image.Image, 'resize', autospec=True, side_effect=Image.Image.resize) as resize:
+            levels = build_pyramid(img, [(160, 90), (1280, 720), (320, 180)])
+        self.assertEqual(sorted(levels), [(160, 90), (320, 180), (1280, 720), (1600, 900)])
+        self.assertEqual([(c.args[0].size, c.args[1]) for c in resize.call_args_list],
+                         [((1600, 900), (1280, 720)), ((640, 360), (320, 180)), ((320, 180), (160, 90))])
+
+    def test_downscale_matches_direct_lanczos(self):
+        """Test that the reduce() pre-shrink doesn't visibly change the result."""
+        from image_converter import downscale
+        x = np.linspace(0, 255, 2000)
+        img = Image.fromarray(np.outer(x, np.ones(2000)).astype('uint8')).convert('RGB')
+        with mock.patch.object(Image.Image, 'reduce', autospec=True, side_effect=Image.Image.reduce) as reduce:
+            fast = downscale(img, (250, 250))
+        self.assertEqual(reduce.call_args.args[1], 4)
+        direct = img.resize((250, 250), Image.Resampling.LANCZOS)
+        self.assertLessEqual(max(high for _, high in ImageChops.difference(fast, direct).getextrema()), 2)
+
+    def test_jpeg_derivatives_decode_at_reduced_scale(self):
+        """Test that derivative-only requests let libjpeg decode a smaller image."""
+        from image_converter import convert_image_multi
+        buf = io.BytesIO()
+        Image.new('RGB', (1600, 1200), 'red').save(buf, 'JPEG')
+        outputs = [{'format': 'WEBP', 'output': io.BytesIO(), 'size': (320, 0)},
+                   {'format': 'JPEG', 'output': io.BytesIO(), 'size': (640, 0)}]
+        with mock.patch('PIL.Image.Image.load', autospec=True, side_effect=Image.Image.load) as load:
+            manifest = convert_image_multi(buf.getvalue(), outputs)
+        self.assertEqual([entry['size'] for entry in manifest], [[320, 240], [640, 480]])
+        self.assertEqual(load.call_args_list[0].args[0].size, (800, 600))
+
+    def test_unreadable_input_reports_each_output(self):
+        """Test that a bad input fails per output instead of raising."""
+        from image_converter import convert_image_multi
+        manifest = convert_image_multi(b'not an image', [{'format': 'PNG', 'output': io.BytesIO()},
+                                                         {'format': 'PNG', 'output': io.BytesIO(), 'size': (10, 10)}])
+        self.assertEqual([entry['success'] for entry in manifest], [False, False])
+        self.assertTrue(all(entry['error'] for entry in manifest))
+
+
+class TestMemoryBudget(unittest.TestCase):
+    """Peak-memory benchmarks; each conversion runs in a fresh interpreter."""
+    
+    # VmHWM is reset by exec, unlike ru_maxrss which inherits the parent's peak
+    SCRIPT = """
+import json, resource, sys
+from image_converter import convert_image
+result = convert_image(sys.argv[1], sys.argv[2], sys.argv[3])
+try:
+    with open('/proc/self/status') as f:
+        peak_kb = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+except OSError:
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({'success': result[0], 'peak_kb': peak_kb}))
+"""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.test_dir = tempfile.mkdtemp()
+        cls.large_jpeg = os.path.join(cls.test_dir, "large.jpg")
+        Image.new('RGB', (4000, 4000), (10, 120, 200)).save(cls.large_jpeg, 'JPEG')
+    
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.test_dir)
+    
+    def measure(self, output_name, fmt='PNG', **env):
+        output_path = os.path.join(self.test_dir, output_name)
+        environ = dict(os.environ, **env)
+        environ['PATH'] = ''  # keep ImageMagick out of the measurement
+        result = subprocess.run(
+            [sys.executable, '-c', self.SCRIPT, self.large_jpeg, output_path, fmt],
+            capture_output=True, check=True, env=environ, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        return json.loads(result.stdout.decode().strip().splitlines()[-1]), output_path
+    
+    def test_draft_decode_bounds_peak_memory(self):
+        """Test that downscaled JPEG decoding keeps peak RSS near the budget."""
+        full, _ = self.measure('full.png')
+        budget = 32 * 1024 * 1024
+        small, small_path = self.measure('small.png', FORMATLY_MEMORY_BUDGET=str(budget),
+                                         FORMATLY_OVERSIZE_POLICY='downscale')
+        
+        self.assertTrue(full['success'])
+        self.assertTrue(small['success'])
+        self.assertLess(small['peak_kb'], full['peak_kb'] / 2)
+        with Image.open(small_path) as img:
+            self.assertLessEqual(img.width * img.height * 8, budget)
+    
+    def test_over_budget_image_uses_imagemagick_pixel_cache(self):
+        """Test that images over the memory budget go to ImageMagick with limits."""
+        png_path = os.path.join(self.test_dir, "wide.png")
+        Image.new('RGB', (300, 200)).save(png_path, 'PNG')
+        output_path = os.path.join(self.test_dir, "wide.webp")
+        
+        with mock.patch('image_converter.MEMORY_BUDGET', 1024), \
+                mock.patch('image_converter.check_imagemagick', return_value='magick'), \
+                mock.patch('magick_backend.subprocess.run') as run:
+            success, actual_format, _ = convert_image(png_path, output_path, 'WEBP')
+        
+        self.assertTrue(success)
+        self.assertEqual(actual_format, 'WEBP')
+        cmd = run.call_args[0][0]
+        self.assertEqual(cmd[:3], ['magick', '-limit', 'memory'])
+        self.assertEqual(cmd[-2:], [png_path, output_path])
+    
+    def test_oversized_input_rejected_before_decode(self):
+        """Test that images over the pixel limit fail without being decoded."""
+        full, _ = self.measure('full.bmp', fmt='BMP')
+        rejected, path = self.measure('rejected.bmp', fmt='BMP', FORMATLY_MAX_PIXELS='1000000')
+        
+        self.assertFalse(rejected['success'])
+        self.assertFalse(os.path.exists(path))
+        self.assertLess(rejected['peak_kb'], full['peak_kb'] / 2)
+
+class TestCapabilities(unittest.TestCase):
+    FORMAT_LIST = """   Format  Mode  Description
+-------------------------------------------------------------------------------
+      AVIF* rw+   AV1 Image File Format (1.0.9)
+      CDR   r--   Corel Draw
+      PDF   rw+   Portable Document Format
+      PNG*  rw-   Portable Network Graphics (libpng 1.6.39)
+"""
+
+    def setUp(self):
+        capabilities._capabilities = None
+        capabilities._probed_at = 0.0
+
+    def tearDown(self):
+        capabilities._capabilities = None
+        capabilities._probed_at = 0.0
+
+    def test_parse_formats(self):
+        """Test parsing the read/write columns of `magick -list format`."""
+        read_formats, write_formats = capabilities.parse_formats(self.FORMAT_LIST)
+        self.assertEqual(read_formats, {'AVIF', 'CDR', 'PDF', 'PNG'})
+        self.assertEqual(write_formats, {'AVIF', 'PDF', 'PNG'})
+
+    def test_parse_version(self):
+        """Test extracting the version from `magick -version`."""
+        output = "Version: ImageMagick 7.1.1-15 Q16-HDRI x86_64 21298\nCopyright: (C) 1999 ImageMagick Studio LLC\n"
+        self.assertEqual(capabilities.parse_version(output), '7.1.1-15')
+
+    def test_probe_is_cached(self):
+        """Test that repeated lookups do not spawn ImageMagick again."""
+        def fake_run(cmd, **kwargs):
+            stdout = self.FORMAT_LIST if '-list' in cmd else 'Version: ImageMagick 7.1.1-15 Q16'
+            return mock.Mock(stdout=stdout.encode())
+
+        with mock.patch('capabilities.subprocess.run', side_effect=fake_run) as run:
+            for _ in range(5):
+                self.assertEqual(check_imagemagick(), 'magick')
+                self.assertTrue(capabilities.imagemagick_can_write('pdf'))
+                self.assertFalse(capabilities.imagemagick_can_write('CDR'))
+            self.assertEqual(run.call_count, 2)
+
+            capabilities.refresh_capabilities()
+            self.assertEqual(run.call_count, 4)
+
+    def test_probe_without_imagemagick(self):
+        """Test the probe result when no ImageMagick binary is installed."""
+        with mock.patch('capabilities.subprocess.run', side_effect=FileNotFoundError):
+            caps = capabilities.get_capabilities()
+        self.assertIsNone(caps['command'])
+        self.assertFalse(capabilities.imagemagick_can_write('PDF'))
+
+    def test_probe_in_background(self):
+        """Test that a background probe runs once and callers never wait for it."""
+        release = threading.Event()
+        result = {'command': 'magick', 'version': None, 'read_formats': frozenset(), 'write_formats': frozenset()}
+
+        def slow_probe():
+            release.wait(5)
+            return result
+
+        with mock.patch('capabilities.probe_imagemagick', side_effect=slow_probe) as probe:
+            capabilities.probe_in_background()
+            capabilities.probe_in_background()
+            self.assertIsNone(capabilities.cached_capabilities())
+            release.set()
+            capabilities._background.join(5)
+            self.assertIs(capabilities.cached_capabilities(), result)
+            capabilities.probe_in_background()
+        self.assertEqual(probe.call_count, 1)
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,79 @@
+import unittest
+from unittest import mock
+import os
+import shutil
+import tempfile
+import time
+from janitor import Janitor
+
+
+class TestJanitor(unittest.TestCase):
+    def setUp(self):
+        """Set up output and upload directories."""
+        self.test_dir = tempfile.mkdtemp()
+        self.outputs = os.path.join(self.test_dir, 'outputs')
+        self.uploads = os.path.join(self.test_dir, 'uploads')
+        os.makedirs(self.outputs)
+        os.makedirs(self.uploads)
+        self.removed = []
+        self.janitor = Janitor([self.outputs, self.uploads], ttl=60, max_bytes=1000, interval=0,
+                               on_remove=self.removed.extend, lock_path=os.path.join(self.test_dir, 'janitor.lock'))
+
+    def tearDown(self):
+        """Clean up test files."""
+        shutil.rmtree(self.test_dir)
+
+    def make_file(self, directory, name, size=100, age=0):
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_lock_outside_swept_directories(self):
+        """Test that the sweep lock isn't left in the (served) directories."""
+        self.janitor.sweep()
+        self.assertEqual(os.listdir(self.outputs), [])
+        self.assertEqual(os.listdir(self.uploads), [])
+        default = Janitor([self.outputs, self.uploads])
+        self.assertEqual(default.lock_path, Janitor([self.outputs, self.uploads]).lock_path)
+        self.assertNotEqual(default.lock_path, Janitor([self.uploads]).lock_path)
+        self.assertFalse(default.lock_path.startswith(self.test_dir))
+
+    def test_expires_old_files(self):
+        """Test that files past the TTL are removed from both directories."""
+        old_output = self.make_file(self.outputs, 'old.png', age=120)
+        old_upload = self.make_file(self.uploads, 'orphan.jpg', age=120)
+        fresh = self.make_file(self.outputs, 'fresh.png')
+        keep = self.make_file(self.outputs, '.gitkeep', age=120)
+
+        self.janitor.sweep()
+        self.assertEqual(sorted(self.removed), sorted([old_output, old_upload]))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertTrue(os.path.exists(keep))
+
+    def test_quota_evicts_oldest_first(self):
+        """Test that the disk quota is enforced oldest-first."""
+        oldest = self.make_file(self.outputs, 'a.png', size=400, age=30)
+        middle = self.make_file(self.uploads, 'b.png', size=400, age=20)
+        newest = self.make_file(self.outputs, 'c.png', size=400, age=10)
+
+        self.janitor.sweep()
+        self.assertEqual(self.removed, [oldest])
+        self.assertTrue(os.path.exists(middle))
+        self.assertTrue(os.path.exists(newest))
+        self.assertEqual(self.janitor.total_bytes(), 800)
+
+    def test_tracked_files_are_swept_without_rescan(self):
+        """Test that the index, not a directory listing, drives later sweeps."""
+        self.janitor.sweep()
+        path = self.make_file(self.outputs, 'new.png', age=120)
+        self.janitor.track(path)
+        with mock.patch('os.scandir', side_effect=AssertionError('rescanned')):
+            self.janitor.sweep()
+        self.assertEqual(self.removed, [path])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import io
+import os
+import shutil
+import tempfile
+import time
+from PIL import Image  # type: ignore
+from image_converter import convert_image, convert_image_multi
+from jobs import JobQueue, QueueFull
+
+
+def slow_square(value, delay=0):
+    time.sleep(delay)
+    return value * value
+
+
+class SlowFile(io.BytesIO):
+    """An upload that takes `delay` seconds per read"""
+
+    def __init__(self, data, delay):
+        super().__init__(data)
+        self.delay = delay
+
+    def read(self, *args):
+        time.sleep(self.delay)
+        return super().read(*args)
+
+
+def convert_slowly(output_path, multi=False, delay=5):
+    buf = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(buf, 'PNG')
+    source = SlowFile(buf.getvalue(), delay)
+    if multi:
+        return convert_image_multi(source, [{'format': 'WEBP', 'output': output_path}])
+    return convert_image(source, output_path, 'WEBP')
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        """Set up a queue backed by a temporary database."""
+        self.test_dir = tempfile.mkdtemp()
+        self.queue = JobQueue(os.path.join(self.test_dir, 'jobs.sqlite3'), max_workers=1, max_pending=1, timeout=1)
+
+    def tearDown(self):
+        """Shut the pool down and clean up."""
+        self.queue.shutdown()
+        shutil.rmtree(self.test_dir)
+
+    def test_job_result(self):
+        """Test that a finished job stores the on_result value."""
+        job_id = self.queue.submit(slow_square, 7, on_result=lambda value: {'value': value})
+        job = self.queue.wait(job_id)
+        self.assertEqual(job['state'], 'done')
+        self.assertEqual(job['result'], {'value': 49})
+        self.assertEqual(self.queue.pending(), 0)
+
+    def test_queue_full(self):
+        """Test that submissions beyond max_pending are refused."""
+        job_id = self.queue.submit(slow_square, 2, delay=0.5)
+        with self.assertRaises(QueueFull):
+            self.queue.submit(slow_square, 3)
+        self.queue.wait(job_id)
+        self.queue.wait(self.queue.submit(slow_square, 3))
+
+    def test_job_timeout(self):
+        """Test that a job running past its time limit is failed."""
+        job_id = self.queue.submit(slow_square, 2, delay=5)
+        job = self.queue.wait(job_id)
+        self.assertEqual(job['state'], 'failed')
+        self.assertIn('timed out', job['error'])
+
+    def test_conversion_timeout_not_swallowed(self):
+        """Test that the converters' own error handling doesn't turn a timeout into a result."""
+        for multi in (False, True):
+            with self.subTest(multi=multi):
+                job_id = self.queue.submit(convert_slowly, os.path.join(self.test_dir, 'out.webp'), multi=multi)
+                job = self.queue.wait(job_id)
+                self.assertEqual(job['state'], 'failed')
+                self.assertEqual(job['error'], 'Conversion timed out after 1 seconds')
+
+    def test_shared_state(self):
+        """Test that another queue on the same database sees the job."""
+        job_id = self.queue.submit(slow_square, 4)
+        self.queue.wait(job_id)
+        other = JobQueue(self.queue.db_path)
+        self.assertEqual(other.get(job_id)['state'], 'done')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import io
+import os
+import runpy
+import unittest
+from unittest import mock
+from werkzeug.test import EnvironBuilder  # type: ignore
+from werkzeug.formparser import parse_form_data  # type: ignore
+import loadtest
+
+
+class TestLoadTest(unittest.TestCase):
+    def test_multipart_body_parses(self):
+        """Test that the hand-built upload body is valid multipart."""
+        body, content_type = loadtest.multipart_body({'output_format': 'WEBP'}, {'file': ('a.jpg', b'\xff\xd8data')})
+        environ = EnvironBuilder(method='POST', input_stream=io.BytesIO(body),
+                                 content_type=content_type, content_length=len(body)).get_environ()
+        _, form, files = parse_form_data(environ)
+        self.assertEqual(form['output_format'], 'WEBP')
+        self.assertEqual((files['file'].filename, files['file'].read()), ('a.jpg', b'\xff\xd8data'))
+
+    def test_summary_and_checks(self):
+        """Test that shed requests are counted apart from errors."""
+        results = [(200, 0.1)] * 8 + [(429, 0.001), (500, 0.2)]
+        summary = loadtest.summarize(results, elapsed=2)
+        self.assertEqual((summary['ok'], summary['shed'], summary['errors'], summary['rps']), (8, 1, 1, 4.0))
+        self.assertEqual(summary['p95_ms'], 100.0)
+        self.assertEqual(loadtest.check(summary, max_error_rate=0.2), [])
+        self.assertEqual(len(loadtest.check(summary, max_p95_ms=50, max_error_rate=0.05)), 2)
+
+
+class TestGunicornConf(unittest.TestCase):
+    def load(self, **env):
+        with mock.patch.dict(os.environ, env):
+            os.environ.pop('JOB_WORKERS', None)
+            os.environ.pop('BATCH_WORKERS', None)
+            os.environ.pop('FORMATLY_MEMORY_BUDGET', None)
+            config = runpy.run_path('gunicorn.conf.py')
+            return config, os.environ['JOB_WORKERS'], os.environ['BATCH_WORKERS']
+
+    def test_plan_fits_cpu_and_memory(self):
+        """Test that job and /batch processes together are capped by CPUs and by memory."""
+        with mock.patch.dict(os.environ):
+            config = runpy.run_path('gunicorn.conf.py')
+        plan = config['plan']
+        mb = 1024 ** 2
+
+        def peak(workers, jobs, batch, budget):
+            return workers * (config['WORKER_MEMORY'] + (jobs + batch) * (budget + config['CONVERSION_OVERHEAD']))
+
+        self.assertEqual(plan(8, 16 * 1024 * mb, 256 * mb), (4, 1, 1, 256 * mb))
+        self.assertEqual(plan(8, 16 * 1024 * mb, 256 * mb, workers=2), (2, 2, 2, 256 * mb))
+        for cpus, memory in ((8, 16 * 1024 * mb), (8, 2048 * mb), (2, 1024 * mb), (1, 512 * mb)):
+            with self.subTest(cpus=cpus, memory=memory):
+                workers, jobs, batch, budget = plan(cpus, memory, 256 * mb)
+                self.assertGreaterEqual(min(jobs, batch), 1)
+                self.assertLessEqual(workers * (jobs + batch), max(2, cpus))
+                self.assertLessEqual(peak(workers, jobs, batch, budget), memory)
+        # Too small for two 256MB conversions: the budget shrinks instead
+        self.assertLess(plan(1, 512 * mb, 256 * mb)[3], 256 * mb)
+
+    def test_settings(self):
+        """Test the preload/gthread profile and environment overrides."""
+        config, job_workers, batch_workers = self.load(PORT='9999', WEB_CONCURRENCY='3', GUNICORN_THREADS='16', MAX_REQUESTS='500')
+        self.assertTrue(config['preload_app'])
+        self.assertEqual(config['worker_class'], 'gthread')
+        self.assertEqual((config['bind'], config['threads']), ('0.0.0.0:9999', 16))
+        self.assertLessEqual(config['workers'], 3)
+        self.assertEqual((config['max_requests'], config['max_requests_jitter']), (500, 50))
+        self.assertGreaterEqual(int(job_workers), 1)
+        self.assertGreaterEqual(int(batch_workers), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
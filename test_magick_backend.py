@@ -0,0 +1,119 @@
+import unittest
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+import magick_backend
+from magick_backend import MagickPool, WorkerUnavailable
+
+# Stands in for the Wand worker: copies input to output, or hangs/fails on request
+FAKE_WORKER = '''
+import json, shutil, sys, time
+print('ready', flush=True)
+for line in sys.stdin:
+    request = json.loads(line)
+    if 'slow' in request['input']:
+        time.sleep(30)
+    if 'bad' in request['input']:
+        print(json.dumps({'ok': False, 'error': 'no decode delegate'}), flush=True)
+        continue
+    shutil.copyfile(request['input'], request['output'])
+    print(json.dumps({'ok': True}), flush=True)
+'''
+
+
+class TestMagickPool(unittest.TestCase):
+    def setUp(self):
+        """Set up a pool of fake workers."""
+        self.test_dir = tempfile.mkdtemp()
+        self.pool = MagickPool(size=1, command=[sys.executable, '-c', FAKE_WORKER])
+
+    def tearDown(self):
+        """Stop workers and clean up."""
+        self.pool.close()
+        shutil.rmtree(self.test_dir)
+
+    def make_input(self, name):
+        path = os.path.join(self.test_dir, name)
+        with open(path, 'wb') as f:
+            f.write(b'data')
+        return path
+
+    def test_worker_is_reused(self):
+        """Test that consecutive conversions share one worker process."""
+        source = self.make_input('in.png')
+        self.pool.run(source, os.path.join(self.test_dir, 'a.pdf'))
+        worker = self.pool._idle.queue[0]
+        self.pool.run(source, os.path.join(self.test_dir, 'b.pdf'))
+        self.assertIs(self.pool._idle.queue[0], worker)
+        self.assertTrue(os.path.exists(os.path.join(self.test_dir, 'b.pdf')))
+
+    def test_failure_raises_called_process_error(self):
+        """Test that worker errors surface like a failed magick command."""
+        with self.assertRaises(subprocess.CalledProcessError) as ctx:
+            self.pool.run(self.make_input('bad.png'), os.path.join(self.test_dir, 'out.pdf'))
+        self.assertIn(b'no decode delegate', ctx.exception.stderr)
+        self.assertTrue(self.pool._idle.queue[0].alive())
+
+    def test_timeout_kills_and_replaces_worker(self):
+        """Test that a stuck conversion times out and the worker is replaced."""
+        with self.assertRaises(subprocess.TimeoutExpired):
+            self.pool.run(self.make_input('slow.png'), os.path.join(self.test_dir, 'out.pdf'), timeout=0.5)
+        self.assertEqual(self.pool._started, 0)
+        self.pool.run(self.make_input('ok.png'), os.path.join(self.test_dir, 'out.pdf'))
+
+    def test_interrupted_worker_not_reused(self):
+        """Test that a worker interrupted mid-conversion is killed, so its reply can't reach the next caller."""
+        self.pool.run(self.make_input('in.png'), os.path.join(self.test_dir, 'a.pdf'))
+        worker = self.pool._idle.queue[0]
+        with mock.patch('magick_backend.select.select', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.pool.run(self.make_input('in.png'), os.path.join(self.test_dir, 'b.pdf'))
+        self.assertFalse(worker.alive())
+        self.assertEqual(self.pool._started, 0)
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.pool.run(self.make_input('bad.png'), os.path.join(self.test_dir, 'c.pdf'))
+
+    def test_timeout_includes_wait_for_worker(self):
+        """Test that time spent waiting for a busy pool counts against the timeout."""
+        self.pool.run(self.make_input('in.png'), os.path.join(self.test_dir, 'a.pdf'))
+        busy = self.pool._acquire(1)
+        threading.Timer(0.5, self.pool._release, (busy,)).start()
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            self.pool.run(self.make_input('slow.png'), os.path.join(self.test_dir, 'out.pdf'), timeout=1)
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    def test_unavailable_worker(self):
+        """Test startup failure when the worker cannot load its binding."""
+        pool = MagickPool(size=1, command=[sys.executable, '-c', 'print("Wand is not installed")'])
+        with self.assertRaises(WorkerUnavailable):
+            pool.run(self.make_input('in.png'), os.path.join(self.test_dir, 'out.pdf'))
+
+    def test_unavailable_worker_not_respawned(self):
+        """Test that after a failed start the fallback goes straight to subprocess."""
+        pool = MagickPool(size=1, command=[sys.executable, '-c', 'print("Wand is not installed")'])
+        with mock.patch.object(magick_backend, 'BACKEND', 'pool'), \
+                mock.patch.object(magick_backend, 'get_pool', return_value=pool), \
+                mock.patch.object(magick_backend, 'MagickWorker', wraps=magick_backend.MagickWorker) as worker, \
+                mock.patch('magick_backend.subprocess.run') as run:
+            for _ in range(3):
+                magick_backend.run_conversion('magick', 'in.png', 'out.pdf')
+        self.assertEqual(worker.call_count, 1)
+        self.assertEqual(run.call_count, 3)
+
+    def test_run_conversion_falls_back_to_subprocess(self):
+        """Test that the pool backend falls back to forking magick."""
+        with mock.patch.object(magick_backend, 'BACKEND', 'pool'), \
+                mock.patch.object(magick_backend, 'get_pool', side_effect=WorkerUnavailable('no wand')), \
+                mock.patch('magick_backend.subprocess.run') as run:
+            magick_backend.run_conversion('magick', 'in.png', 'out.pdf')
+        self.assertEqual(run.call_args[0][0], ['magick', 'in.png', 'out.pdf'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import metrics
+from metrics import Counter, Histogram
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        """Create throwaway metrics."""
+        self.histogram = Histogram('test_seconds', 'Test histogram', ['stage'], buckets=(0.1, 1))
+        self.counter = Counter('test_bytes', 'Test counter', ['output'])
+
+    def tearDown(self):
+        """Unregister them again."""
+        metrics.REGISTRY.pop('test_seconds')
+        metrics.REGISTRY.pop('test_bytes')
+
+    def test_histogram_exposition(self):
+        """Test cumulative buckets, sum and count in the text format."""
+        self.histogram.observe(0.05, stage='encode')
+        self.histogram.observe(0.5, stage='encode')
+        self.histogram.observe(5, stage='encode')
+        text = self.histogram.render()
+        self.assertIn('# TYPE test_seconds histogram', text)
+        self.assertIn('test_seconds_bucket{stage="encode",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{stage="encode",le="1.0"} 2', text)
+        self.assertIn('test_seconds_bucket{stage="encode",le="+Inf"} 3', text)
+        self.assertIn('test_seconds_sum{stage="encode"} 5.55', text)
+        self.assertIn('test_seconds_count{stage="encode"} 3', text)
+
+    def test_counter_labels_are_escaped(self):
+        """Test that label values cannot break the exposition format."""
+        self.counter.inc(10, output='a"b')
+        self.assertIn('test_bytes_total{output="a\\"b"} 10', self.counter.render())
+
+    def test_collected_samples_merge(self):
+        """Test that observations made in a worker are replayed in the parent."""
+        def work():
+            self.counter.inc(3, output='PNG')
+            return 'done'
+
+        value, samples = metrics.call_collected(work)
+        self.assertEqual(value, 'done')
+        self.assertEqual(self.counter.get(output='PNG'), 0)
+        metrics.merge(samples)
+        self.assertEqual(self.counter.get(output='PNG'), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
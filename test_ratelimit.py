@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from ratelimit import RateLimiter, retry_after_header
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, 'ratelimit.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_token_bucket_refills(self):
+        """Test burst, refill rate and the suggested retry delay."""
+        limiter = RateLimiter(self.db_path, rate=2, burst=3)
+        self.assertEqual([limiter.consume('a', now=100) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(limiter.consume('a', now=100), 0.5)
+        self.assertEqual(limiter.consume('a', now=100.5), 0)
+        self.assertGreater(limiter.consume('a', now=100.5), 0)
+        # Buckets are independent and capped at the burst size
+        self.assertEqual(limiter.consume('b', now=100), 0)
+        self.assertEqual([limiter.consume('a', now=1000) for _ in range(4)].count(0), 3)
+
+    def test_state_shared_between_instances(self):
+        """Test that separate limiters (e.g. gunicorn workers) share one bucket."""
+        first = RateLimiter(self.db_path, rate=1, burst=2)
+        second = RateLimiter(self.db_path, rate=1, burst=2)
+        self.assertEqual(first.consume('a', now=10), 0)
+        self.assertEqual(second.consume('a', now=10), 0)
+        self.assertGreater(first.consume('a', now=10), 0)
+
+    def test_admission_slots(self):
+        """Test the in-flight cap, release and expiry of abandoned slots."""
+        limiter = RateLimiter(self.db_path, max_inflight=2, slot_ttl=60)
+        slots = [limiter.admit(now=100), limiter.admit(now=100)]
+        self.assertTrue(all(slots))
+        self.assertIsNone(limiter.admit(now=100))
+        limiter.release(slots[0])
+        self.assertTrue(limiter.admit(now=100))
+        # Slots of a worker that died mid-request expire
+        self.assertTrue(limiter.admit(now=200))
+        self.assertEqual(RateLimiter(self.db_path).admit(), '')
+
+    def test_concurrent_consumers_never_overspend(self):
+        """Test that racing threads can't take more tokens than the burst."""
+        limiter = RateLimiter(self.db_path, rate=0.001, burst=50)
+        allowed = []
+
+        def worker():
+            for _ in range(20):
+                if limiter.consume('a') == 0:
+                    allowed.append(1)
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(allowed), 50)
+
+    def test_decisions_are_fast(self):
+        """Test that a check stays well under a millisecond or so."""
+        limiter = RateLimiter(self.db_path, rate=1000, burst=1000, max_inflight=10)
+        start = time.perf_counter()
+        for _ in range(200):
+            limiter.consume('a')
+            limiter.release(limiter.admit())
+        self.assertLess((time.perf_counter() - start) / 200, 0.005)
+
+    def test_retry_after_header(self):
+        self.assertEqual(retry_after_header(0.2), '1')
+        self.assertEqual(retry_after_header(4.1), '5')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import io
+import os
+import shutil
+import tempfile
+from result_cache import ResultCache, hash_stream, make_key
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        """Set up test fixtures."""
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.test_dir, 'cache.sqlite3')
+
+    def tearDown(self):
+        """Clean up test directory."""
+        shutil.rmtree(self.test_dir)
+
+    def write_output(self, name, size):
+        path = os.path.join(self.test_dir, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def test_hash_stream_rewinds(self):
+        """Test that hashing leaves the stream ready to be read again."""
+        stream = io.BytesIO(b'image bytes')
+        first = hash_stream(stream)
+        self.assertEqual(stream.read(), b'image bytes')
+        stream.seek(0)
+        self.assertEqual(hash_stream(stream), first)
+
+    def test_key_depends_on_format_and_options(self):
+        """Test that the key changes with target format and encoder options."""
+        key = make_key('abc', 'PNG')
+        self.assertEqual(key, make_key('abc', 'png'))
+        self.assertNotEqual(key, make_key('abc', 'WEBP'))
+        self.assertNotEqual(key, make_key('abc', 'PNG', {'preset': 'small'}))
+
+    def test_hit_and_miss_counters(self):
+        """Test hit/miss accounting."""
+        cache = ResultCache(self.test_dir, self.db_path)
+        self.assertIsNone(cache.get('k1'))
+        cache.put('k1', self.write_output('k1.png', 10), 'PNG')
+        entry = cache.get('k1')
+        self.assertEqual(entry['filename'], 'k1.png')
+        self.assertEqual(entry['format'], 'PNG')
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_lru_eviction(self):
+        """Test that the least recently used output is evicted over budget."""
+        cache = ResultCache(self.test_dir, self.db_path, max_bytes=25)
+        cache.put('k1', self.write_output('k1.png', 10), 'PNG')
+        cache.put('k2', self.write_output('k2.png', 10), 'PNG')
+        cache.get('k1')
+        cache.put('k3', self.write_output('k3.png', 10), 'PNG')
+
+        self.assertIsNone(cache.get('k2'))
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, 'k2.png')))
+        self.assertIsNotNone(cache.get('k1'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_missing_output_is_a_miss(self):
+        """Test that an output deleted behind the cache's back is not served."""
+        cache = ResultCache(self.test_dir, self.db_path)
+        path = self.write_output('k1.png', 10)
+        cache.put('k1', path, 'PNG')
+        os.remove(path)
+        self.assertIsNone(cache.get('k1'))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_index_persists(self):
+        """Test that a new cache instance picks up the on-disk index."""
+        cache = ResultCache(self.test_dir, self.db_path)
+        cache.put('k1', self.write_output('k1.png', 10), 'PNG')
+        reloaded = ResultCache(self.test_dir, self.db_path)
+        self.assertEqual(reloaded.get('k1')['filename'], 'k1.png')
+
+    def test_workers_share_index_and_budget(self):
+        """Test that caches on the same directory, as in two gunicorn workers, see one index."""
+        first = ResultCache(self.test_dir, self.db_path, max_bytes=25)
+        second = ResultCache(self.test_dir, self.db_path, max_bytes=25)
+        first.put('k1', self.write_output('k1.png', 10), 'PNG', dimensions=[4, 3])
+        second.put('k2', self.write_output('k2.png', 10), 'PNG')
+        self.assertEqual(first.get('k2')['filename'], 'k2.png')
+        self.assertEqual(second.get('k1')['dimensions'], [4, 3])
+
+        # k1 was used last, so a third output pushes k2 out for both
+        first.put('k3', self.write_output('k3.png', 10), 'PNG')
+        self.assertIsNone(second.get('k2'))
+        self.assertEqual(second.stats()['bytes'], 20)
+        second.discard('k1.png')
+        self.assertIsNone(first.get('k1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import io
+from PIL import Image  # type: ignore
+from sniff import SniffingStream, UploadRejected, sniff
+
+
+def encode(fmt, size=(123, 45), mode='RGB', **options):
+    buf = io.BytesIO()
+    Image.new(mode, size).save(buf, fmt, **options)
+    return buf.getvalue()
+
+
+class TestSniff(unittest.TestCase):
+    def test_identifies_format_and_size(self):
+        """Test that common formats are identified from their header."""
+        for fmt, ext in [('PNG', 'png'), ('JPEG', 'jpg'), ('GIF', 'gif'), ('TIFF', 'tiff'), ('TGA', 'tga')]:
+            with self.subTest(fmt=fmt):
+                self.assertEqual(sniff(encode(fmt)[:4096], f'a.{ext}'), {'format': fmt, 'size': (123, 45)})
+
+    def test_webp_size_without_full_file(self):
+        """Test that lossy and lossless WEBP dimensions come from the header alone."""
+        for options in ({'quality': 50}, {'lossless': True}):
+            with self.subTest(options=options):
+                info = sniff(encode('WEBP', **options)[:64], 'a.webp')
+                self.assertEqual(info['size'], (123, 45))
+
+    def test_waits_for_more_header(self):
+        """Test that a truncated header asks for more bytes instead of deciding."""
+        self.assertIsNone(sniff(encode('JPEG')[:10], 'a.jpg'))
+
+    def test_imagemagick_only_formats(self):
+        """Test formats identified by signature alone."""
+        self.assertEqual(sniff(b'%PDF-1.7\n...', 'a.pdf', complete=True)['format'], 'PDF')
+        self.assertEqual(sniff(b'<?xml version="1.0"?>\n<svg xmlns="..."/>', 'a.svg', complete=True)['format'], 'SVG')
+        self.assertEqual(sniff(b'\x00\x00\x00\x18ftypheic', 'a.heic', complete=True)['format'], 'HEIC')
+        self.assertEqual(sniff(b'arbitrary camera data', 'a.raw', complete=True)['format'], None)
+
+    def test_rejects_mislabeled(self):
+        """Test that content not matching the extension is rejected."""
+        with self.assertRaises(UploadRejected) as ctx:
+            sniff(encode('PNG'), 'a.jpg')
+        self.assertEqual(ctx.exception.status, 415)
+
+    def test_stream_holds_header_until_accepted(self):
+        """Test that bytes reach the spool only after the header is accepted."""
+        data = encode('PNG', size=(300, 300), mode='RGBA')
+        target = io.BytesIO()
+        stream = SniffingStream(target, 'a.png')
+        stream.write(data[:8])
+        self.assertEqual(target.getvalue(), b'')
+        stream.write(data[8:])
+        stream.seek(0)
+        self.assertEqual(stream.read(), data)
+        self.assertEqual(stream.info['size'], (300, 300))
+
+
+if __name__ == '__main__':
+    unittest.main()